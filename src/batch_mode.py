@@ -0,0 +1,118 @@
+"""
+Non-interactive batch mode, running CLI commands from a file or stdin.
+
+The whole batch runs on the session's one connection in a single transaction. Each command
+gets a savepoint: when a command commits, its work is kept in the batch, and when it rolls
+back, only that command is undone. The batch commits once, at the end. Concurrent batches
+("query batch", "generate_report all") run on other pooled connections, so they don't see
+the batch's changes until it has committed.
+
+Locks are held until then too. An item checked out or returned in a batch stays locked until
+the whole batch finishes, and other desks are told it is being handled at another desk.
+Keep circulation batches short, or split them into several batches.
+
+Each command prints one JSON line with its status, time and output, and a summary line
+follows the last command.
+"""
+
+import io
+import json
+import time
+import psycopg2
+from contextlib import redirect_stdout
+from psycopg2 import extensions
+
+class BatchConnection:
+    """
+    The session's connection, with commit and rollback scoped to the running command's savepoint.
+    The commands catch and print their own errors, so a rollback out of a failed statement is
+    what marks a command as failed. Rollbacks that only discard work, like profile's, don't.
+    """
+    def __init__(self, connection):
+        self.connection = connection
+        self.failed = False
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+    def savepoint(self, statement):
+        cursor = self.connection.cursor()
+        cursor.execute(statement)
+        cursor.close()
+
+    def begin(self):
+        self.failed = False
+        self.savepoint("SAVEPOINT batch_command")
+
+    def commit(self):
+        # Keep the command's work so far, a later rollback only undoes what comes after
+        self.savepoint("RELEASE SAVEPOINT batch_command; SAVEPOINT batch_command")
+
+    def rollback(self):
+        if self.connection.get_transaction_status() == extensions.TRANSACTION_STATUS_INERROR:
+            self.failed = True
+        self.savepoint("ROLLBACK TO SAVEPOINT batch_command")
+
+    def end(self):
+        """Finish the running command, undoing it if it left the transaction aborted. Returns whether it failed."""
+        if self.connection.get_transaction_status() == extensions.TRANSACTION_STATUS_INERROR:
+            self.rollback()
+        self.savepoint("RELEASE SAVEPOINT batch_command")
+        return self.failed
+
+def read_commands(command_file):
+    """Yield (line number, command) for each line of a command file, skipping blanks and # comments."""
+    for number, line in enumerate(command_file, start=1):
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield number, line
+
+def run_batch(connection, commands, handle_command, out):
+    """
+    Run (line number, command) pairs through handle_command(connection, command), which
+    returns a status, writing a JSON result per command to out. Stops at quit. Returns the
+    number of commands that didn't succeed.
+    """
+    batch = BatchConnection(connection)
+    start = time.perf_counter()
+    count = failed = 0
+
+    for number, command in commands:
+        command_start = time.perf_counter()
+        output = io.StringIO()
+        try:
+            batch.begin()
+            with redirect_stdout(output):
+                status = handle_command(batch, command)
+            if batch.end():
+                status = "error"
+        except psycopg2.Error as e:
+            # The command ended the transaction itself (e.g. an executed COMMIT), carry on in a new one
+            connection.rollback()
+            output.write(f"Batch transaction lost: {e}\n")
+            status = "error"
+        except Exception as e:
+            batch.rollback()
+            batch.end()
+            output.write(f"{e}\n")
+            status = "error"
+
+        if status == "quit":
+            break
+        count += 1
+        failed += status != "ok"
+        print(json.dumps({
+            'line': number,
+            'command': command,
+            'status': status,
+            'ms': round((time.perf_counter() - command_start) * 1000, 1),
+            'output': output.getvalue().splitlines(),
+        }), file=out, flush=True)
+
+    connection.commit()
+    print(json.dumps({
+        'commands': count,
+        'failed': failed,
+        'ms': round((time.perf_counter() - start) * 1000, 1),
+    }), file=out, flush=True)
+    return failed
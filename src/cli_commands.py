@@ -1,7 +1,50 @@
 import os
+import time
+import uuid
+import shlex
+from psycopg2 import errors
+import query_registry
+import report_export
+import query_profile
+import latency_stats
+import concurrent_runner
+from result_cache import ResultCache
 
 # Every function must accept connection, active_user and args as parameters. args may be None type
 
+# Rows pulled from the server per round trip when streaming results
+FETCH_SIZE = 2000
+
+# Output options accepted after any query or report, e.g. "query borrowing_history_report --limit 50"
+OUTPUT_OPTIONS = {'--limit': 'limit', '--fetch-size': 'fetch_size', '--page': 'page_size'}
+
+# Results of the canned queries and reports, shared by the whole CLI session
+RESULT_CACHE = ResultCache()
+
+# Seconds a query's result is served from the cache, by query name. Loans change all day, the
+# catalog and the long term statistics hardly at all. 0 never caches
+CACHE_TTLS = {
+    'currently_checked_out'           : 30,
+    'books_due_soon'                  : 30,
+    'members_with_overdue_books'      : 30,
+    'clients_exceeding_borr_lims'     : 30,
+    'trans_history'                   : 30,
+    'check_client'                    : 30,
+    'available_books_by_genre'        : 30,
+    'books_of_year'                   : 3600,
+    'books_by_author'                 : 3600,
+    'avg_borrow_time_by_genre'        : 600,
+    'frequent_borrowers_by_genre'     : 600,
+    'frequent_borrowed_items_by_type' : 600,
+    'never_late_clients'              : 600,
+    'avg_loan_duration'               : 600,
+    'member_engagement'               : 600,
+}
+DEFAULT_CACHE_TTL = 60
+
+# Pool batches check their connections out of, set by main()
+CONNECTION_POOL = None
+
 def library_help(connection, active_user, input_string):
     """Displays the helper text"""
     helper_text = """
@@ -10,8 +53,20 @@ def library_help(connection, active_user, input_string):
     quit    : close the session and exit
     clear   : clear the screen
     execute : execute an arbitrary PostgreSQL command (requires admin privileges)
+    checkout: checkout <item_id> lends an item to the active user
+    return  : return <item_id> checks an item back in
+    cache   : "cache stats" shows result cache hits and misses, "cache clear" empties it
+    profile : profile <query or report> [arguments] runs it under EXPLAIN ANALYZE and marks the
+              costliest plan nodes (requires admin privileges)
+    stats   : latency percentiles and rows of every query and report run, "stats clear" resets them
+    export  : export <query or report> [arguments] <file.csv | directory.parquet> writes a result
+              to CSV, or to Parquet part files (needs pyarrow) (requires admin privileges)
     query   : executes pre-baked queries. Use "query help" to see options
     generate_report : generates pre-baked reports. Use "generate_report help" to see options
+              both accept --limit N (stop after N rows), --fetch-size N (rows per round trip)
+              and --page N (pause every N rows)
+              "generate_report all" and "query batch <query>, <query>, ..." run several at
+              once on their own connections
     """
     print(helper_text)
 
@@ -29,6 +84,14 @@ def execute_postgresql(connection, active_user, input_string):
 
     command = input_string
 
+    # Anything run here may change data the cached results were read from
+    RESULT_CACHE.invalidate()
+
+    # A single SELECT is streamed instead of fetched whole
+    if command.strip().lower().startswith("select") and ';' not in command.strip().rstrip(';'):
+        stream_results(connection, active_user, command)
+        return
+
     try:
         cursor = connection.cursor()
 
@@ -36,10 +99,9 @@ def execute_postgresql(connection, active_user, input_string):
         cursor.execute(command)
         connection.commit()
 
-        # Fetch and display results if it's a SELECT query
-        if command.strip().lower().startswith("select"):
-            results = cursor.fetchall()
-            for row in results:
+        # Fetch and display results if the (last) statement returned any
+        if cursor.description:
+            for row in cursor.fetchall():
                 print(row)
 
         print("SQL command executed successfully.")
@@ -47,8 +109,442 @@ def execute_postgresql(connection, active_user, input_string):
     except Exception as e:
         print(f"Error executing SQL command: {e}")
 
+def parse_output_options(args):
+    """Split the output options off a command's arguments, returning (arguments, options). Raises ValueError."""
+    remaining, options = [], {}
+    args = iter(args)
+    for arg in args:
+        if arg not in OUTPUT_OPTIONS:
+            remaining.append(arg)
+            continue
+        value = next(args, None)
+        if value is None or not value.isnumeric() or int(value) == 0:
+            raise ValueError(f"{arg} needs a positive number")
+        options[OUTPUT_OPTIONS[arg]] = int(value)
+    return remaining, options
+
+def fetch_batches(cursor, limit=None, fetch_size=FETCH_SIZE):
+    """Yield a cursor's rows fetch_size at a time, stopping after limit rows."""
+    count = 0
+    while limit is None or count < limit:
+        rows = cursor.fetchmany(fetch_size if limit is None else min(fetch_size, limit - count))
+        if not rows:
+            return
+        count += len(rows)
+        yield rows
+
+def print_rows(batches, start, page_size=None, keep=False):
+    """
+    Print batches of rows as they arrive. With page_size, wait for Enter after each page.
+    Returns (rows printed, seconds to the first row, rows kept). With keep, the rows are kept
+    for the result cache, unless there are too many or printing was stopped early.
+    """
+    count = 0
+    first_row = None
+    kept = [] if keep else None
+    for rows in batches:
+        if first_row is None:
+            first_row = time.perf_counter() - start
+        if kept is not None:
+            kept.extend(rows)
+            if len(kept) > RESULT_CACHE.max_rows:
+                kept = None
+
+        for row in rows:
+            print(row)
+            count += 1
+            if page_size and count % page_size == 0 and input("-- more (Enter, or q to stop) --").strip().lower() == 'q':
+                return count, first_row, None
+    return count, first_row, kept
+
+def print_timing(count, first_row, start, limit=None, cached_age=None):
+    """Summary line printed after a result set."""
+    more = " (limit reached)" if limit is not None and count >= limit else ""
+    first = f"first row after {first_row * 1000:.0f} ms, " if first_row is not None else ""
+    cached = f", cached {cached_age:.0f} s ago" if cached_age is not None else ""
+    print(f"{count} rows{more}, {first}{(time.perf_counter() - start) * 1000:.0f} ms total{cached}")
+
+def cache_key(name, args, options):
+    """Cache key of a query run. The limit changes the rows, fetch size and paging don't."""
+    return (name, tuple(args), options.get('limit'))
+
+def serve_cached(key, options):
+    """Print a live cached result for key, returning whether there was one."""
+    cached = RESULT_CACHE.get(key)
+    if cached is None:
+        return False
+
+    rows, age = cached
+    start = time.perf_counter()
+    count, first_row, _ = print_rows([rows], start, options.get('page_size'))
+    print_timing(count, first_row, start, options.get('limit'), age)
+    return True
+
+def store_result(key, rows):
+    if key is not None and rows is not None:
+        RESULT_CACHE.put(key, rows, CACHE_TTLS.get(key[0], DEFAULT_CACHE_TTL))
+
+def stream_results(connection, active_user, query, options=None, cache_name=None):
+    """
+    Run a SELECT through a named (server side) cursor, printing rows as they arrive so client
+    memory stays bounded by the fetch size however large the result is. With a cache_name,
+    a live cached result is printed instead and a fresh one is cached if it is small enough.
+    """
+    options = options or {}
+    key = cache_key(cache_name, (), options) if cache_name else None
+    if key and serve_cached(key, options):
+        return
+    stream_query(connection, query, options, key)
+
+def stream_query(connection, query, options, key=None):
+    limit = options.get('limit')
+    try:
+        start = time.perf_counter()
+        cursor = connection.cursor(name=f"stream_{uuid.uuid4().hex}")
+        cursor.execute(query.strip().rstrip(';'))
+
+        count, first_row, rows = print_rows(fetch_batches(cursor, limit, options.get('fetch_size', FETCH_SIZE)),
+                                            start, options.get('page_size'), keep=key is not None)
+
+        # Closing the cursor early also stops the server producing rows past the limit
+        cursor.close()
+        connection.commit()
+        print_timing(count, first_row, start, limit)
+        record_latency(key, start, count, options)
+        store_result(key, rows)
+    except Exception as e:
+        connection.rollback()
+        print(f"Error executing SQL command: {e}")
+
+def execute_prepared(connection, active_user, name, args, options=None):
+    """
+    Run a registered query with its arguments, as a prepared statement on this connection.
+    These return few rows, so they skip the server side cursor and its extra round trips.
+    """
+    options = options or {}
+    try:
+        # Aliases share their entries with the query they stand for
+        resolved, _, values = query_registry.resolve(name, args)
+        key = cache_key(resolved, values, options)
+        if serve_cached(key, options):
+            return
+
+        start = time.perf_counter()
+        cursor = connection.cursor()
+        try:
+            query_registry.execute(cursor, name, args)
+        except errors.InvalidSqlStatementName:
+            # The session lost its prepared statements (e.g. DISCARD ALL), prepare again
+            connection.rollback()
+            # The registry is keyed on the psycopg2 connection, which a batch wraps
+            query_registry.forget(cursor.connection)
+            query_registry.execute(cursor, name, args)
+        connection.commit()
+
+        count, first_row, rows = print_rows(fetch_batches(cursor, options.get('limit'), options.get('fetch_size', FETCH_SIZE)),
+                                            start, options.get('page_size'), keep=True)
+        print_timing(count, first_row, start, options.get('limit'))
+        record_latency(key, start, count, options)
+        store_result(key, rows)
+        cursor.close()
+    except ValueError as e:
+        print(e)
+    except Exception as e:
+        connection.rollback()
+        print(f"Error executing SQL command: {e}")
+
+def rebuild_fee_totals(connection):
+    """Recompute the fee report totals from Fee_Ledger, correcting any that drifted."""
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT rebuild_fee_totals()")
+        corrected = cursor.fetchone()[0]
+        connection.commit()
+        cursor.close()
+    except Exception as e:
+        connection.rollback()
+        print(f"Error rebuilding fee totals: {e}")
+        return
+
+    print(f"Rebuilt the fee totals, {corrected} corrected")
+    if corrected:
+        RESULT_CACHE.invalidate()
+
+def accrue_fees(connection, force=False):
+    """
+    Accrue the late fees of loans still out in Fee_Ledger up to today, returning the number
+    of loans accrued, or None if it failed. Does nothing if already done today unless forced.
+    """
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT accrue_open_loan_fees(%s)", (force,))
+        accrued = cursor.fetchone()[0]
+        connection.commit()
+        cursor.close()
+    except Exception as e:
+        connection.rollback()
+        print(f"Error accruing late fees: {e}")
+        return None
+
+    if accrued:
+        RESULT_CACHE.invalidate()
+    return accrued
+
+def ensure_partitions(connection):
+    """
+    Create Transaction's monthly partitions for the months ahead, if it is partitioned. The DDL
+    only runs when it changes, so this is run at startup and by the nightly accrual instead.
+    """
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT ensure_transaction_partitions()")
+        created = cursor.fetchone()[0]
+        connection.commit()
+        cursor.close()
+        if created:
+            print(f"Created {created} Transaction partitions")
+    except Exception as e:
+        connection.rollback()
+        print(f"Error creating Transaction partitions: {e}")
+
+def ledger_report(connection, active_user, report, options=None, cache_name=None):
+    """Run a report reading Fee_Ledger or the fee totals, accruing open loan fees first if that hasn't happened today."""
+    if accrue_fees(connection) is None:
+        return
+    stream_results(connection, active_user, report, options, cache_name)
+
+def checkout(connection, active_user, input_string):
+    """Lend an item to the active user, in one call to checkout_item()"""
+    command = input_string.split()
+    if len(command) != 2 or not command[1].isnumeric():
+        print("Usage: checkout <item_id>")
+        return
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT * FROM checkout_item(%s, %s)", (int(active_user), int(command[1])))
+        transaction_id, expected_return_date = cursor.fetchone()
+        connection.commit()
+        cursor.close()
+        RESULT_CACHE.invalidate()
+        print(f"Checked out item {command[1]} to client {active_user} (transaction {transaction_id}), due {expected_return_date:%Y-%m-%d}")
+    except errors.LockNotAvailable:
+        connection.rollback()
+        print(f"Item {command[1]} is being checked out or returned at another desk, try again")
+    except errors.RaiseException as e:
+        connection.rollback()
+        print(e.diag.message_primary)
+    except Exception as e:
+        connection.rollback()
+        print(f"Error checking out item {command[1]}: {e}")
+
+def return_item(connection, active_user, input_string):
+    """Check an item back in, in one call to return_item()"""
+    command = input_string.split()
+    if len(command) != 2 or not command[1].isnumeric():
+        print("Usage: return <item_id>")
+        return
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT * FROM return_item(%s)", (int(command[1]),))
+        returned = cursor.fetchall()
+        connection.commit()
+        cursor.close()
+        RESULT_CACHE.invalidate()
+        for transaction_id, client_id, days_late, fee in returned:
+            late = f"{days_late} days late, ${fee:.2f} late fee" if days_late else "on time"
+            print(f"Returned item {command[1]} from client {client_id} (transaction {transaction_id}), {late}")
+    except errors.LockNotAvailable:
+        connection.rollback()
+        print(f"Item {command[1]} is being checked out or returned at another desk, try again")
+    except errors.RaiseException as e:
+        connection.rollback()
+        print(e.diag.message_primary)
+    except Exception as e:
+        connection.rollback()
+        print(f"Error returning item {command[1]}: {e}")
+
+def cache(connection, active_user, input_string):
+    """Show the result cache statistics, or clear it"""
+    command = input_string.split()
+    match command[1] if len(command) > 1 else "stats":
+        case "stats":
+            stats = RESULT_CACHE.stats()
+            print(f"Result cache: {stats['entries']} entries ({stats['rows']} rows), "
+                  f"{stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate), "
+                  f"{stats['evictions']} evicted, {stats['invalidations']} invalidations")
+        case "clear":
+            RESULT_CACHE.invalidate()
+            print("Result cache cleared.")
+        case _:
+            print(f"No cache command for {command[1]}, use stats or clear")
+
+def canned_query_text(cursor, name, args):
+    """SQL of a canned query or report, registered queries with their arguments bound. Raises ValueError."""
+    if name in query_registry.QUERIES or name in query_registry.ALIASES:
+        return query_registry.render(cursor, name, args)
+    if name in EXPORTS and not args:
+        return EXPORTS[name]
+    raise ValueError(f"No query or report is available for {' '.join([name] + args)}")
+
+def profile(connection, active_user, input_string):
+    """
+    Run a canned query or report under EXPLAIN (ANALYZE, BUFFERS) and print its plan with
+    the nodes that took the most time marked.
+    """
+    try:
+        command = shlex.split(input_string)
+    except ValueError as e:
+        print(f"Could not parse profile arguments: {e}")
+        return
+
+    if len(command) < 2:
+        print("Usage: profile <query or report> [arguments]")
+        return
+
+    try:
+        cursor = connection.cursor()
+        report = canned_query_text(cursor, command[1], command[2:])
+        cursor.close()
+
+        if command[1] in FEE_REPORTS:
+            accrue_fees(connection)
+
+        for line in query_profile.format_profile(query_profile.explain_analyze(connection, report)):
+            print(line)
+    except ValueError as e:
+        print(e)
+    except Exception as e:
+        connection.rollback()
+        print(f"Error profiling {command[1]}: {e}")
+
+def stats(connection, active_user, input_string):
+    """Show the latency percentiles recorded for the canned queries and reports, or reset them"""
+    command = input_string.split()
+    if len(command) > 1 and command[1] == "clear":
+        latency_stats.clear()
+        print("Latency statistics cleared.")
+        return
+
+    rows = latency_stats.summary()
+    if not rows:
+        print("No queries recorded yet.")
+        return
+
+    print(f"{'query':<32} {'runs':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} {'avg rows':>9}")
+    for name, runs, p50, p95, p99, slowest, average_rows in rows:
+        print(f"{name:<32} {runs:>6} {p50:>9.1f} {p95:>9.1f} {p99:>9.1f} {slowest:>9.1f} {average_rows:>9.0f}")
+
+def record_latency(key, start, count, options):
+    """Count a run of a canned query into its latency histogram. Paged runs include the reader's pauses, so they're left out."""
+    if key is not None and not options.get('page_size'):
+        latency_stats.record(key[0], time.perf_counter() - start, count)
+
+def export(connection, active_user, input_string):
+    """
+    Write a canned query or report to a CSV file or a directory of Parquet parts. Streamed
+    through COPY, so it works for results of any size.
+    """
+    try:
+        command = shlex.split(input_string)
+    except ValueError as e:
+        print(f"Could not parse export arguments: {e}")
+        return
+
+    if len(command) < 3:
+        print("Usage: export <query or report> [arguments] <file.csv | directory.parquet>")
+        return
+
+    name, args, path = command[1], command[2:-1], command[-1]
+    if not path.endswith(('.csv', '.parquet')):
+        print("Export to a .csv file or a .parquet directory")
+        return
+
+    try:
+        cursor = connection.cursor()
+        report = canned_query_text(cursor, name, args)
+
+        if name in FEE_REPORTS:
+            accrue_fees(connection)
+
+        start = time.perf_counter()
+        if path.endswith('.csv'):
+            report_export.export_csv(cursor, report, path)
+            written = f"{cursor.rowcount} rows"
+        else:
+            written = f"{report_export.export_parquet(cursor, report, path)} parts"
+        connection.commit()
+        cursor.close()
+        print(f"Exported {name} to {path}: {written} in {time.perf_counter() - start:.1f} s")
+    except ValueError as e:
+        print(e)
+    except ImportError as e:
+        connection.rollback()
+        print(f"Parquet export needs pyarrow installed: {e}")
+    except Exception as e:
+        connection.rollback()
+        print(f"Error exporting {name}: {e}")
+
+def split_batch(input_string):
+    """The comma separated commands after "query batch", each as a list of arguments. Raises ValueError."""
+    lexer = shlex.shlex(input_string, posix=True, punctuation_chars=',')
+    lexer.whitespace_split = True
+    commands = [[]]
+    for token in list(lexer)[2:]:
+        if token.strip(','):
+            commands[-1].append(token)
+        else:
+            commands.extend([] for _ in token)
+    return [command for command in commands if command]
+
+def run_canned(connection, active_user, command):
+    """Run one query or report of a batch, given as its name, arguments and output options."""
+    if command[0] == "member_engagement":
+        generate_report(connection, active_user, shlex.join(["generate_report"] + command))
+    else:
+        query(connection, active_user, shlex.join(["query"] + command))
+
+def run_batch(connection, active_user, commands):
+    """
+    Run queries and reports concurrently, each on its own pooled connection, then print their
+    results in the order given with each one's time, so a batch takes about as long as its
+    slowest query rather than all of them back to back.
+    """
+    if CONNECTION_POOL is None:
+        print("Batches need the session's connection pool")
+        return
+    if not commands:
+        print("Request at least one query, e.g. query batch books_due_soon, trans_history 11")
+        return
+    if any('--page' in command for command in commands):
+        print("--page can't be used in a batch, its results are printed once all have run")
+        return
+
+    # Accrue the ledger once here, not in every report that reads it
+    if any(command[0] in FEE_REPORTS for command in commands):
+        accrue_fees(connection)
+
+    start = time.perf_counter()
+    tasks = [(' '.join(command), lambda worker, command=command: run_canned(worker, active_user, command))
+             for command in commands]
+    total = 0
+    for label, output, seconds, error in concurrent_runner.run_concurrently(CONNECTION_POOL, tasks):
+        print(f"== {label} ({seconds * 1000:.0f} ms) ==")
+        for line in output:
+            print(line, end='')
+        if error is not None:
+            print(f"Error running {label}: {error}")
+        total += seconds
+    print(f"{len(tasks)} queries in {(time.perf_counter() - start) * 1000:.0f} ms, {total * 1000:.0f} ms one after another")
+
 def generate_report(connection, active_user, input_string):
-    command = input_string.split(' ')
+    try:
+        command, options = parse_output_options(shlex.split(input_string))
+    except ValueError as e:
+        print(e)
+        return
+
     if len(command) <= 1:
         print("Request a report or help to see options")
         return
@@ -58,36 +554,72 @@ def generate_report(connection, active_user, input_string):
             helper_text = """
             Options:
             member_engagement   : Generates and displays a member engagement report
+            monthly_fees_report : Fees collected for returned items within the last month
+            refresh_fees        : Recomputes the fee totals from the ledger, correcting any that drifted
+            accrue_fees         : Nightly job, creates the coming months' Transaction partitions, accrues
+                                  open loan fees up to today, e.g. from cron:
+                                  echo "generate_report accrue_fees" | LIBDB_ADMIN_PASSWORD=... python src/main.py --batch - --client 1
+            all                 : Runs the end of day reports at once, output options apply to each
             """
             print(helper_text)
+        case "all":
+            flags = [token for flag, key in OUTPUT_OPTIONS.items() if key in options for token in (flag, str(options[key]))]
+            run_batch(connection, active_user, [[report] + flags for report in END_OF_DAY_REPORTS])
         case "member_engagement":
-            execute_postgresql(connection, active_user, member_engagement_report)
+            stream_results(connection, active_user, member_engagement_report, options, cache_name=command[1])
         case "monthly_fees_report":
-            execute_postgresql(connection, active_user, monthly_fees_report)
+            ledger_report(connection, active_user, monthly_fees_report, options, cache_name=command[1])
+        case "refresh_fees":
+            rebuild_fee_totals(connection)
+        case "accrue_fees":
+            ensure_partitions(connection)
+            accrued = accrue_fees(connection)
+            if accrued is not None:
+                print(f"Accrued the late fees of {accrued} open loans")
         case _:
             print(f"No report is available for {command[1]}") 
 
 def query(connection, active_user, input_string):
-    command = input_string.split(' ')
+    # Output options go with each command of a batch, e.g. query batch books_due_soon --limit 5, trans_history 11
+    if input_string.split()[1:2] == ["batch"]:
+        try:
+            commands = split_batch(input_string)
+        except ValueError as e:
+            print(f"Could not parse query arguments: {e}")
+            return
+        run_batch(connection, active_user, commands)
+        return
+
+    # shlex keeps quoted arguments together, e.g. query books_by_author "Stephen King"
+    try:
+        command, options = parse_output_options(shlex.split(input_string))
+    except ValueError as e:
+        print(f"Could not parse query arguments: {e}")
+        return
+
     if len(command) <= 1:
         print("Request a query or help to see options")
         return
+
+    if command[1] in query_registry.QUERIES or command[1] in query_registry.ALIASES:
+        execute_prepared(connection, active_user, command[1], command[2:], options)
+        return
     
     match command[1]:
         case "help":
             helper_text = """
             Options:
-            books_of_2007                   : Gets all the books published in 2007
+            books_of_year <year>            : Gets all the books published in a year (books_of_2007)
             available_horror_digital_media  : Gets all digital media items that are available in the horror genre
-            trans_history_11                : Gets all transactions involving item ID 11
-            avg_borro_time_science_fiction  : Average borrowing time for "Science Fiction" books (in days)
+            trans_history <item_id>         : Gets all transactions involving an item (trans_history_11)
+            avg_borrow_time_by_genre <genre>: Average borrowing time for books in a genre, in days (avg_borro_time_science_fiction)
             most_pop_author_last_month      : Shows the most borrowed author in the last month
             clients_exceeding_borr_lims     : Lists clients who are currently over their borrowing limits
-            check_client_42                 : Checks the status and information of client 42
-            books_by_stephen_king           : Shows all books by Stephen King
+            check_client <client_id>        : Checks the status and information of a client (check_client_42)
+            books_by_author <author>        : Shows all books by an author, quote names with spaces (books_by_stephen_king)
             owed_fines_per_client           : Shows the fines owed by each client
-            book_mystery_availability       : Lists available books in the 'Mystery' genre
-            frequent_borrower_thriller      : Top 5 clients who borrowed the most thrillers this year
+            available_books_by_genre <genre>: Lists available books in a genre (book_mystery_availability)
+            frequent_borrowers_by_genre <genre> : Clients who borrowed the most books in a genre this year (frequent_borrower_romance)
             books_due_soon                  : Books that are due within the next 7 days
             members_with_overdue_books      : Clients who currently have overdue books
             frequent_borrowed_items_by_type : Most borrowed book titles per membership type
@@ -100,53 +632,40 @@ def query(connection, active_user, input_string):
             overdue_items_report            : Report on all currently overdue items and fees
             revenue_summary                 : Total outstanding fees by membership and item category
             monthly_fees_report             : Fees collected for returned items within the last month
+            batch <query>, <query>, ...     : Runs several queries at once, each with its own arguments and options
             """
             
             print(helper_text)
-        case "books_of_2007":
-            execute_postgresql(connection, active_user, books_of_2007)
-        case "trans_history_11":
-            execute_postgresql(connection, active_user, trans_history_11)
-        case "avg_borro_time_science_fiction":
-            execute_postgresql(connection, active_user, avg_borro_time_science_fiction)
         case "most_pop_author_last_month":
-            execute_postgresql(connection, active_user, most_pop_author_last_month)
+            stream_results(connection, active_user, most_pop_author_last_month, options, cache_name=command[1])
         case "clients_exceeding_borr_lims":
-            execute_postgresql(connection, active_user, clients_exceeding_borr_lims)
-        case "check_client_42":
-            execute_postgresql(connection, active_user, check_client_42)
+            stream_results(connection, active_user, clients_exceeding_borr_lims, options, cache_name=command[1])
         case "owed_fines_per_client":
-            execute_postgresql(connection, active_user, owed_fines_per_client)
-        case "books_by_stephen_king":
-            execute_postgresql(connection, active_user, books_by_stephen_king)
-        case "book_mystery_availability":
-            execute_postgresql(connection, active_user, book_mystery_availability)
-        case "frequent_borrower_romance":
-            execute_postgresql(connection, active_user, frequent_borrower_romance)
+            ledger_report(connection, active_user, owed_fines_per_client, options, cache_name=command[1])
         case "books_due_soon":
-            execute_postgresql(connection, active_user, books_due_soon)
+            stream_results(connection, active_user, books_due_soon, options, cache_name=command[1])
         case "members_with_overdue_books":
-            execute_postgresql(connection, active_user, members_with_overdue_books)
+            stream_results(connection, active_user, members_with_overdue_books, options, cache_name=command[1])
         case "frequent_borrowed_items_by_type":
-            execute_postgresql(connection, active_user, frequent_borrowed_items_by_type)
+            stream_results(connection, active_user, frequent_borrowed_items_by_type, options, cache_name=command[1])
         case "never_late_clients":
-            execute_postgresql(connection, active_user, never_late_clients)
+            stream_results(connection, active_user, never_late_clients, options, cache_name=command[1])
         case "avg_loan_duration":
-            execute_postgresql(connection, active_user, avg_loan_duration)
+            stream_results(connection, active_user, avg_loan_duration, options, cache_name=command[1])
         case "monthly_summary_report":
-            execute_postgresql(connection, active_user, monthly_summary_report)           
+            ledger_report(connection, active_user, monthly_summary_report, options, cache_name=command[1])           
         case "borrowing_history_report":
-            execute_postgresql(connection, active_user, borrowing_history_report)
+            ledger_report(connection, active_user, borrowing_history_report, options, cache_name=command[1])
         case "currently_checked_out":
-            execute_postgresql(connection, active_user, currently_checked_out)
+            ledger_report(connection, active_user, currently_checked_out, options, cache_name=command[1])
         case "item_availability_and_history":
-            execute_postgresql(connection, active_user, item_availability_and_history)
+            ledger_report(connection, active_user, item_availability_and_history, options, cache_name=command[1])
         case "overdue_items_report":
-            execute_postgresql(connection, active_user, overdue_items_report)
+            ledger_report(connection, active_user, overdue_items_report, options, cache_name=command[1])
         case "revenue_summary":
-            execute_postgresql(connection, active_user, revenue_summary)
+            ledger_report(connection, active_user, revenue_summary, options, cache_name=command[1])
         case "monthly_fees_report":
-            execute_postgresql(connection, active_user, monthly_fees_report)
+            ledger_report(connection, active_user, monthly_fees_report, options, cache_name=command[1])
         case _:
             print(f"No query is available for {command[1]}")
 
@@ -158,22 +677,8 @@ GROUP BY c.client_id, c.name
 ORDER BY total_transactions DESC;
 """
 
-trans_history_11 = """
-SELECT transaction_id, client_id, date_borrowed, expected_return_date, returned_date
-FROM Transaction
-WHERE item_id = 11;
-"""
-
 # Nifemi
 
-avg_borro_time_science_fiction = """
-SELECT AVG((t.returned_date::date - t.date_borrowed::date)) AS avg_borrow_days
-FROM transaction AS t
-JOIN book AS bo ON t.item_id = bo.item_id
-WHERE bo.genre = 'Science Fiction'
-AND t.returned_date IS NOT NULL;
-"""
-
 most_pop_author_last_month = """
 SELECT
   bo.author,
@@ -188,110 +693,42 @@ LIMIT 1;
 
 # Just fees collected in the last month (excludes not returned/paid)
 monthly_fees_report = """
--- (assuming $0.25 per day late fee)
 SELECT
-  c.membership_type,
-  SUM(
-    GREATEST(
-      (t.returned_date::date - t.expected_return_date::date),
-      0
-    ) * 0.25
-  ) AS total_fees_collected
-FROM transaction AS t
-JOIN client      AS c ON t.client_id = c.client_id
-WHERE t.returned_date::date
+  membership_type,
+  SUM(fees_collected) AS total_fees_collected
+FROM daily_fees -- Late returns only, see Fee_Ledger in libraryDDL.sql
+WHERE returned_day
       BETWEEN CURRENT_DATE - INTERVAL '1 month'
           AND CURRENT_DATE
-GROUP BY c.membership_type;
+GROUP BY membership_type;
 """
 
 clients_exceeding_borr_lims = """
--- (Regular: 5 items, Student: 10, Senior Citizen: 7, Other: 3)
+-- Open loans per client are counted by triggers, the limits live in membership_limit
 SELECT
   c.client_id,
   c.name,
-  COUNT(*) AS current_borrowed,
-  CASE c.membership_type
-    WHEN 'Regular'        THEN 5
-    WHEN 'Student'        THEN 10
-    WHEN 'Senior Citizen' THEN 7
-    ELSE 3
-  END AS borrow_limit
-FROM transaction AS t
-JOIN client      AS c ON t.client_id = c.client_id
-WHERE t.returned_date IS NULL
-GROUP BY c.client_id, c.name, c.membership_type
-HAVING COUNT(*) > CASE c.membership_type
-                    WHEN 'Regular'        THEN 5
-                    WHEN 'Student'        THEN 10
-                    WHEN 'Senior Citizen' THEN 7
-                    ELSE 3
-                  END;
+  n.open_loans AS current_borrowed,
+  l.loan_limit AS borrow_limit
+FROM client_loan_count AS n
+JOIN client            AS c ON n.client_id = c.client_id
+JOIN membership_limit  AS l ON l.membership_type = c.membership_type
+WHERE n.open_loans > l.loan_limit;
 """
 
 # Holden
 
-books_by_stephen_king = """
-SELECT *
-FROM Book
-WHERE author = 'Stephen King';
-"""
-
-books_of_2007 = """
-SELECT *
-FROM Book
-WHERE publication_year = 2007;
-"""
-
-check_client_42 = """
-SELECT *
-FROM Client
-WHERE client_id = 42;
-"""
-
 owed_fines_per_client = """
 SELECT
-  c.client_id,
-  c.name,
-  SUM(
-    GREATEST(
-      (t.returned_date::date - t.expected_return_date::date),
-      0
-    ) * 0.25
-  ) AS total_owed
-FROM transaction AS t
-JOIN client AS c ON t.client_id = c.client_id
-WHERE t.returned_date IS NOT NULL -- Only consider returned items
-  AND t.returned_date > t.expected_return_date
-GROUP BY c.client_id, c.name
-HAVING SUM(GREATEST((t.returned_date::date - t.expected_return_date::date), 0) * 0.25) > 0;
+  client_id,
+  name,
+  total_owed
+FROM client_fines -- Only returned items, see Client_Fines in libraryDDL.sql
+WHERE total_owed > 0;
 """
 
 # Michael
 
-book_mystery_availability = """
-SELECT
-    b.title,
-    b.item_id
-FROM media_item AS m
-JOIN book AS b ON m.item_id = b.item_id
-WHERE b.genre = 'Mystery' AND m.availability_status = 'Available';
-"""
-
-frequent_borrower_romance = """
-SELECT
-    c.client_id,
-    c.name,
-    COUNT(*) AS romance_borrow_count
-FROM transaction AS t
-JOIN media_item AS m ON t.item_id = m.item_id
-JOIN book AS b ON m.item_id = b.item_id
-JOIN client AS c ON t.client_id = c.client_id
-WHERE b.genre = 'Romance' AND (t.date_borrowed >= CURRENT_DATE - INTERVAL '1 year')
-GROUP BY c.client_id, c.name
-ORDER BY romance_borrow_count DESC;
-"""
-
 books_due_soon = """
 SELECT
     b.title,
@@ -361,13 +798,9 @@ SELECT
    FROM transaction
    WHERE date_borrowed >= date_trunc('month', CURRENT_DATE)) AS total_items_loaned,
 
-  (SELECT SUM(
-      GREATEST(
-        (returned_date::date - expected_return_date::date),
-        0
-      ) * 0.25)
-   FROM transaction
-   WHERE returned_date >= date_trunc('month', CURRENT_DATE)) AS total_fees_collected,
+  (SELECT SUM(fees_collected)
+   FROM daily_fees
+   WHERE returned_day >= date_trunc('month', CURRENT_DATE)) AS total_fees_collected,
 
   (SELECT b.title
    FROM transaction AS t
@@ -386,24 +819,18 @@ SELECT
     c.client_id,
     c.name,
     t.transaction_id,
-    mi.item_id,
-    b.title AS book_title,
-    dm.title AS digital_media_title,
-    mg.title AS magazine_title,
+    t.item_id,
+    CASE WHEN ic.category = 'Book' THEN ic.title END AS book_title,
+    CASE WHEN ic.category = 'Digital Media' THEN ic.title END AS digital_media_title,
+    CASE WHEN ic.category = 'Magazine' THEN ic.title END AS magazine_title,
     t.date_borrowed,
     t.expected_return_date,
     t.returned_date,
-    CASE 
-        WHEN t.returned_date IS NULL AND CURRENT_DATE > t.expected_return_date
-        THEN EXTRACT(DAY FROM (CURRENT_DATE - t.expected_return_date)) * 0.25
-        ELSE 0
-    END AS late_fee
+    COALESCE(f.fee, 0) AS late_fee
 FROM Client c
 JOIN Transaction t ON c.client_id = t.client_id
-JOIN Media_Item mi ON t.item_id = mi.item_id
-LEFT JOIN Book b ON mi.item_id = b.item_id
-LEFT JOIN Digital_Media dm ON mi.item_id = dm.item_id
-LEFT JOIN Magazine mg ON mi.item_id = mg.item_id
+LEFT JOIN Item_Catalog ic ON t.item_id = ic.item_id
+LEFT JOIN Fee_Ledger f ON t.transaction_id = f.transaction_id AND f.returned_day IS NULL
 ORDER BY c.client_id, t.date_borrowed DESC;
 """
 
@@ -412,24 +839,18 @@ SELECT DISTINCT
     c.client_id,
     c.name,
     t.transaction_id,
-    mi.item_id,
-    b.title AS book_title,
-    dm.title AS digital_media_title,
-    mg.title AS magazine_title,
+    t.item_id,
+    CASE WHEN ic.category = 'Book' THEN ic.title END AS book_title,
+    CASE WHEN ic.category = 'Digital Media' THEN ic.title END AS digital_media_title,
+    CASE WHEN ic.category = 'Magazine' THEN ic.title END AS magazine_title,
     t.date_borrowed,
     t.expected_return_date,
     t.returned_date,
-    CASE 
-        WHEN t.returned_date IS NULL AND CURRENT_DATE > t.expected_return_date
-        THEN EXTRACT(DAY FROM (CURRENT_DATE - t.expected_return_date)) * 0.25
-        ELSE 0
-    END AS late_fee
+    COALESCE(f.fee, 0) AS late_fee
 FROM Client c
 JOIN Transaction t ON c.client_id = t.client_id
-JOIN Media_Item mi ON t.item_id = mi.item_id
-LEFT JOIN Book b ON mi.item_id = b.item_id
-LEFT JOIN Digital_Media dm ON mi.item_id = dm.item_id
-LEFT JOIN Magazine mg ON mi.item_id = mg.item_id
+LEFT JOIN Item_Catalog ic ON t.item_id = ic.item_id
+LEFT JOIN Fee_Ledger f ON t.transaction_id = f.transaction_id AND f.returned_day IS NULL
 WHERE t.returned_date IS NULL
 ORDER BY c.client_id, t.date_borrowed DESC;
 """
@@ -439,67 +860,81 @@ SELECT
     c.client_id,
     c.name,
     t.transaction_id,
-    mi.item_id,
-    b.title AS book_title,
-    dm.title AS digital_media_title,
-    mg.title AS magazine_title,
+    t.item_id,
+    CASE WHEN ic.category = 'Book' THEN ic.title END AS book_title,
+    CASE WHEN ic.category = 'Digital Media' THEN ic.title END AS digital_media_title,
+    CASE WHEN ic.category = 'Magazine' THEN ic.title END AS magazine_title,
     t.date_borrowed,
     t.expected_return_date,
     t.returned_date,
-    CASE 
-        WHEN t.returned_date IS NULL AND CURRENT_DATE > t.expected_return_date
-        THEN EXTRACT(DAY FROM CURRENT_DATE - t.expected_return_date) * 0.25
-        ELSE 0
-    END AS late_fee
+    COALESCE(f.fee, 0) AS late_fee
 FROM Client c
 JOIN Transaction t ON c.client_id = t.client_id
-JOIN Media_Item mi ON t.item_id = mi.item_id
-LEFT JOIN Book b ON mi.item_id = b.item_id
-LEFT JOIN Digital_Media dm ON mi.item_id = dm.item_id
-LEFT JOIN Magazine mg ON mi.item_id = mg.item_id
+LEFT JOIN Item_Catalog ic ON t.item_id = ic.item_id
+LEFT JOIN Fee_Ledger f ON t.transaction_id = f.transaction_id AND f.returned_day IS NULL
 ORDER BY c.client_id, t.date_borrowed DESC;
 """
 
 overdue_items_report = """
 SELECT
-    c.client_id,
-    c.name,
-    t.transaction_id,
-    mi.item_id,
-    CASE 
-        WHEN b.title IS NOT NULL THEN b.title
-        WHEN dm.title IS NOT NULL THEN dm.title
-        WHEN mg.title IS NOT NULL THEN mg.title
-        ELSE 'Unknown'
-    END AS title,
-    t.date_borrowed,
-    t.expected_return_date,
-    EXTRACT(DAY FROM CURRENT_DATE - t.expected_return_date) * 0.25 AS late_fee
-FROM Transaction t
-JOIN Client c ON t.client_id = c.client_id
-JOIN Media_Item mi ON t.item_id = mi.item_id
-LEFT JOIN Book b ON mi.item_id = b.item_id
-LEFT JOIN Digital_Media dm ON mi.item_id = dm.item_id
-LEFT JOIN Magazine mg ON mi.item_id = mg.item_id
-WHERE t.returned_date IS NULL AND CURRENT_DATE > t.expected_return_date;
+    client_id,
+    name,
+    transaction_id,
+    item_id,
+    title,
+    date_borrowed,
+    expected_return_date,
+    late_fee
+FROM Open_Loans
+WHERE late_fee > 0;
 """
 
 revenue_summary = """
 SELECT
-    c.membership_type,
-    CASE 
-        WHEN b.item_id IS NOT NULL THEN 'Book'
-        WHEN dm.item_id IS NOT NULL THEN 'Digital Media'
-        WHEN mg.item_id IS NOT NULL THEN 'Magazine'
-        ELSE 'Unknown'
-    END AS item_category,
-    SUM(EXTRACT(DAY FROM CURRENT_DATE - t.expected_return_date) * 0.25) AS total_fees
-FROM Transaction t
-JOIN Client c ON t.client_id = c.client_id
-JOIN Media_Item mi ON t.item_id = mi.item_id
-LEFT JOIN Book b ON mi.item_id = b.item_id
-LEFT JOIN Digital_Media dm ON mi.item_id = dm.item_id
-LEFT JOIN Magazine mg ON mi.item_id = mg.item_id
-WHERE t.returned_date IS NULL AND CURRENT_DATE > t.expected_return_date
-GROUP BY c.membership_type, item_category;
+    membership_type,
+    item_category,
+    SUM(late_fee) AS total_fees
+FROM Open_Loans
+WHERE late_fee > 0
+GROUP BY membership_type, item_category;
 """
+
+# Canned queries and reports the export command accepts, by the name they are run with
+EXPORTS = {
+    'member_engagement'               : member_engagement_report,
+    'most_pop_author_last_month'      : most_pop_author_last_month,
+    'clients_exceeding_borr_lims'     : clients_exceeding_borr_lims,
+    'owed_fines_per_client'           : owed_fines_per_client,
+    'books_due_soon'                  : books_due_soon,
+    'members_with_overdue_books'      : members_with_overdue_books,
+    'frequent_borrowed_items_by_type' : frequent_borrowed_items_by_type,
+    'never_late_clients'              : never_late_clients,
+    'avg_loan_duration'               : avg_loan_duration,
+    'monthly_summary_report'          : monthly_summary_report,
+    'borrowing_history_report'        : borrowing_history_report,
+    'currently_checked_out'           : currently_checked_out,
+    'item_availability_and_history'   : item_availability_and_history,
+    'overdue_items_report'            : overdue_items_report,
+    'revenue_summary'                 : revenue_summary,
+    'monthly_fees_report'             : monthly_fees_report,
+}
+
+# Reports reading Fee_Ledger or the totals kept from it, whose open loan fees are accrued before they run
+FEE_REPORTS = {'owed_fines_per_client', 'monthly_summary_report', 'overdue_items_report',
+               'revenue_summary', 'monthly_fees_report', 'borrowing_history_report',
+               'currently_checked_out', 'item_availability_and_history'}
+
+# Run together by "generate_report all"
+END_OF_DAY_REPORTS = [
+    'member_engagement',
+    'monthly_fees_report',
+    'monthly_summary_report',
+    'revenue_summary',
+    'owed_fines_per_client',
+    'overdue_items_report',
+    'members_with_overdue_books',
+    'currently_checked_out',
+    'books_due_soon',
+    'clients_exceeding_borr_lims',
+    'most_pop_author_last_month',
+]
@@ -0,0 +1,66 @@
+"""
+Run several CLI commands at once, each on its own pooled connection.
+
+The commands print their results as usual. While they run, each thread's printing goes to its
+own spool file instead of the terminal, and the results are printed afterwards in the order
+the commands were given, so concurrent reports never interleave. Spooling to disk keeps
+memory flat however many rows the reports print.
+"""
+
+import sys
+import time
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Commands run at once. main()'s pool holds five connections and the session keeps one
+BATCH_WORKERS = 4
+
+class ThreadOutput:
+    """Stand-in for sys.stdout sending each thread's output to the file it set, if any."""
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def target(self):
+        return getattr(self.local, 'spool', None) or self.stream
+
+    def write(self, text):
+        return self.target().write(text)
+
+    def flush(self):
+        self.target().flush()
+
+def run_task(output, pool, task):
+    """Run one command on a pooled connection with its output spooled, returning (spool, seconds, error)."""
+    spool = tempfile.TemporaryFile('w+')
+    output.local.spool = spool
+    start = time.perf_counter()
+    error = None
+    try:
+        with pool.connection() as connection:
+            task(connection)
+    except Exception as e:
+        error = e
+    finally:
+        output.local.spool = None
+    return spool, time.perf_counter() - start, error
+
+def run_concurrently(pool, tasks, workers=BATCH_WORKERS):
+    """
+    Run (label, task) pairs, each task called with its own connection from pool. Yields
+    (label, output, seconds, error) in the order given, as soon as each one and all
+    before it are done.
+    """
+    output = ThreadOutput(sys.stdout)
+    sys.stdout = output
+    try:
+        with ThreadPoolExecutor(max_workers=min(workers, len(tasks)) or 1) as executor:
+            futures = [(label, executor.submit(run_task, output, pool, task)) for label, task in tasks]
+            for label, future in futures:
+                spool, seconds, error = future.result()
+                spool.seek(0)
+                yield label, spool, seconds, error
+                spool.close()
+    finally:
+        sys.stdout = output.stream
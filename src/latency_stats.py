@@ -0,0 +1,152 @@
+"""
+Latency histograms for the canned queries and reports, persisted across CLI sessions.
+
+Every run that reaches the database is counted into fixed, roughly logarithmic millisecond
+buckets per query name, along with the rows it returned. Percentiles are read back from the
+buckets, interpolating within one, so the file stays a few hundred bytes per query however
+many runs it has seen.
+
+Runs are counted in memory and merged into the file every FLUSH_SECONDS, before a summary
+and at exit. Each merge holds a lock file, so CLI sessions sharing the file add to each
+other's counts instead of overwriting them.
+"""
+
+import os
+import json
+import time
+import atexit
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+STATS_PATH = ".libdb_latency.json"
+
+# Longest a run stays only in memory before it is merged into the file
+FLUSH_SECONDS = 30
+
+# Upper bounds of the latency buckets in milliseconds, one more bucket catches the rest
+BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000]
+
+# Queries can run on several threads at once, the pending counts and the file are only touched under this
+_lock = threading.Lock()
+
+# Runs not yet merged into the file, per path, and when each path was last merged
+_pending = {}
+_flushed_at = {}
+
+class FileLock:
+    """Exclusive lock on path + ".lock", held across processes for the with block."""
+    def __init__(self, path):
+        self.path = path + ".lock"
+
+    def __enter__(self):
+        self.file = open(self.path, 'a+')
+        if fcntl:
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, *exc):
+        if not fcntl:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.file.close()
+
+def load(path=STATS_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as stats_file:
+        return json.load(stats_file)
+
+def save(stats, path=STATS_PATH):
+    # A temporary file per process, the lock file orders the replaces
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'w') as stats_file:
+        json.dump(stats, stats_file)
+    os.replace(temporary, path)
+
+def empty_entry():
+    return {'buckets': [0] * (len(BUCKETS_MS) + 1), 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'rows': 0}
+
+def merge(entry, other):
+    """Add the runs counted in other into entry."""
+    entry['buckets'] = [a + b for a, b in zip(entry['buckets'], other['buckets'])]
+    entry['count'] += other['count']
+    entry['total_ms'] += other['total_ms']
+    entry['max_ms'] = max(entry['max_ms'], other['max_ms'])
+    entry['rows'] += other['rows']
+
+def _flush(path):
+    """Merge the pending runs for path into the file. Call with _lock held."""
+    pending = _pending.pop(path, None)
+    _flushed_at[path] = time.monotonic()
+    if not pending:
+        return
+
+    with FileLock(path):
+        stats = load(path)
+        for name, entry in pending.items():
+            merge(stats.setdefault(name, empty_entry()), entry)
+        save(stats, path)
+
+def flush(path=STATS_PATH):
+    """Write the runs counted so far to the file."""
+    with _lock:
+        _flush(path)
+
+def flush_all():
+    with _lock:
+        for path in list(_pending):
+            _flush(path)
+
+atexit.register(flush_all)
+
+def record(name, seconds, rows, path=STATS_PATH):
+    """Count one run of a query."""
+    milliseconds = seconds * 1000
+    bucket = next((i for i, bound in enumerate(BUCKETS_MS) if milliseconds <= bound), len(BUCKETS_MS))
+
+    with _lock:
+        entry = _pending.setdefault(path, {}).setdefault(name, empty_entry())
+        entry['buckets'][bucket] += 1
+        entry['count'] += 1
+        entry['total_ms'] += milliseconds
+        entry['max_ms'] = max(entry['max_ms'], milliseconds)
+        entry['rows'] += rows
+
+        if time.monotonic() - _flushed_at.setdefault(path, time.monotonic()) >= FLUSH_SECONDS:
+            _flush(path)
+
+def percentile(entry, fraction):
+    """Estimate a latency percentile in milliseconds from an entry's buckets."""
+    rank = fraction * entry['count']
+    seen = 0
+    for i, count in enumerate(entry['buckets']):
+        if count and seen + count >= rank:
+            lower = BUCKETS_MS[i - 1] if i > 0 else 0
+            upper = BUCKETS_MS[i] if i < len(BUCKETS_MS) else entry['max_ms']
+            return min(lower + (upper - lower) * (rank - seen) / count, entry['max_ms'])
+        seen += count
+    return entry['max_ms']
+
+def summary(path=STATS_PATH):
+    """(name, runs, p50, p95, p99, max, average rows) per query, slowest p95 first."""
+    flush(path)
+    rows = []
+    for name, entry in load(path).items():
+        rows.append((name, entry['count'], percentile(entry, 0.50), percentile(entry, 0.95),
+                     percentile(entry, 0.99), entry['max_ms'], entry['rows'] / entry['count']))
+    return sorted(rows, key=lambda row: row[3], reverse=True)
+
+def clear(path=STATS_PATH):
+    with _lock:
+        _pending.pop(path, None)
+        with FileLock(path):
+            if os.path.exists(path):
+                os.remove(path)
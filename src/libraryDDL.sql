@@ -22,6 +22,10 @@ The tables that will need to be created are:
     Something to consider?
 */
 
+-- Schema version: 9
+-- Bump this with every change to the file. The CLI compares it (and a fingerprint of the file)
+-- with Schema_Version at startup and only runs this file when they differ.
+
 -- Define ENUMs
 DO $$
 BEGIN
@@ -87,6 +91,30 @@ CREATE TABLE IF NOT EXISTS Magazine (
     issue_number INT NOT NULL
 );
 
+-- Transaction can optionally be range partitioned by date_borrowed, one partition per month.
+-- Run this file with "SET libdb.partition_transactions = 'on'" to create it that way (see
+-- fill_db.create_tables). The primary key then has to include the partition key. Rows outside
+-- every monthly partition land in Transaction_Default until ensure_transaction_partitions()
+-- moves them out. An existing unpartitioned Transaction is left as it is.
+DO $$
+BEGIN
+    IF current_setting('libdb.partition_transactions', true) = 'on' AND to_regclass('transaction') IS NULL THEN
+        CREATE TABLE Transaction (
+            transaction_id SERIAL CHECK (transaction_id >= 0),
+            client_id INT NOT NULL,
+            FOREIGN KEY (client_id) REFERENCES Client(client_id),
+            item_id INT NOT NULL,
+            FOREIGN KEY (item_id) REFERENCES Media_Item(item_id),
+            date_borrowed TIMESTAMP NOT NULL,
+            expected_return_date TIMESTAMP NOT NULL CHECK (expected_return_date > date_borrowed),
+            returned_date TIMESTAMP CHECK (returned_date IS NULL OR returned_date > date_borrowed),
+            PRIMARY KEY (transaction_id, date_borrowed)
+        ) PARTITION BY RANGE (date_borrowed);
+
+        CREATE TABLE Transaction_Default PARTITION OF Transaction DEFAULT;
+    END IF;
+END $$;
+
 CREATE TABLE IF NOT EXISTS Transaction (
     transaction_id SERIAL PRIMARY KEY CHECK (transaction_id >= 0),
     client_id INT NOT NULL,
@@ -96,4 +124,799 @@ CREATE TABLE IF NOT EXISTS Transaction (
     date_borrowed TIMESTAMP NOT NULL,
     expected_return_date TIMESTAMP NOT NULL CHECK (expected_return_date > date_borrowed),
     returned_date TIMESTAMP CHECK (returned_date IS NULL OR returned_date > date_borrowed)
-);
\ No newline at end of file
+);
+-- Indexes for the circulation queries in cli_commands.py
+-- Loan history per item and per client
+CREATE INDEX IF NOT EXISTS transaction_item_id_idx ON Transaction (item_id, date_borrowed);
+CREATE INDEX IF NOT EXISTS transaction_client_id_idx ON Transaction (client_id, date_borrowed);
+
+-- Date range reports (last month, this month, this year)
+CREATE INDEX IF NOT EXISTS transaction_date_borrowed_idx ON Transaction (date_borrowed);
+CREATE INDEX IF NOT EXISTS transaction_returned_date_idx ON Transaction (returned_date);
+
+-- Open loans are a small slice of the history, these only index the unreturned rows
+CREATE INDEX IF NOT EXISTS transaction_open_due_idx ON Transaction (expected_return_date) WHERE returned_date IS NULL;
+CREATE INDEX IF NOT EXISTS transaction_open_client_idx ON Transaction (client_id, expected_return_date) WHERE returned_date IS NULL;
+
+-- Catalog lookups
+CREATE INDEX IF NOT EXISTS book_author_idx ON Book (author);
+CREATE INDEX IF NOT EXISTS book_genre_idx ON Book (genre);
+CREATE INDEX IF NOT EXISTS book_publication_year_idx ON Book (publication_year);
+CREATE INDEX IF NOT EXISTS digital_media_genre_idx ON Digital_Media (genre);
+
+-- Item catalog
+-- One row per media item with what the reports show about it, so a report finds an item's
+-- title and category with a single lookup instead of LEFT JOINing Book, Digital_Media and
+-- Magazine. Kept in step with those tables by the triggers below, don't write to it directly.
+CREATE TABLE IF NOT EXISTS Item_Catalog (
+    item_id INT PRIMARY KEY,
+    FOREIGN KEY (item_id) REFERENCES Media_Item(item_id) ON DELETE CASCADE,
+    category VARCHAR(20) NOT NULL CHECK (category IN ('Book', 'Digital Media', 'Magazine')),
+    title VARCHAR(100) NOT NULL,
+    author VARCHAR(100),
+    genre VARCHAR(50)
+);
+
+CREATE INDEX IF NOT EXISTS item_catalog_category_idx ON Item_Catalog (category);
+
+CREATE OR REPLACE FUNCTION sync_item_catalog() RETURNS trigger AS $$
+DECLARE
+    item_category VARCHAR(20) := CASE TG_TABLE_NAME
+        WHEN 'book' THEN 'Book'
+        WHEN 'digital_media' THEN 'Digital Media'
+        ELSE 'Magazine'
+    END;
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        DELETE FROM Item_Catalog WHERE category = item_category;
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM Item_Catalog WHERE item_id = OLD.item_id AND category = item_category;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        IF TG_TABLE_NAME = 'magazine' THEN
+            INSERT INTO Item_Catalog (item_id, category, title, author, genre)
+            VALUES (NEW.item_id, item_category, NEW.title, NULL, NULL)
+            ON CONFLICT (item_id) DO UPDATE
+            SET category = EXCLUDED.category, title = EXCLUDED.title, author = EXCLUDED.author, genre = EXCLUDED.genre;
+        ELSE
+            INSERT INTO Item_Catalog (item_id, category, title, author, genre)
+            VALUES (NEW.item_id, item_category, NEW.title, NEW.author, NEW.genre)
+            ON CONFLICT (item_id) DO UPDATE
+            SET category = EXCLUDED.category, title = EXCLUDED.title, author = EXCLUDED.author, genre = EXCLUDED.genre;
+        END IF;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS book_item_catalog ON Book;
+CREATE TRIGGER book_item_catalog
+    AFTER INSERT OR UPDATE OR DELETE ON Book
+    FOR EACH ROW EXECUTE FUNCTION sync_item_catalog();
+
+DROP TRIGGER IF EXISTS book_item_catalog_truncate ON Book;
+CREATE TRIGGER book_item_catalog_truncate
+    AFTER TRUNCATE ON Book
+    FOR EACH STATEMENT EXECUTE FUNCTION sync_item_catalog();
+
+DROP TRIGGER IF EXISTS digital_media_item_catalog ON Digital_Media;
+CREATE TRIGGER digital_media_item_catalog
+    AFTER INSERT OR UPDATE OR DELETE ON Digital_Media
+    FOR EACH ROW EXECUTE FUNCTION sync_item_catalog();
+
+DROP TRIGGER IF EXISTS digital_media_item_catalog_truncate ON Digital_Media;
+CREATE TRIGGER digital_media_item_catalog_truncate
+    AFTER TRUNCATE ON Digital_Media
+    FOR EACH STATEMENT EXECUTE FUNCTION sync_item_catalog();
+
+DROP TRIGGER IF EXISTS magazine_item_catalog ON Magazine;
+CREATE TRIGGER magazine_item_catalog
+    AFTER INSERT OR UPDATE OR DELETE ON Magazine
+    FOR EACH ROW EXECUTE FUNCTION sync_item_catalog();
+
+DROP TRIGGER IF EXISTS magazine_item_catalog_truncate ON Magazine;
+CREATE TRIGGER magazine_item_catalog_truncate
+    AFTER TRUNCATE ON Magazine
+    FOR EACH STATEMENT EXECUTE FUNCTION sync_item_catalog();
+
+-- Fill the catalog for items loaded before it existed
+INSERT INTO Item_Catalog (item_id, category, title, author, genre)
+SELECT item_id, 'Book', title, author, genre FROM Book
+UNION ALL
+SELECT item_id, 'Digital Media', title, author, genre FROM Digital_Media
+UNION ALL
+SELECT item_id, 'Magazine', title, NULL, NULL FROM Magazine
+ON CONFLICT (item_id) DO NOTHING;
+
+-- Fee ledger
+-- Late fees are $0.25 for every day an item comes back (or is still out) past the day it was
+-- due. late_fee() is the only place that rule is written down. Fee_Ledger keeps one row per
+-- late loan: loans returned late get their final fee when the return is recorded, and loans
+-- still out are accrued up to the day accrue_open_loan_fees() last ran. That runs nightly
+-- ("generate_report accrue_fees" from a cron batch, see cli_commands.py). As a fallback the
+-- fee reports accrue first if it hasn't run today. The fee reports read the ledger instead
+-- of working fees out over the whole history.
+CREATE OR REPLACE FUNCTION late_fee(expected_return_date TIMESTAMP, as_of DATE) RETURNS NUMERIC AS $$
+    SELECT GREATEST(as_of - expected_return_date::date, 0) * 0.25;
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Transaction's primary key includes date_borrowed when it is partitioned, so transaction_id
+-- can't reference it. Kept in step by the triggers below, don't write to it directly
+CREATE TABLE IF NOT EXISTS Fee_Ledger (
+    transaction_id INT PRIMARY KEY,
+    client_id INT NOT NULL,
+    FOREIGN KEY (client_id) REFERENCES Client(client_id),
+    item_id INT NOT NULL,
+    days_late INT NOT NULL CHECK (days_late > 0),
+    fee NUMERIC(10, 2) NOT NULL,
+    returned_day DATE,
+    accrued_through DATE NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS fee_ledger_returned_day_idx ON Fee_Ledger (returned_day);
+
+CREATE TABLE IF NOT EXISTS Fee_Accrual (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    accrued_through DATE NOT NULL
+);
+
+CREATE OR REPLACE FUNCTION record_late_fees() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        DELETE FROM Fee_Ledger;
+        RETURN NULL;
+    END IF;
+
+    -- A changed loan's fee is worked out again from its new row
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM Fee_Ledger f USING old_loans o WHERE f.transaction_id = o.transaction_id;
+    END IF;
+
+    -- Open loans added overdue (e.g. by a bulk load) are accrued to today straight away
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO Fee_Ledger AS f (transaction_id, client_id, item_id, days_late, fee, returned_day, accrued_through)
+        SELECT n.transaction_id, n.client_id, n.item_id,
+               COALESCE(n.returned_date::date, CURRENT_DATE) - n.expected_return_date::date,
+               late_fee(n.expected_return_date, COALESCE(n.returned_date::date, CURRENT_DATE)),
+               n.returned_date::date,
+               COALESCE(n.returned_date::date, CURRENT_DATE)
+        FROM new_loans n
+        WHERE n.expected_return_date::date < COALESCE(n.returned_date::date, CURRENT_DATE)
+        ORDER BY n.transaction_id
+        ON CONFLICT (transaction_id) DO UPDATE
+        SET client_id = EXCLUDED.client_id, item_id = EXCLUDED.item_id, days_late = EXCLUDED.days_late,
+            fee = EXCLUDED.fee, returned_day = EXCLUDED.returned_day, accrued_through = EXCLUDED.accrued_through;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS transaction_fee_ledger_insert ON Transaction;
+CREATE TRIGGER transaction_fee_ledger_insert
+    AFTER INSERT ON Transaction
+    REFERENCING NEW TABLE AS new_loans
+    FOR EACH STATEMENT EXECUTE FUNCTION record_late_fees();
+
+DROP TRIGGER IF EXISTS transaction_fee_ledger_update ON Transaction;
+CREATE TRIGGER transaction_fee_ledger_update
+    AFTER UPDATE ON Transaction
+    REFERENCING OLD TABLE AS old_loans NEW TABLE AS new_loans
+    FOR EACH STATEMENT EXECUTE FUNCTION record_late_fees();
+
+DROP TRIGGER IF EXISTS transaction_fee_ledger_delete ON Transaction;
+CREATE TRIGGER transaction_fee_ledger_delete
+    AFTER DELETE ON Transaction
+    REFERENCING OLD TABLE AS old_loans
+    FOR EACH STATEMENT EXECUTE FUNCTION record_late_fees();
+
+DROP TRIGGER IF EXISTS transaction_fee_ledger_truncate ON Transaction;
+CREATE TRIGGER transaction_fee_ledger_truncate
+    AFTER TRUNCATE ON Transaction
+    FOR EACH STATEMENT EXECUTE FUNCTION record_late_fees();
+
+-- Bring the fees of loans still out up to today. Only overdue open loans are read (through
+-- transaction_open_due_idx), and it does nothing if they were already accrued today unless
+-- forced. Returns the number of loans accrued.
+CREATE OR REPLACE FUNCTION accrue_open_loan_fees(force BOOLEAN DEFAULT FALSE) RETURNS INT AS $$
+DECLARE
+    accrued INT;
+BEGIN
+    IF NOT force AND (SELECT accrued_through FROM Fee_Accrual) >= CURRENT_DATE THEN
+        RETURN 0;
+    END IF;
+
+    -- A second accrual waits for the first and then finds there is nothing left to do
+    PERFORM pg_advisory_xact_lock(hashtext('accrue_open_loan_fees'));
+    IF NOT force AND (SELECT accrued_through FROM Fee_Accrual) >= CURRENT_DATE THEN
+        RETURN 0;
+    END IF;
+
+    INSERT INTO Fee_Ledger AS f (transaction_id, client_id, item_id, days_late, fee, returned_day, accrued_through)
+    SELECT t.transaction_id, t.client_id, t.item_id,
+           CURRENT_DATE - t.expected_return_date::date,
+           late_fee(t.expected_return_date, CURRENT_DATE),
+           NULL,
+           CURRENT_DATE
+    FROM Transaction t
+    WHERE t.returned_date IS NULL AND t.expected_return_date < CURRENT_DATE
+    ORDER BY t.transaction_id
+    ON CONFLICT (transaction_id) DO UPDATE
+    SET days_late = EXCLUDED.days_late, fee = EXCLUDED.fee, accrued_through = EXCLUDED.accrued_through
+    WHERE f.returned_day IS NULL AND f.accrued_through < EXCLUDED.accrued_through;
+    GET DIAGNOSTICS accrued = ROW_COUNT;
+
+    UPDATE Fee_Accrual SET accrued_through = CURRENT_DATE;
+    RETURN accrued;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Record the fees of the loans already in Transaction the first time this runs
+INSERT INTO Fee_Ledger (transaction_id, client_id, item_id, days_late, fee, returned_day, accrued_through)
+SELECT transaction_id, client_id, item_id,
+       COALESCE(returned_date::date, CURRENT_DATE) - expected_return_date::date,
+       late_fee(expected_return_date, COALESCE(returned_date::date, CURRENT_DATE)),
+       returned_date::date,
+       COALESCE(returned_date::date, CURRENT_DATE)
+FROM Transaction
+WHERE expected_return_date::date < COALESCE(returned_date::date, CURRENT_DATE)
+ON CONFLICT (transaction_id) DO NOTHING;
+
+INSERT INTO Fee_Accrual (accrued_through)
+VALUES (CURRENT_DATE)
+ON CONFLICT (id) DO NOTHING;
+
+-- Fee reports
+-- The fee reports are served from totals kept per client and per return day as the ledger
+-- changes, so a report reads a few summary rows and nothing is rebuilt when it runs. Only
+-- returned loans are totalled: accruing the fees of loans still out leaves the totals alone,
+-- and those are read from Open_Loans, a plain view over the open loans in Transaction (through
+-- transaction_open_due_idx) and their ledger rows. Don't write to the totals directly.
+DO $$
+DECLARE
+    view_name TEXT;
+BEGIN
+    -- The fee reports used to be materialized views, refreshed whenever any of their tables changed
+    FOREACH view_name IN ARRAY ARRAY['client_fines', 'daily_fees', 'open_loans'] LOOP
+        IF EXISTS (SELECT 1 FROM pg_class WHERE oid = to_regclass(view_name) AND relkind = 'm') THEN
+            EXECUTE format('DROP MATERIALIZED VIEW %I', view_name);
+        END IF;
+    END LOOP;
+END $$;
+
+DROP FUNCTION IF EXISTS refresh_fee_reports(BOOLEAN);
+DROP FUNCTION IF EXISTS mark_fee_reports_stale() CASCADE;
+DROP TABLE IF EXISTS Fee_Report_Refresh;
+DROP SEQUENCE IF EXISTS Fee_Report_Changes;
+
+CREATE INDEX IF NOT EXISTS fee_ledger_client_id_idx ON Fee_Ledger (client_id);
+
+-- Late fees owed per client for returned items
+CREATE TABLE IF NOT EXISTS Client_Fee_Total (
+    client_id INT PRIMARY KEY,
+    FOREIGN KEY (client_id) REFERENCES Client(client_id) ON DELETE CASCADE,
+    late_returns INT NOT NULL,
+    total_owed NUMERIC(12, 2) NOT NULL
+);
+
+-- Fees collected per return day and membership type
+CREATE TABLE IF NOT EXISTS Daily_Fee_Total (
+    returned_day DATE NOT NULL,
+    membership_type membership_type_enum NOT NULL,
+    late_returns INT NOT NULL,
+    fees_collected NUMERIC(12, 2) NOT NULL,
+    PRIMARY KEY (returned_day, membership_type)
+);
+
+-- A total whose late returns were all undone stays behind at 0 until the next rebuild
+CREATE OR REPLACE VIEW Client_Fines AS
+SELECT
+    c.client_id,
+    c.name,
+    t.total_owed
+FROM Client_Fee_Total t
+JOIN Client c ON t.client_id = c.client_id
+WHERE t.late_returns > 0;
+
+CREATE OR REPLACE VIEW Daily_Fees AS
+SELECT returned_day, membership_type, late_returns, fees_collected
+FROM Daily_Fee_Total
+WHERE late_returns > 0;
+
+-- Loans still out, with what the overdue reports show about them and their fee as of the
+-- last accrual
+CREATE OR REPLACE VIEW Open_Loans AS
+SELECT
+    t.transaction_id,
+    c.client_id,
+    c.name,
+    c.membership_type,
+    t.item_id,
+    COALESCE(ic.title, 'Unknown') AS title,
+    COALESCE(ic.category, 'Unknown') AS item_category,
+    t.date_borrowed,
+    t.expected_return_date,
+    COALESCE(f.fee, 0) AS late_fee
+FROM Transaction t
+JOIN Client c ON t.client_id = c.client_id
+LEFT JOIN Item_Catalog ic ON t.item_id = ic.item_id
+LEFT JOIN Fee_Ledger f ON t.transaction_id = f.transaction_id
+WHERE t.returned_date IS NULL;
+
+CREATE OR REPLACE FUNCTION total_late_fees() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        DELETE FROM Client_Fee_Total;
+        DELETE FROM Daily_Fee_Total;
+        RETURN NULL;
+    END IF;
+
+    -- Each trigger only has the transition tables of its own event, so every branch collects
+    -- the statement's signed changes and adds them to both totals, in key order so concurrent
+    -- statements lock the total rows in the same order
+    IF TG_OP = 'INSERT' THEN
+        WITH changes AS (
+            SELECT f.client_id, c.membership_type, f.returned_day, 1 AS returns, f.fee
+            FROM new_fees f JOIN Client c ON c.client_id = f.client_id
+            WHERE f.returned_day IS NOT NULL
+        ), clients AS (
+            INSERT INTO Client_Fee_Total AS t (client_id, late_returns, total_owed)
+            SELECT client_id, SUM(returns), SUM(fee) FROM changes
+            GROUP BY client_id ORDER BY client_id
+            ON CONFLICT (client_id) DO UPDATE
+            SET late_returns = t.late_returns + EXCLUDED.late_returns, total_owed = t.total_owed + EXCLUDED.total_owed
+        )
+        INSERT INTO Daily_Fee_Total AS d (returned_day, membership_type, late_returns, fees_collected)
+        SELECT returned_day, membership_type, SUM(returns), SUM(fee) FROM changes
+        GROUP BY returned_day, membership_type ORDER BY returned_day, membership_type
+        ON CONFLICT (returned_day, membership_type) DO UPDATE
+        SET late_returns = d.late_returns + EXCLUDED.late_returns, fees_collected = d.fees_collected + EXCLUDED.fees_collected;
+    ELSIF TG_OP = 'DELETE' THEN
+        WITH changes AS (
+            SELECT f.client_id, c.membership_type, f.returned_day, -1 AS returns, -f.fee AS fee
+            FROM old_fees f JOIN Client c ON c.client_id = f.client_id
+            WHERE f.returned_day IS NOT NULL
+        ), clients AS (
+            INSERT INTO Client_Fee_Total AS t (client_id, late_returns, total_owed)
+            SELECT client_id, SUM(returns), SUM(fee) FROM changes
+            GROUP BY client_id ORDER BY client_id
+            ON CONFLICT (client_id) DO UPDATE
+            SET late_returns = t.late_returns + EXCLUDED.late_returns, total_owed = t.total_owed + EXCLUDED.total_owed
+        )
+        INSERT INTO Daily_Fee_Total AS d (returned_day, membership_type, late_returns, fees_collected)
+        SELECT returned_day, membership_type, SUM(returns), SUM(fee) FROM changes
+        GROUP BY returned_day, membership_type ORDER BY returned_day, membership_type
+        ON CONFLICT (returned_day, membership_type) DO UPDATE
+        SET late_returns = d.late_returns + EXCLUDED.late_returns, fees_collected = d.fees_collected + EXCLUDED.fees_collected;
+    ELSE
+        WITH changes AS (
+            SELECT f.client_id, c.membership_type, f.returned_day, 1 AS returns, f.fee
+            FROM new_fees f JOIN Client c ON c.client_id = f.client_id
+            WHERE f.returned_day IS NOT NULL
+            UNION ALL
+            SELECT f.client_id, c.membership_type, f.returned_day, -1, -f.fee
+            FROM old_fees f JOIN Client c ON c.client_id = f.client_id
+            WHERE f.returned_day IS NOT NULL
+        ), clients AS (
+            INSERT INTO Client_Fee_Total AS t (client_id, late_returns, total_owed)
+            SELECT client_id, SUM(returns), SUM(fee) FROM changes
+            GROUP BY client_id HAVING SUM(returns) <> 0 OR SUM(fee) <> 0 ORDER BY client_id
+            ON CONFLICT (client_id) DO UPDATE
+            SET late_returns = t.late_returns + EXCLUDED.late_returns, total_owed = t.total_owed + EXCLUDED.total_owed
+        )
+        INSERT INTO Daily_Fee_Total AS d (returned_day, membership_type, late_returns, fees_collected)
+        SELECT returned_day, membership_type, SUM(returns), SUM(fee) FROM changes
+        GROUP BY returned_day, membership_type HAVING SUM(returns) <> 0 OR SUM(fee) <> 0
+        ORDER BY returned_day, membership_type
+        ON CONFLICT (returned_day, membership_type) DO UPDATE
+        SET late_returns = d.late_returns + EXCLUDED.late_returns, fees_collected = d.fees_collected + EXCLUDED.fees_collected;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS fee_ledger_totals_insert ON Fee_Ledger;
+CREATE TRIGGER fee_ledger_totals_insert
+    AFTER INSERT ON Fee_Ledger
+    REFERENCING NEW TABLE AS new_fees
+    FOR EACH STATEMENT EXECUTE FUNCTION total_late_fees();
+
+DROP TRIGGER IF EXISTS fee_ledger_totals_update ON Fee_Ledger;
+CREATE TRIGGER fee_ledger_totals_update
+    AFTER UPDATE ON Fee_Ledger
+    REFERENCING OLD TABLE AS old_fees NEW TABLE AS new_fees
+    FOR EACH STATEMENT EXECUTE FUNCTION total_late_fees();
+
+DROP TRIGGER IF EXISTS fee_ledger_totals_delete ON Fee_Ledger;
+CREATE TRIGGER fee_ledger_totals_delete
+    AFTER DELETE ON Fee_Ledger
+    REFERENCING OLD TABLE AS old_fees
+    FOR EACH STATEMENT EXECUTE FUNCTION total_late_fees();
+
+DROP TRIGGER IF EXISTS fee_ledger_totals_truncate ON Fee_Ledger;
+CREATE TRIGGER fee_ledger_totals_truncate
+    AFTER TRUNCATE ON Fee_Ledger
+    FOR EACH STATEMENT EXECUTE FUNCTION total_late_fees();
+
+-- Daily_Fee_Total is kept per membership type, so a client changing type takes their returned
+-- fees over to the new one. Reads the ledger only for clients whose type changed
+CREATE OR REPLACE FUNCTION move_client_fees() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO Daily_Fee_Total AS d (returned_day, membership_type, late_returns, fees_collected)
+    SELECT f.returned_day, moved.membership_type, SUM(moved.sign), SUM(moved.sign * f.fee)
+    FROM (
+        SELECT n.client_id, n.membership_type, 1 AS sign
+        FROM new_clients n JOIN old_clients o ON o.client_id = n.client_id
+        WHERE o.membership_type <> n.membership_type
+        UNION ALL
+        SELECT o.client_id, o.membership_type, -1
+        FROM new_clients n JOIN old_clients o ON o.client_id = n.client_id
+        WHERE o.membership_type <> n.membership_type
+    ) moved
+    JOIN Fee_Ledger f ON f.client_id = moved.client_id
+    WHERE f.returned_day IS NOT NULL
+    GROUP BY f.returned_day, moved.membership_type ORDER BY f.returned_day, moved.membership_type
+    ON CONFLICT (returned_day, membership_type) DO UPDATE
+    SET late_returns = d.late_returns + EXCLUDED.late_returns, fees_collected = d.fees_collected + EXCLUDED.fees_collected;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS client_fee_totals_update ON Client;
+CREATE TRIGGER client_fee_totals_update
+    AFTER UPDATE ON Client
+    REFERENCING OLD TABLE AS old_clients NEW TABLE AS new_clients
+    FOR EACH STATEMENT EXECUTE FUNCTION move_client_fees();
+
+-- Recompute both totals from Fee_Ledger, fixing any that drifted, e.g. over a load run with
+-- the triggers disabled. Returns and membership changes wait for it, so none is lost between
+-- the sums and the write. Returns how many totals it corrected
+CREATE OR REPLACE FUNCTION rebuild_fee_totals() RETURNS INT AS $$
+DECLARE
+    changed INT;
+    total INT := 0;
+BEGIN
+    LOCK TABLE Client_Fee_Total, Daily_Fee_Total IN EXCLUSIVE MODE;
+
+    INSERT INTO Client_Fee_Total AS t (client_id, late_returns, total_owed)
+    SELECT client_id, COUNT(*), SUM(fee) FROM Fee_Ledger WHERE returned_day IS NOT NULL
+    GROUP BY client_id ORDER BY client_id
+    ON CONFLICT (client_id) DO UPDATE SET late_returns = EXCLUDED.late_returns, total_owed = EXCLUDED.total_owed
+    WHERE (t.late_returns, t.total_owed) <> (EXCLUDED.late_returns, EXCLUDED.total_owed);
+    GET DIAGNOSTICS changed = ROW_COUNT;
+    total := total + changed;
+
+    -- Totals already at 0 are only cleared away, not counted as corrected
+    WITH removed AS (
+        DELETE FROM Client_Fee_Total t
+        WHERE NOT EXISTS (SELECT 1 FROM Fee_Ledger f WHERE f.client_id = t.client_id AND f.returned_day IS NOT NULL)
+        RETURNING t.late_returns
+    )
+    SELECT total + COUNT(*) FILTER (WHERE late_returns <> 0) INTO total FROM removed;
+
+    INSERT INTO Daily_Fee_Total AS d (returned_day, membership_type, late_returns, fees_collected)
+    SELECT f.returned_day, c.membership_type, COUNT(*), SUM(f.fee)
+    FROM Fee_Ledger f JOIN Client c ON c.client_id = f.client_id
+    WHERE f.returned_day IS NOT NULL
+    GROUP BY f.returned_day, c.membership_type ORDER BY f.returned_day, c.membership_type
+    ON CONFLICT (returned_day, membership_type) DO UPDATE
+    SET late_returns = EXCLUDED.late_returns, fees_collected = EXCLUDED.fees_collected
+    WHERE (d.late_returns, d.fees_collected) <> (EXCLUDED.late_returns, EXCLUDED.fees_collected);
+    GET DIAGNOSTICS changed = ROW_COUNT;
+    total := total + changed;
+
+    WITH removed AS (
+        DELETE FROM Daily_Fee_Total d
+        WHERE NOT EXISTS (SELECT 1 FROM Fee_Ledger f JOIN Client c ON c.client_id = f.client_id
+                          WHERE f.returned_day = d.returned_day AND c.membership_type = d.membership_type)
+        RETURNING d.late_returns
+    )
+    SELECT total + COUNT(*) FILTER (WHERE late_returns <> 0) INTO total FROM removed;
+
+    RETURN total;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Total the fees already in Fee_Ledger the first time this runs, and correct them on every apply
+SELECT rebuild_fee_totals();
+
+-- Transaction partitions
+-- Create the monthly partitions covering from_date through to_date, by default the months
+-- already sitting in Transaction_Default up to three months ahead. Rows found in the default
+-- partition for a new month are moved into it. Does nothing if Transaction isn't partitioned.
+-- Only months from ten years back to a year ahead get partitions: a stray date like 1900 or
+-- 2999 stays in the default partition instead of creating every month up to it.
+CREATE OR REPLACE FUNCTION ensure_transaction_partitions(from_date DATE DEFAULT NULL, to_date DATE DEFAULT NULL) RETURNS INT AS $$
+DECLARE
+    window_start DATE := date_trunc('month', CURRENT_DATE - INTERVAL '10 years');
+    window_end DATE := date_trunc('month', CURRENT_DATE + INTERVAL '1 year');
+    month_start DATE;
+    last_month DATE;
+    partition_name TEXT;
+    created INT := 0;
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('transaction')) THEN
+        RETURN 0;
+    END IF;
+
+    SELECT date_trunc('month', LEAST(COALESCE(from_date, CURRENT_DATE), CURRENT_DATE,
+                                     MIN(date_borrowed) FILTER (WHERE date_borrowed >= window_start)::date)),
+           date_trunc('month', GREATEST(COALESCE(to_date, CURRENT_DATE + INTERVAL '3 months'),
+                                        MAX(date_borrowed) FILTER (WHERE date_borrowed < window_end + INTERVAL '1 month')::date))
+    INTO month_start, last_month
+    FROM Transaction_Default;
+
+    month_start := GREATEST(month_start, window_start);
+    last_month := LEAST(last_month, window_end);
+
+    WHILE month_start <= last_month LOOP
+        partition_name := format('transaction_%s', to_char(month_start, 'YYYY_MM'));
+
+        IF to_regclass(partition_name) IS NULL THEN
+            -- Attaching a range the default partition already holds rows for would fail, so the
+            -- partition is filled from the default one before it is attached
+            EXECUTE format('CREATE TABLE %I (LIKE Transaction INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', partition_name);
+            EXECUTE format('WITH moved AS (DELETE FROM Transaction_Default WHERE date_borrowed >= %L AND date_borrowed < %L RETURNING *) '
+                           'INSERT INTO %I SELECT * FROM moved',
+                           month_start, month_start + INTERVAL '1 month', partition_name);
+            EXECUTE format('ALTER TABLE Transaction ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                           partition_name, month_start, month_start + INTERVAL '1 month');
+            created := created + 1;
+        END IF;
+
+        month_start := month_start + INTERVAL '1 month';
+    END LOOP;
+
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Detach the monthly partitions that end on or before before_date so they can be archived
+-- or dropped without touching the rest of the table. Returns the detached partition names.
+CREATE OR REPLACE FUNCTION detach_transaction_partitions(before_date DATE) RETURNS SETOF TEXT AS $$
+DECLARE
+    partition_name TEXT;
+BEGIN
+    FOR partition_name IN
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = to_regclass('transaction')
+          AND child.relname ~ '^transaction_[0-9]{4}_[0-9]{2}$'
+          AND to_date(substr(child.relname, 13), 'YYYY_MM') + INTERVAL '1 month' <= before_date
+        ORDER BY child.relname
+    LOOP
+        EXECUTE format('ALTER TABLE Transaction DETACH PARTITION %I', partition_name);
+        RETURN NEXT partition_name;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Keep partitions ready for the months ahead every time this file runs
+SELECT ensure_transaction_partitions();
+
+-- Loan limits
+-- How many items each membership type may have out at once, and how many each client has
+-- out now. Client_Loan_Count is kept current by the statement triggers below, which apply
+-- each statement's net change per client from its transition tables, so a bulk load updates
+-- every count in one pass. Clients with nothing ever lent have no row, read them as 0.
+-- Don't write to Client_Loan_Count directly.
+CREATE TABLE IF NOT EXISTS Membership_Limit (
+    membership_type membership_type_enum PRIMARY KEY,
+    loan_limit INT NOT NULL CHECK (loan_limit >= 0)
+);
+
+INSERT INTO Membership_Limit (membership_type, loan_limit)
+VALUES ('Regular', 5), ('Student', 10), ('Senior Citizen', 7), ('Other', 3)
+ON CONFLICT (membership_type) DO NOTHING;
+
+CREATE TABLE IF NOT EXISTS Client_Loan_Count (
+    client_id INT PRIMARY KEY,
+    FOREIGN KEY (client_id) REFERENCES Client(client_id) ON DELETE CASCADE,
+    open_loans INT NOT NULL
+);
+
+CREATE OR REPLACE FUNCTION count_client_loans() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        DELETE FROM Client_Loan_Count;
+        RETURN NULL;
+    END IF;
+
+    -- Each trigger only has the transition tables of its own event. Clients are updated in
+    -- client_id order so concurrent statements lock their rows in the same order
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO Client_Loan_Count AS n (client_id, open_loans)
+        SELECT client_id, COUNT(*) FROM new_loans WHERE returned_date IS NULL
+        GROUP BY client_id ORDER BY client_id
+        ON CONFLICT (client_id) DO UPDATE SET open_loans = n.open_loans + EXCLUDED.open_loans;
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE Client_Loan_Count AS n SET open_loans = n.open_loans - closed.loans
+        FROM (SELECT client_id, COUNT(*) AS loans FROM old_loans WHERE returned_date IS NULL GROUP BY client_id) closed
+        WHERE n.client_id = closed.client_id;
+    ELSE
+        INSERT INTO Client_Loan_Count AS n (client_id, open_loans)
+        SELECT client_id, SUM(change) FROM (
+            SELECT client_id, 1 AS change FROM new_loans WHERE returned_date IS NULL
+            UNION ALL
+            SELECT client_id, -1 FROM old_loans WHERE returned_date IS NULL
+        ) changes
+        GROUP BY client_id HAVING SUM(change) <> 0 ORDER BY client_id
+        ON CONFLICT (client_id) DO UPDATE SET open_loans = n.open_loans + EXCLUDED.open_loans;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Transition tables need a trigger per event. Rows moved between partitions by
+-- ensure_transaction_partitions() don't go through Transaction, so they aren't counted twice
+DROP TRIGGER IF EXISTS transaction_loan_count_insert ON Transaction;
+CREATE TRIGGER transaction_loan_count_insert
+    AFTER INSERT ON Transaction
+    REFERENCING NEW TABLE AS new_loans
+    FOR EACH STATEMENT EXECUTE FUNCTION count_client_loans();
+
+DROP TRIGGER IF EXISTS transaction_loan_count_update ON Transaction;
+CREATE TRIGGER transaction_loan_count_update
+    AFTER UPDATE ON Transaction
+    REFERENCING OLD TABLE AS old_loans NEW TABLE AS new_loans
+    FOR EACH STATEMENT EXECUTE FUNCTION count_client_loans();
+
+DROP TRIGGER IF EXISTS transaction_loan_count_delete ON Transaction;
+CREATE TRIGGER transaction_loan_count_delete
+    AFTER DELETE ON Transaction
+    REFERENCING OLD TABLE AS old_loans
+    FOR EACH STATEMENT EXECUTE FUNCTION count_client_loans();
+
+DROP TRIGGER IF EXISTS transaction_loan_count_truncate ON Transaction;
+CREATE TRIGGER transaction_loan_count_truncate
+    AFTER TRUNCATE ON Transaction
+    FOR EACH STATEMENT EXECUTE FUNCTION count_client_loans();
+
+-- Recompute every count from Transaction, fixing any that drifted, e.g. over a load run with
+-- the triggers disabled. Checkouts and returns wait for it, so none is lost between the count
+-- and the write. Returns how many counts it wrote
+CREATE OR REPLACE FUNCTION recount_client_loans() RETURNS INT AS $$
+DECLARE
+    written INT;
+    cleared INT;
+BEGIN
+    LOCK TABLE Client_Loan_Count IN EXCLUSIVE MODE;
+
+    INSERT INTO Client_Loan_Count AS n (client_id, open_loans)
+    SELECT client_id, COUNT(*) FROM Transaction WHERE returned_date IS NULL
+    GROUP BY client_id ORDER BY client_id
+    ON CONFLICT (client_id) DO UPDATE SET open_loans = EXCLUDED.open_loans
+    WHERE n.open_loans <> EXCLUDED.open_loans;
+    GET DIAGNOSTICS written = ROW_COUNT;
+
+    UPDATE Client_Loan_Count AS n SET open_loans = 0
+    WHERE n.open_loans <> 0
+      AND NOT EXISTS (SELECT 1 FROM Transaction t WHERE t.client_id = n.client_id AND t.returned_date IS NULL);
+    GET DIAGNOSTICS cleared = ROW_COUNT;
+
+    RETURN written + cleared;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Count the loans already in Transaction the first time this runs, and correct them on every apply
+SELECT recount_client_loans();
+
+-- Circulation
+-- Checking an item out or in is one call, so a desk makes a single round trip per item. The
+-- Media_Item row is locked NOWAIT first: when another desk is already lending or returning the
+-- same item the call fails straight away (SQLSTATE 55P03) instead of queueing behind it, and
+-- availability is only flipped by an UPDATE that checks it, so an item can't be lent twice.
+-- A checkout also locks the client's row, so two desks lending to one client can't both get
+-- in under the client's loan limit.
+
+-- Lend an item to a client for loan_days, returning the new transaction and its due date
+CREATE OR REPLACE FUNCTION checkout_item(borrower INT, item INT, loan_days INT DEFAULT 14)
+RETURNS TABLE (transaction_id INT, expected_return_date TIMESTAMP) AS $$
+DECLARE
+    status account_status_enum;
+    open_loans INT;
+    loan_limit INT;
+BEGIN
+    PERFORM 1 FROM Client c WHERE c.client_id = borrower FOR NO KEY UPDATE;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Client % does not exist', borrower;
+    END IF;
+
+    -- Read after the lock, so the count includes loans committed while this call waited for it
+    SELECT c.account_status, COALESCE(n.open_loans, 0), l.loan_limit INTO status, open_loans, loan_limit
+    FROM Client c
+    JOIN Membership_Limit l ON l.membership_type = c.membership_type
+    LEFT JOIN Client_Loan_Count n ON n.client_id = c.client_id
+    WHERE c.client_id = borrower;
+
+    IF status <> 'Active' THEN
+        RAISE EXCEPTION 'Client % is %, items can only be lent to active clients', borrower, status;
+    ELSIF open_loans >= loan_limit THEN
+        RAISE EXCEPTION 'Client % already has % items out, their limit is %', borrower, open_loans, loan_limit;
+    END IF;
+
+    PERFORM 1 FROM Media_Item m WHERE m.item_id = item FOR UPDATE NOWAIT;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Item % does not exist', item;
+    END IF;
+
+    RETURN QUERY
+    WITH lent AS (
+        UPDATE Media_Item m
+        SET availability_status = 'Unavailable'
+        WHERE m.item_id = item AND m.availability_status = 'Available'
+        RETURNING m.item_id
+    )
+    INSERT INTO Transaction AS t (client_id, item_id, date_borrowed, expected_return_date)
+    SELECT borrower, lent.item_id, LOCALTIMESTAMP, LOCALTIMESTAMP + make_interval(days => loan_days)
+    FROM lent
+    RETURNING t.transaction_id, t.expected_return_date;
+
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Item % is already checked out', item;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Return an item, closing its open loans and making it available again. Returns the loans
+-- closed (normally one) with how many days late each came back and its fee. The fee is
+-- recorded in Fee_Ledger by its triggers
+DROP FUNCTION IF EXISTS return_item(INT);
+CREATE FUNCTION return_item(item INT)
+RETURNS TABLE (transaction_id INT, client_id INT, days_late INT, fee NUMERIC) AS $$
+BEGIN
+    PERFORM 1 FROM Media_Item m WHERE m.item_id = item FOR UPDATE NOWAIT;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Item % does not exist', item;
+    END IF;
+
+    RETURN QUERY
+    WITH returned AS (
+        UPDATE Transaction t
+        SET returned_date = LOCALTIMESTAMP
+        WHERE t.item_id = item AND t.returned_date IS NULL
+        RETURNING t.transaction_id, t.client_id, GREATEST(t.returned_date::date - t.expected_return_date::date, 0) AS days_late,
+                  late_fee(t.expected_return_date, t.returned_date::date) AS fee
+    ), available AS (
+        UPDATE Media_Item m
+        SET availability_status = 'Available'
+        WHERE m.item_id = item AND m.availability_status <> 'Available'
+    )
+    SELECT r.transaction_id, r.client_id, r.days_late, r.fee FROM returned r;
+
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Item % is not checked out', item;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Incremental loads
+-- What fill_db's incremental load last applied from each sheet: its columns, the columns its
+-- rows are matched on, and a hash per row. Written in the same transaction as the rows, so it
+-- always describes what the tables hold. Dropping the tables or a full load clears it.
+CREATE TABLE IF NOT EXISTS Load_Manifest (
+    sheet VARCHAR(50) PRIMARY KEY,
+    columns JSONB NOT NULL,
+    row_key JSONB NOT NULL,
+    fingerprint CHAR(64) NOT NULL,
+    row_hashes JSONB NOT NULL
+);
+
+-- Schema version
+-- One row recording which version of this file the database was last built from. Written by
+-- schema_version.py after the whole file applied, so a failed run leaves the old version.
+CREATE TABLE IF NOT EXISTS Schema_Version (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    version INT NOT NULL,
+    fingerprint CHAR(64) NOT NULL,
+    applied_at TIMESTAMP NOT NULL
+);
@@ -4,10 +4,17 @@ Class: EECS 447
 Assignment: Database Design Project Part 5: Physical Database Design
 """
 
+import os
+import sys
 import getpass
-import psycopg2
-import sqlparse
+import argparse
 import cli_commands as cli
+import batch_mode
+
+# The connection pool lives with the fill scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts", "fill_db_script"))
+from db_connection import PostgresDB
+import schema_version
 
 # Database connection parameters
 DB_HOST = "libdb-25co-postgres.cajikaswgj3d.us-east-1.rds.amazonaws.com"
@@ -17,58 +24,29 @@ DB_PASSWORD = open("src/password.txt", 'r').read().strip()
 
 LIBRARY_PASSWORD = "password"
 
-def connect_to_db():
-    """Establish a connection to the PostgreSQL DB"""
-    try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
-        print("DB connection successful")
-        return conn
-    except Exception as e:
-        print(f"DB connection failure: {e}")
-        return None
-
-def is_correctly_configured(db_connection):
-    """Verify the database schema using the libraryDDL.sql file."""
-    ddl_path = "src/libraryDDL.sql"
-
-    try:
-        with open(ddl_path, 'r') as ddl_file:
-            ddl_content = ddl_file.read()
-
-        # Remove comments from the SQL file
-        ddl_content = sqlparse.format(ddl_content, strip_comments=True)
-
-        # Parse the SQL statements
-        statements = sqlparse.split(ddl_content)
-
-        cursor = db_connection.cursor()
+# Batch mode checks the admin password once, every admin command of the batch then uses the answer
+BATCH_ADMIN = None
 
-        for statement in statements:
-            statement = statement.strip()
-            if statement:
-                try:
-                    cursor.execute(statement)
-                except Exception as e:
-                    print(f"Schema verification failed for statement: {statement}\n{e}")
-                    return False
+# Shared connection pool for the CLI session
+DB = PostgresDB(host=DB_HOST, dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, min_size=1, max_size=5)
+cli.CONNECTION_POOL = DB
 
-        print("Database schema matches expectation")
-        cursor.close()
-        return True
+def connect_to_db():
+    """Check the session's connection out of the PostgreSQL connection pool"""
+    return DB.connect()
 
-    except FileNotFoundError:
-        print("DDL file not found")
-        return False
-    except Exception as e:
-        print(f"Exception encountered: {e}")
+def is_correctly_configured(db_connection):
+    """Verify the database schema against the version of libraryDDL.sql, applying it if they differ."""
+    if not schema_version.ensure_schema(db_connection, "src/libraryDDL.sql"):
         return False
 
+    # Replaying the DDL used to create these, now it only runs when the file changes
+    cli.ensure_partitions(db_connection)
+    return True
+
 def verify():
+    if BATCH_ADMIN is not None:
+        return BATCH_ADMIN
     print("The admin password is required for that action.")
     password_input = getpass.getpass()
     return (password_input == LIBRARY_PASSWORD) # Beautiful security :)
@@ -79,15 +57,94 @@ def execute(connection, active_user, called_function, input_string=None, admin=F
             called_function(connection, active_user, input_string)
         else:
             print("Invalid Admin Password")
+            return "denied"
     else:
         called_function(connection, active_user, input_string)
-
-def main():
-    """CLI for interacting with DB"""
+    return "ok"
+
+def run_command(connection, active_user, input_string):
+    """Run one line of input, returning its status: ok, denied, unknown, logout or quit."""
+    command = input_string.split(' ')
+
+    match command[0].lower():
+        case "quit":
+            if verify():
+                return "quit"
+            return "denied"
+        case "logout":
+            return "logout"
+        case "clear":
+            return execute(connection, active_user, cli.clear)
+        case "help":
+            return execute(connection, active_user, cli.library_help)
+        case "execute":
+            return execute(connection, active_user, cli.execute_postgresql, ' '.join(input_string.split(' ')[1:]) , True)
+        case "generate_report":
+            return execute(connection, active_user, cli.generate_report, input_string, True)
+        case "query":
+            return execute(connection, active_user, cli.query, input_string, True)
+        case "export":
+            return execute(connection, active_user, cli.export, input_string, True)
+        case "profile":
+            return execute(connection, active_user, cli.profile, input_string, True)
+        case "checkout":
+            return execute(connection, active_user, cli.checkout, input_string)
+        case "return":
+            return execute(connection, active_user, cli.return_item, input_string)
+        case "stats":
+            return execute(connection, active_user, cli.stats, input_string)
+        case "cache":
+            return execute(connection, active_user, cli.cache, input_string)
+        case "":
+            return "ok"
+        case _:
+            print(f"No command found for: {command[0]}")
+            return "unknown"
+
+def run_batch_command(connection, active_user, input_string):
+    """run_command for batch mode, where nobody is there to turn --page's pages."""
+    if '--page' in input_string.split():
+        print("--page can't be used in batch mode")
+        return "error"
+    return run_command(connection, active_user, input_string)
+
+def run_batch(connection, command_path, active_user):
+    """Run the commands in a file (- for stdin) as one batch, printing a JSON line per command. Returns the failures."""
+    global BATCH_ADMIN
+    if not active_user.isnumeric():
+        print("Batch mode needs a numeric --client ID", file=sys.stderr)
+        return 1
+
+    # Scheduled batches set the password in the environment, otherwise ask once up front. Commands
+    # read from stdin would be taken for the answer, so those batches have to set it
+    password = os.environ.get("LIBDB_ADMIN_PASSWORD")
+    if password is None and command_path == '-':
+        print("A batch read from stdin needs LIBDB_ADMIN_PASSWORD set (empty to run without admin commands)", file=sys.stderr)
+        return 1
+    if password is None:
+        password = getpass.getpass("Admin password (blank to run without admin commands): ", stream=sys.stderr)
+    BATCH_ADMIN = password == LIBRARY_PASSWORD
+
+    command_file = sys.stdin if command_path == '-' else open(command_path, 'r')
+    try:
+        commands = batch_mode.read_commands(command_file)
+        return batch_mode.run_batch(connection, commands, lambda batch, line: run_batch_command(batch, active_user, line), sys.stdout)
+    finally:
+        if command_file is not sys.stdin:
+            command_file.close()
+
+def main(batch=None, client=""):
+    """CLI for interacting with DB. With batch, runs the commands in that file (- for stdin) and exits"""
     connection = connect_to_db()
     if not is_correctly_configured(connection):
         raise Exception("Database is not correctly configured!")
 
+    if batch is not None:
+        failed = run_batch(connection, batch, client)
+        DB.close()
+        PostgresDB.close_all()
+        return failed
+
     quit = False
     active_user = ""
     while not quit:
@@ -99,28 +156,20 @@ def main():
 
         while active_user != "":
             input_string = input(">> ")
-            command = input_string.split(' ')
-
-            match command[0].lower():
+            match run_command(connection, active_user, input_string):
                 case "quit":
-                    if verify():
-                        quit = True
-                        break
+                    quit = True
+                    break
                 case "logout":
                     active_user = ""
-                case "clear":
-                    execute(connection, active_user, cli.clear)
-                case "help":
-                    execute(connection, active_user, cli.library_help)
-                case "execute":
-                    execute(connection, active_user, cli.execute_postgresql, ' '.join(input_string.split(' ')[1:]) , True)
-                case "generate_report":
-                    execute(connection, active_user, cli.generate_report, input_string, True)
-                case "query":
-                    execute(connection, active_user, cli.query, input_string, True)
-                case "":
-                    continue
-                case _:
-                    print(f"No command found for: {command[0]}")
-
-main()
+
+    DB.close()
+    PostgresDB.close_all()
+    return 0
+
+parser = argparse.ArgumentParser(description="Library database CLI")
+parser.add_argument("--batch", metavar="FILE",
+                    help="run the commands in FILE (- for stdin, needs LIBDB_ADMIN_PASSWORD) in one transaction, one JSON result line each")
+parser.add_argument("--client", default="", help="client ID the batch runs as")
+args = parser.parse_args()
+sys.exit(1 if main(batch=args.batch, client=args.client) else 0)
@@ -0,0 +1,66 @@
+"""
+EXPLAIN ANALYZE a query and summarise where its time went.
+
+Each plan node's own time is its total time less its children's, so the nodes that actually
+do the work stand out from the ones that just pass rows up. The query runs for real under
+ANALYZE, inside a transaction that is always rolled back.
+"""
+
+# Nodes marked as the most expensive in a profile
+TOP_NODES = 3
+
+def explain_analyze(connection, query):
+    """Run query under EXPLAIN (ANALYZE, BUFFERS), returning the JSON plan document."""
+    cursor = connection.cursor()
+    try:
+        cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query.strip().rstrip(';'))
+        return cursor.fetchone()[0][0]
+    finally:
+        connection.rollback()
+        cursor.close()
+
+def plan_nodes(plan, depth=0):
+    """Walk a plan tree depth first, yielding (node, depth)."""
+    yield plan, depth
+    for child in plan.get('Plans', []):
+        yield from plan_nodes(child, depth + 1)
+
+def self_time(node):
+    """Milliseconds spent in a node itself, not in the nodes below it."""
+    total = node.get('Actual Total Time', 0) * node.get('Actual Loops', 1)
+    children = sum(child.get('Actual Total Time', 0) * child.get('Actual Loops', 1) for child in node.get('Plans', []))
+    return max(total - children, 0)
+
+def describe(node):
+    """One line naming a node and what it ran on."""
+    text = node['Node Type']
+    if 'Relation Name' in node:
+        text += f" on {node['Relation Name']}"
+        if node.get('Alias') and node['Alias'] != node['Relation Name']:
+            text += f" {node['Alias']}"
+    if 'Index Name' in node:
+        text += f" using {node['Index Name']}"
+    return text
+
+def format_profile(document, top=TOP_NODES):
+    """Lines of the indented plan, the top most expensive nodes marked, then the timings."""
+    plan = document['Plan']
+    nodes = list(plan_nodes(plan))
+    execution = document.get('Execution Time', 0) or 1
+    costliest = {id(node) for node, _ in sorted(nodes, key=lambda item: self_time(item[0]), reverse=True)[:top]}
+
+    lines = []
+    for node, depth in nodes:
+        own = self_time(node)
+        marker = ">>" if id(node) in costliest else "  "
+        hit, read = node.get('Shared Hit Blocks', 0), node.get('Shared Read Blocks', 0)
+        lines.append(f"{marker} {'  ' * depth}{describe(node)}"
+                     f"  (self {own:.1f} ms, {own / execution:.0%}; rows {node.get('Actual Rows', 0)} x {node.get('Actual Loops', 1)};"
+                     f" est {node.get('Plan Rows', 0)}; buffers hit {hit} read {read})")
+        for condition in ('Index Cond', 'Filter', 'Hash Cond', 'Join Filter'):
+            if condition in node:
+                lines.append(f"   {'  ' * depth}  {condition}: {node[condition]}")
+
+    lines.append(f"Planning {document.get('Planning Time', 0):.1f} ms, execution {document.get('Execution Time', 0):.1f} ms."
+                 f" >> marks the {top} nodes with the most time of their own.")
+    return lines
@@ -0,0 +1,155 @@
+"""
+Registry of the canned queries that take parameters.
+
+Each query is PREPAREd on the server the first time a connection runs it and EXECUTEd by
+name after that, so its text is parsed and planned once per connection rather than on every
+call. Parameters are typed, "query trans_history 11" binds item_id as an int. The old fixed
+variants (trans_history_11, books_by_stephen_king, ...) are kept as aliases.
+"""
+
+import weakref
+from collections import namedtuple
+from psycopg2 import sql
+
+Query = namedtuple('Query', ['sql', 'params', 'description'])
+
+# Postgres type each parameter converter is declared as in PREPARE
+SQL_TYPES = {int: 'int', str: 'text'}
+
+QUERIES = {
+    'trans_history': Query("""
+SELECT transaction_id, client_id, date_borrowed, expected_return_date, returned_date
+FROM Transaction
+WHERE item_id = %s;
+""", [('item_id', int)], "Gets all transactions involving an item"),
+
+    'check_client': Query("""
+SELECT *
+FROM Client
+WHERE client_id = %s;
+""", [('client_id', int)], "Checks the status and information of a client"),
+
+    'books_of_year': Query("""
+SELECT *
+FROM Book
+WHERE publication_year = %s;
+""", [('year', int)], "Gets all the books published in a year"),
+
+    'books_by_author': Query("""
+SELECT *
+FROM Book
+WHERE author = %s;
+""", [('author', str)], "Shows all books by an author"),
+
+    'avg_borrow_time_by_genre': Query("""
+SELECT AVG((t.returned_date::date - t.date_borrowed::date)) AS avg_borrow_days
+FROM transaction AS t
+JOIN book AS bo ON t.item_id = bo.item_id
+WHERE bo.genre = %s
+AND t.returned_date IS NOT NULL;
+""", [('genre', str)], "Average borrowing time for books in a genre (in days)"),
+
+    'available_books_by_genre': Query("""
+SELECT
+    b.title,
+    b.item_id
+FROM media_item AS m
+JOIN book AS b ON m.item_id = b.item_id
+WHERE b.genre = %s AND m.availability_status = 'Available';
+""", [('genre', str)], "Lists available books in a genre"),
+
+    'frequent_borrowers_by_genre': Query("""
+SELECT
+    c.client_id,
+    c.name,
+    COUNT(*) AS borrow_count
+FROM transaction AS t
+JOIN media_item AS m ON t.item_id = m.item_id
+JOIN book AS b ON m.item_id = b.item_id
+JOIN client AS c ON t.client_id = c.client_id
+WHERE b.genre = %s AND (t.date_borrowed >= CURRENT_DATE - INTERVAL '1 year')
+GROUP BY c.client_id, c.name
+ORDER BY borrow_count DESC;
+""", [('genre', str)], "Clients who borrowed the most books in a genre this year"),
+}
+
+# The fixed queries these replaced, still accepted by name
+ALIASES = {
+    'trans_history_11'               : ('trans_history', ['11']),
+    'check_client_42'                : ('check_client', ['42']),
+    'books_of_2007'                  : ('books_of_year', ['2007']),
+    'books_by_stephen_king'          : ('books_by_author', ['Stephen King']),
+    'avg_borro_time_science_fiction' : ('avg_borrow_time_by_genre', ['Science Fiction']),
+    'book_mystery_availability'      : ('available_books_by_genre', ['Mystery']),
+    'frequent_borrower_romance'      : ('frequent_borrowers_by_genre', ['Romance']),
+}
+
+# Names prepared on each connection. A reconnect is a new connection object, so it starts empty
+_prepared = weakref.WeakKeyDictionary()
+
+def resolve(name, args):
+    """Look a query up by name or alias, returning (name, query, converted args). Raises ValueError."""
+    if name in ALIASES:
+        if args:
+            raise ValueError(f"{name} takes no arguments, use {ALIASES[name][0]} for other values")
+        name, args = ALIASES[name]
+
+    if name not in QUERIES:
+        raise ValueError(f"No query is available for {name}")
+
+    query = QUERIES[name]
+    if len(args) != len(query.params):
+        raise ValueError(f"Usage: query {usage(name)}")
+
+    values = []
+    for (param, convert), arg in zip(query.params, args):
+        try:
+            values.append(convert(arg))
+        except ValueError:
+            raise ValueError(f"{param} must be {SQL_TYPES[convert]}, got {arg!r}")
+
+    return name, query, values
+
+def usage(name):
+    """Name and parameters of a query, as typed at the prompt."""
+    return ' '.join([name] + [f"<{param}>" for param, _ in QUERIES[name].params])
+
+def statement_name(name):
+    return f"registry_{name}"
+
+def prepare_statement(name, query):
+    """Build the PREPARE for a query, numbering its %s placeholders $1, $2, ..."""
+    parts = query.sql.strip().rstrip(';').split('%s')
+    body = parts[0] + ''.join(f"${i}{part}" for i, part in enumerate(parts[1:], start=1))
+    types = sql.SQL('')
+    if query.params:
+        types = sql.SQL(' ({})').format(sql.SQL(', ').join(sql.SQL(SQL_TYPES[convert]) for _, convert in query.params))
+    return sql.SQL("PREPARE {name}{types} AS {body}").format(
+            name=sql.Identifier(statement_name(name)), types=types, body=sql.SQL(body))
+
+def execute(cursor, name, args):
+    """Run a registered query on cursor, preparing it first if its connection hasn't yet."""
+    name, query, values = resolve(name, args)
+    prepared = _prepared.setdefault(cursor.connection, set())
+
+    if name not in prepared:
+        # The session may still hold it from an earlier run that lost track of it. Asking first
+        # leaves the caller's transaction alone, where a failed PREPARE would abort it
+        cursor.execute("SELECT 1 FROM pg_prepared_statements WHERE name = %s", (statement_name(name),))
+        if cursor.fetchone() is None:
+            cursor.execute(prepare_statement(name, query))
+        prepared.add(name)
+
+    placeholders = sql.SQL('')
+    if values:
+        placeholders = sql.SQL(' ({})').format(sql.SQL(', ').join(sql.Placeholder() for _ in values))
+    cursor.execute(sql.SQL("EXECUTE {name}{args}").format(name=sql.Identifier(statement_name(name)), args=placeholders), values)
+
+def forget(connection):
+    """Drop what is known to be prepared on a connection, for example after the server lost it."""
+    _prepared.pop(connection, None)
+
+def render(cursor, name, args=()):
+    """The query text with its arguments bound, for EXPLAIN and logging."""
+    name, query, values = resolve(name, list(args))
+    return cursor.mogrify(query.sql, values).decode()
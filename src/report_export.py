@@ -0,0 +1,71 @@
+"""
+Export query results to files with COPY (query) TO STDOUT.
+
+CSV is written straight from the COPY stream. Parquet goes through a CSV spool file next to
+the target and is converted chunk by chunk with pandas, one part file per chunk, so neither
+format ever holds the whole result in memory. Parquet needs pyarrow (or fastparquet)
+installed, it isn't a dependency of the CLI otherwise.
+"""
+
+import os
+import tempfile
+
+# Rows per Parquet part file
+PARQUET_CHUNK_SIZE = 100000
+
+# pandas dtypes for the Postgres types the reports return, by type OID. Anything else is text.
+# Fixing the dtypes up front keeps every part's schema the same, whatever values a chunk has
+PANDAS_DTYPES = {
+    16: 'boolean',                    # bool
+    20: 'Int64', 21: 'Int64', 23: 'Int64',   # int8, int2, int4
+    700: 'float64', 701: 'float64',   # float4, float8
+    1700: 'float64',                  # numeric
+}
+DATETIME_OIDS = {1082, 1114, 1184}    # date, timestamp, timestamptz
+
+def copy_statement(query):
+    return f"COPY ({query.strip().rstrip(';')}) TO STDOUT WITH (FORMAT csv, HEADER)"
+
+def export_csv(cursor, query, path):
+    """Stream a query's result into a CSV file with a header row."""
+    with open(path, 'w', newline='') as csv_file:
+        cursor.copy_expert(copy_statement(query), csv_file)
+    return path
+
+def column_types(cursor, query):
+    """Column names with their pandas dtype, or None for dates, read from a zero row run of query."""
+    cursor.execute(f"SELECT * FROM ({query.strip().rstrip(';')}) AS export LIMIT 0")
+    columns = []
+    for column in cursor.description:
+        dtype = None if column.type_code in DATETIME_OIDS else PANDAS_DTYPES.get(column.type_code, 'string')
+        columns.append((column.name, dtype))
+    return columns
+
+def export_parquet(cursor, query, path, chunk_size=PARQUET_CHUNK_SIZE):
+    """Write a query's result as a directory of Parquet part files, chunk_size rows each."""
+    # Only the export needs pandas, keep it off the CLI's startup
+    import pandas as pd
+
+    columns = column_types(cursor, query)
+    dtypes = {name: dtype for name, dtype in columns if dtype}
+    dates = [name for name, dtype in columns if dtype is None]
+
+    os.makedirs(path, exist_ok=True)
+    spool = tempfile.NamedTemporaryFile('wb', suffix='.csv', dir=path, delete=False)
+    try:
+        with spool:
+            cursor.copy_expert(copy_statement(query), spool)
+
+        parts = 0
+        read_options = dict(dtype=dtypes, parse_dates=dates, true_values=['t'], false_values=['f'])
+        for chunk in pd.read_csv(spool.name, chunksize=chunk_size, **read_options):
+            chunk.to_parquet(os.path.join(path, f"part-{parts:05d}.parquet"), index=False)
+            parts += 1
+
+        # An empty result still gets a part, so readers see the columns
+        if not parts:
+            pd.read_csv(spool.name, **read_options).to_parquet(os.path.join(path, "part-00000.parquet"), index=False)
+            parts = 1
+    finally:
+        os.remove(spool.name)
+    return parts
@@ -0,0 +1,85 @@
+"""
+In-memory cache of query results for the CLI session.
+
+Entries are keyed by query name and parameters and expire after a per-query TTL. The cache
+holds at most MAX_ENTRIES results, evicting the least recently used, and results longer than
+MAX_ROWS are never stored so a big report can't fill memory. Anything run through the
+execute admin command may change data, so it clears the whole cache. Batches run queries on
+several threads at once, so every method holds the cache's lock.
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+# Results kept at once, least recently used evicted first
+MAX_ENTRIES = 128
+
+# Results with more rows than this are streamed but not cached
+MAX_ROWS = 10000
+
+class ResultCache:
+    def __init__(self, max_entries=MAX_ENTRIES, max_rows=MAX_ROWS):
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return (rows, age in seconds) for a live entry, or None."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            rows, stored_at, expires_at = entry
+            now = time.monotonic()
+            if now >= expires_at:
+                del self.entries[key]
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return rows, now - stored_at
+
+    def put(self, key, rows, ttl):
+        """Store a result for ttl seconds. Results over max_rows, or with no ttl, aren't kept."""
+        with self.lock:
+            if not ttl or len(rows) > self.max_rows:
+                return
+
+            now = time.monotonic()
+            self.entries[key] = (rows, now, now + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, name=None):
+        """Drop every entry, or only those for one query name."""
+        with self.lock:
+            if name is None:
+                self.entries.clear()
+            else:
+                for key in [key for key in self.entries if key[0] == name]:
+                    del self.entries[key]
+            self.invalidations += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'rows': sum(len(rows) for rows, _, _ in self.entries.values()),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
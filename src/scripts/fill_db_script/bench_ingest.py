@@ -0,0 +1,232 @@
+"""
+Benchmark the fill_db ingest pipeline against a local PostgreSQL.
+
+For each dataset size a synthetic workbook is generated, then every load strategy runs in its
+own fresh process: Excel read, parse_workbook, validation and the database load are timed
+separately and the process' peak RSS is recorded. Results are appended as JSON lines so runs
+can be compared over time. Uses the same DB_* environment settings as fill_db, for example:
+
+    python src/scripts/fill_db_script/bench_ingest.py --sizes 1000 10000 100000 --output bench_results.jsonl
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import datetime
+import resource
+import contextlib
+import multiprocessing
+import numpy as np
+import pandas as pd
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+from dotenv import load_dotenv
+
+import fill_db
+import generate_data
+from validate import validate_tables
+
+STRATEGIES = ['insert_row', 'batched', 'copy']
+
+# Rows per statement for the batched strategy
+BATCH_PAGE_SIZE = 1000
+
+# Seconds between checks that a strategy's process is still alive
+POLL_INTERVAL = 1
+
+# Workbooks generated for the runs are kept here between invocations
+WORKBOOK_DIR = ".fill_db_bench"
+
+def dataset_shape(transactions):
+    """Clients and items to go with a transaction count, keeping the ratios of a real library."""
+    return max(transactions // 50, 10), max(transactions // 20, 10)
+
+def build_workbook(path, transactions, seed):
+    """Write a synthetic workbook with the same sheets and headers as the real export."""
+    clients, items = dataset_shape(transactions)
+    rng = np.random.default_rng(seed)
+    as_of = datetime.datetime(2025, 1, 1)
+
+    open_item_ids = np.sort(rng.choice(items, min(items // 5, transactions), replace=False)) + 1
+    open_items = np.zeros(items, dtype=bool)
+    open_items[open_item_ids - 1] = True
+    item_type = rng.choice(list(generate_data.ITEM_TYPE_MIX), items, p=list(generate_data.ITEM_TYPE_MIX.values()))
+    item_ids = np.arange(1, items + 1)
+    authors = ['Stephen King'] + [f"{first} {last}" for last in generate_data.LAST_NAMES for first in generate_data.FIRST_NAMES]
+    author_weights = generate_data.zipf_weights(len(authors), 1.1)
+
+    titled = ['Item_ID', 'Title', 'Author', 'ISBN', 'Genre', 'Publication_Year']
+    sheets = {
+        'Client': pd.DataFrame(generate_data.client_rows(rng, clients),
+                               columns=['Client_ID', 'Name', 'Membership_Type', 'Account_Status', 'Email_Address', 'Phone_Number']),
+        'MediaItem': pd.DataFrame(generate_data.media_item_rows(items, open_items), columns=['Item_ID', 'Availability_Status']),
+        'Book': pd.DataFrame(generate_data.titled_rows(rng, item_ids[item_type == 'Book'], authors, author_weights, as_of, '978'),
+                             columns=titled),
+        'Magazine': pd.DataFrame(generate_data.magazine_rows(rng, item_ids[item_type == 'Magazine'], as_of),
+                                 columns=['Item_ID', 'Title', 'Publication_Date', 'Issue_Number']),
+        'DigitalMedia': pd.DataFrame(generate_data.titled_rows(rng, item_ids[item_type == 'DigitalMedia'], authors, author_weights, as_of, '979'),
+                                     columns=titled),
+        'Transaction': pd.DataFrame(generate_data.transaction_rows(rng, clients, items, transactions, open_item_ids, 0.1, 3 * 365, as_of),
+                                    columns=['Client_ID', 'Item_ID', 'Date_Borrowed', 'Expected_Return_Date', 'Date_Returned']),
+    }
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with pd.ExcelWriter(path) as writer:
+        for sheet, frame in sheets.items():
+            frame.to_excel(writer, sheet_name=sheet, index=False)
+
+def batched_populate_table(sheet_name, columns, rows, page_size=BATCH_PAGE_SIZE):
+    """Load with multi-row INSERT statements, committing once per table."""
+    target_columns, indexes = fill_db.map_columns(sheet_name, columns)
+    conn, db = fill_db.open_db_conn()
+
+    if not conn:
+        print(f"[SKIPPED] {sheet_name}: could not connect to DB.")
+        return
+
+    cursor = conn.cursor()
+    query = sql.SQL("INSERT INTO {table} ({fields}) VALUES %s").format(
+            table=sql.Identifier(fill_db.TABLE_MAP[sheet_name]),
+            fields=sql.SQL(', ').join(sql.Identifier(c) for c in target_columns)
+    ).as_string(conn)
+    try:
+        execute_values(cursor, query, [tuple(row[i] for i in indexes) for row in rows], page_size=page_size)
+        conn.commit()
+    finally:
+        cursor.close()
+        db.close()
+
+def reset_tables(ddl_path):
+    """Drop and recreate the schema so every strategy loads into empty tables."""
+    conn, db = fill_db.open_db_conn()
+    cursor = conn.cursor()
+    fill_db.drop_table(cursor, conn)
+    cursor.close()
+    db.close()
+    fill_db.create_tables(ddl_path)
+
+def peak_rss_kb():
+    """Peak resident set size of this process so far, in KiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+def run_strategy(workbook_path, strategy, ddl_path, results):
+    """Time each ingest stage for one strategy. Runs in a child process so RSS is its own."""
+    load_dotenv()
+    stages = {}
+
+    # The pipeline's own logging would dominate the timings
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        reset_tables(ddl_path)
+
+        start = time.perf_counter()
+        workbooks = {sheet: fill_db.read_sheet(workbook_path, sheet) for sheet in fill_db.SHEET_NAMES}
+        stages['read'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        tables_data = {sheet: fill_db.parse_workbook_columns(sheet, workbooks[sheet]) for sheet in fill_db.SHEET_NAMES}
+        stages['parse'] = time.perf_counter() - start
+        del workbooks
+
+        start = time.perf_counter()
+        tables_data, _ = validate_tables(tables_data, fill_db.SHEET_NAMES, fill_db.COLUMN_MAP)
+        stages['validate'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for sheet in fill_db.SHEET_NAMES:
+            columns, rows = tables_data[sheet]
+            if strategy == 'insert_row':
+                fill_db.populate_table(sheet, (dict(zip(columns, row)) for row in rows))
+            elif strategy == 'batched':
+                batched_populate_table(sheet, columns, rows)
+            else:
+                fill_db.bulk_populate_table(sheet, columns, rows)
+        stages['load'] = time.perf_counter() - start
+
+    rows = sum(len(rows) for _, rows in tables_data.values())
+    results.put({'stages': stages, 'rows': rows, 'peak_rss_kb': peak_rss_kb()})
+
+def wait_for_result(worker, results, timeout=None):
+    """
+    Wait for a strategy's result, returning (result, None), or (None, reason) if its process
+    died without one or ran longer than timeout seconds, in which case it is stopped.
+    """
+    deadline = time.perf_counter() + timeout if timeout else None
+    while True:
+        try:
+            return results.get(timeout=POLL_INTERVAL), None
+        except queue.Empty:
+            pass
+
+        if not worker.is_alive():
+            # It may have put its result just before exiting
+            try:
+                return results.get(timeout=POLL_INTERVAL), None
+            except queue.Empty:
+                return None, f"exited with code {worker.exitcode}"
+        if deadline and time.perf_counter() > deadline:
+            worker.terminate()
+            return None, f"timed out after {timeout}s"
+
+def benchmark(sizes, strategies, output, seed=447, ddl_path="src/libraryDDL.sql", timeout=None):
+    """
+    Run every strategy at every size, appending one JSON line per run to output. A run that
+    crashes or takes longer than timeout seconds is recorded as failed and the rest carry on.
+    """
+    load_dotenv()
+    context = multiprocessing.get_context('spawn')
+
+    for size in sizes:
+        workbook_path = os.path.join(WORKBOOK_DIR, f"bench_{size}_{seed}.xlsx")
+        if not os.path.exists(workbook_path):
+            print(f"[INFO] Generating workbook with {size} transactions...")
+            build_workbook(workbook_path, size, seed)
+
+        for strategy in strategies:
+            results = context.Queue()
+            worker = context.Process(target=run_strategy, args=(workbook_path, strategy, ddl_path, results))
+            worker.start()
+            result, error = wait_for_result(worker, results, timeout)
+            worker.join()
+
+            if result is None:
+                record = {
+                    'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+                    'transactions': size,
+                    'strategy': strategy,
+                    'failed': error,
+                }
+                with open(output, 'a') as output_file:
+                    output_file.write(json.dumps(record) + "\n")
+                print(f"[ERROR] {size:>9} {strategy:<10} {error}")
+                continue
+
+            record = {
+                'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+                'transactions': size,
+                'strategy': strategy,
+                'rows': result['rows'],
+                'peak_rss_kb': result['peak_rss_kb'],
+                'seconds': result['stages'],
+                'rows_per_sec': {stage: round(result['rows'] / seconds, 1) if seconds else None
+                                 for stage, seconds in result['stages'].items()},
+            }
+            with open(output, 'a') as output_file:
+                output_file.write(json.dumps(record) + "\n")
+
+            rates = ', '.join(f"{stage} {rate:,.0f}/s" for stage, rate in record['rows_per_sec'].items() if rate)
+            print(f"[RESULT] {size:>9} {strategy:<10} {rates}, peak RSS {record['peak_rss_kb'] / 1024:.0f} MiB")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the fill_db ingest stages and load strategies.")
+    parser.add_argument("--sizes", type=int, nargs='+', default=[1000, 10000, 100000], help="transaction counts to run")
+    parser.add_argument("--strategies", nargs='+', choices=STRATEGIES, default=STRATEGIES)
+    parser.add_argument("--seed", type=int, default=447)
+    parser.add_argument("--output", default="bench_results.jsonl")
+    parser.add_argument("--timeout", type=float, help="seconds before a run is stopped and recorded as failed")
+    args = parser.parse_args()
+
+    benchmark(args.sizes, args.strategies, args.output, args.seed, timeout=args.timeout)
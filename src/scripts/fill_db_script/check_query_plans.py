@@ -0,0 +1,190 @@
+"""
+Plan regression check for the canned queries in cli_commands.py.
+
+Loads a generated dataset (see generate_data.py), runs EXPLAIN on every named query and
+fails on any sequential scan of Transaction, or of one of its partitions, that isn't
+exempt. Exemptions are per scan: each names the query, the scan's filter and how many
+months of loans it may read, with the reason why. Also run after every generate_data.py
+load. Uses the same DB_* environment settings as fill_db:
+
+    python src/scripts/fill_db_script/check_query_plans.py --transactions 1000000
+"""
+
+import os
+import sys
+import json
+import datetime
+import argparse
+from dotenv import load_dotenv
+
+from fill_db import open_db_conn, create_tables
+from generate_data import generate
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+import cli_commands as cli
+import query_registry
+
+# Every canned query the check EXPLAINs
+QUERIES = [
+    'trans_history_11',
+    'currently_checked_out',
+    'members_with_overdue_books',
+    'books_due_soon',
+    'books_by_stephen_king',
+    'most_pop_author_last_month',
+    'clients_exceeding_borr_lims',
+    'overdue_items_report',
+    'revenue_summary',
+    'monthly_summary_report',
+    'monthly_fees_report',
+    'books_of_2007',
+    'check_client_42',
+    'owed_fines_per_client',
+    'book_mystery_availability',
+    'frequent_borrower_romance',
+    'never_late_clients',
+    'member_engagement_report',
+    'frequent_borrowed_items_by_type',
+    'avg_loan_duration',
+    'avg_borro_time_science_fiction',
+    'borrowing_history_report',
+    'item_availability_and_history',
+]
+
+# Sequential scans of Transaction allowed per query, as (filter, months, reason). A scan is
+# exempt only if its Filter is exactly the one given (None for a scan keeping every row). With
+# months None it may read the whole history. With a number it may only read the partitions of
+# that many months back up to now, so it needs Transaction partitioned: the same scan of the
+# unpartitioned table, or of older partitions, fails.
+EXEMPT_SCANS = {
+    'member_engagement_report': [(None, None, "counts every loan of every client")],
+    'frequent_borrowed_items_by_type': [(None, None, "counts every loan of every book")],
+    'borrowing_history_report': [(None, None, "returns every loan")],
+    'item_availability_and_history': [(None, None, "returns every loan")],
+    'avg_loan_duration': [("(returned_date IS NOT NULL)", None, "averages every returned loan")],
+    'avg_borro_time_science_fiction': [("(returned_date IS NOT NULL)", None,
+                                        "averages the returned loans of a whole genre")],
+    'never_late_clients': [("(returned_date > expected_return_date)", None,
+                            "looks for a late return among every loan of every client")],
+    'currently_checked_out': [("(returned_date IS NULL)", 0, "most of this month's loans are still out")],
+    'overdue_items_report': [("(returned_date IS NULL)", 0, "most of this month's loans are still out")],
+    'revenue_summary': [("(returned_date IS NULL)", 0, "most of this month's loans are still out")],
+    'monthly_summary_report': [("(date_borrowed >= date_trunc('month'::text, (CURRENT_DATE)::timestamp with time zone))",
+                                0, "counts this month's loans")],
+    'most_pop_author_last_month': [("(date_borrowed >= (CURRENT_DATE - '1 mon'::interval))", 1,
+                                    "counts last month's loans")],
+    'frequent_borrower_romance': [("(date_borrowed >= (CURRENT_DATE - '1 year'::interval))", 12,
+                                   "counts the last year's loans")],
+}
+
+def plan_nodes(plan):
+    """Walk an EXPLAIN (FORMAT JSON) plan tree depth first."""
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from plan_nodes(child)
+
+def transaction_partitions(cursor):
+    """Transaction's partitions, if it is partitioned, by name: (first month or None, empty)."""
+    cursor.execute("""
+        SELECT child.relname, child.relpages = 0 FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = 'transaction'::regclass
+    """)
+    partitions = {}
+    for name, empty in cursor.fetchall():
+        try:
+            month = datetime.datetime.strptime(name, 'transaction_%Y_%m').date()
+        except ValueError:
+            month = None
+        partitions[name] = (month, empty)
+    return partitions
+
+def scan_exemption(name, node, partitions):
+    """The reason a sequential scan of Transaction is allowed, or None if it isn't."""
+    relation = node['Relation Name']
+    month, empty = partitions.get(relation, (None, False))
+    # A partition the planner sees as empty has no pages to read, an index wouldn't help
+    if empty:
+        return "empty partition"
+
+    for scan_filter, months, reason in EXEMPT_SCANS.get(name, []):
+        if node.get('Filter') != scan_filter:
+            continue
+        if months is None:
+            return reason
+        first_month = datetime.date.today().replace(day=1)
+        for _ in range(months):
+            first_month = (first_month - datetime.timedelta(days=1)).replace(day=1)
+        if month and month >= first_month:
+            return reason
+    return None
+
+def transaction_seq_scans(cursor, name, query, partitions):
+    """EXPLAIN a query, returning the plan and its sequential scans of Transaction with their exemptions."""
+    cursor.execute("EXPLAIN (FORMAT JSON) " + query)
+    plan = cursor.fetchone()[0][0]['Plan']
+    scans = [(node, scan_exemption(name, node, partitions)) for node in plan_nodes(plan)
+             if node['Node Type'] == 'Seq Scan' and node.get('Relation Name') in set(partitions) | {'transaction'}]
+    return plan, scans
+
+def canned_query(cursor, name):
+    """Text of a canned query, with the registered ones bound to their alias' arguments."""
+    if name in query_registry.ALIASES:
+        return query_registry.render(cursor, name)
+    return getattr(cli, name)
+
+def check_plans(verbose=False):
+    """EXPLAIN every canned query, returning the ones that scan Transaction without an exemption."""
+    conn, db = open_db_conn()
+    if not conn:
+        raise Exception("Failed to establish database connection for the plan check.")
+
+    failures = []
+    cursor = conn.cursor()
+    try:
+        partitions = transaction_partitions(cursor)
+        for name in QUERIES:
+            plan, scans = transaction_seq_scans(cursor, name, canned_query(cursor, name), partitions)
+            refused = [node for node, reason in scans if reason is None]
+            reasons = sorted({reason for _, reason in scans if reason and reason != "empty partition"})
+
+            if refused:
+                failures.append(name)
+                status = "FAIL"
+            elif reasons:
+                status = f"scan allowed: {'; '.join(reasons)}"
+            else:
+                status = "ok"
+
+            print(f"[{'ERROR' if refused else 'INFO'}] {name:<32} {status}, estimated cost {plan['Total Cost']:.0f}")
+            for scan_filter in sorted({node.get('Filter') or '' for node in refused}):
+                relations = sorted(node['Relation Name'] for node in refused if (node.get('Filter') or '') == scan_filter)
+                scanned = ', '.join(relations) if len(relations) <= 3 else f"{len(relations)} partitions"
+                print(f"[ERROR]     Seq Scan of {scanned}, filter {scan_filter or 'none'}")
+            if verbose or refused:
+                print(json.dumps(plan, indent=2))
+    finally:
+        cursor.close()
+        db.close()
+
+    return failures
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fail if a canned query sequentially scans Transaction without an exemption.")
+    parser.add_argument("--transactions", type=int, default=1000000, help="size of the generated dataset")
+    parser.add_argument("--skip-generate", action="store_true", help="check against the data already loaded")
+    parser.add_argument("--verbose", action="store_true", help="print every plan")
+    parser.add_argument("--partition-transactions", action="store_true", help="create Transaction partitioned by month")
+    args = parser.parse_args()
+
+    load_dotenv()
+    if not args.skip_generate:
+        if not create_tables("src/libraryDDL.sql", args.partition_transactions):
+            raise Exception("Failed to create tables from DDL file.")
+        generate(clients=max(args.transactions // 50, 10), items=max(args.transactions // 20, 10),
+                 transactions=args.transactions, truncate=True)
+
+    failures = check_plans(args.verbose)
+    if failures:
+        print(f"[ERROR] Sequential scan of Transaction in: {', '.join(failures)}")
+        sys.exit(1)
+    print("[SUCCESS] Every sequential scan of Transaction is exempt.")
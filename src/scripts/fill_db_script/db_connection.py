@@ -1,36 +1,125 @@
+import time
+import threading
 import psycopg2
+from contextlib import contextmanager
+from psycopg2 import pool
+from psycopg2 import extensions
+
+# Connections idle for longer than this are pinged before being handed out again
+HEALTH_CHECK_INTERVAL = 30
 
 class PostgresDB:
+    # Pools are shared by every PostgresDB pointing at the same database, keyed on the DSN
+    _pools = {}
+    _pools_lock = threading.Lock()
+
     def __init__(self,
                  host="libdb-25co-postgres.cajikaswgj3d.us-east-1.rds.amazonaws.com",
                  dbname="postgres",
                  user="LibDB_25Co",
-                 password="null"):
+                 password="null",
+                 min_size=1,
+                 max_size=10):
         self.host = host
         self.dbname = dbname
         self.user = user
         self.password = password
+        self.min_size = min_size
+        self.max_size = max_size
         self.conn = None
 
+    def get_pool(self):
+        """Return the shared pool for this database, opening it on first use."""
+        key = (self.host, self.dbname, self.user, self.password)
+        with PostgresDB._pools_lock:
+            if key not in PostgresDB._pools:
+                connection_pool = pool.ThreadedConnectionPool(
+                    self.min_size,
+                    self.max_size,
+                    host=self.host,
+                    database=self.dbname,
+                    user=self.user,
+                    password=self.password
+                )
+                connection_pool.last_used = {}
+                PostgresDB._pools[key] = connection_pool
+            return PostgresDB._pools[key]
+
+    def checkout(self):
+        """Take a healthy connection out of the pool."""
+        connection_pool = self.get_pool()
+        conn = connection_pool.getconn()
+
+        # Replace the connection if the server dropped it while it sat in the pool
+        if not self.is_healthy(conn, connection_pool.last_used.get(id(conn), time.monotonic())):
+            connection_pool.putconn(conn, close=True)
+            conn = connection_pool.getconn()
+
+        return conn
+
+    def checkin(self, conn):
+        """Hand a connection back to the pool, discarding whatever transaction it left open."""
+        connection_pool = self.get_pool()
+        if conn.closed:
+            connection_pool.putconn(conn, close=True)
+            return
+
+        if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+        if conn.autocommit:
+            conn.autocommit = False
+
+        connection_pool.last_used[id(conn)] = time.monotonic()
+        connection_pool.putconn(conn)
+
+    @staticmethod
+    def is_healthy(conn, last_used):
+        """Check a pooled connection, only going to the server if it has been idle a while."""
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < HEALTH_CHECK_INTERVAL:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @contextmanager
+    def connection(self):
+        """Check a connection out for the duration of a with block."""
+        conn = self.checkout()
+        try:
+            yield conn
+        finally:
+            self.checkin(conn)
+
     def connect(self):
         try:
-            self.conn = psycopg2.connect(
-                host=self.host,
-                database=self.dbname,
-                user=self.user,
-                password=self.password
-            )
+            self.conn = self.checkout()
             print("DB connection successful")
             return self.conn
-        except Exception as e:       
+        except Exception as e:
             print(f"[ERROR] DB connection failure: {e}")
             return None
 
     def close(self):
         if self.conn:
-            self.conn.close()
+            self.checkin(self.conn)
+            self.conn = None
             print("DB connection closed")
 
+    @classmethod
+    def close_all(cls):
+        """Close every pooled connection, for use when the process is shutting down."""
+        with cls._pools_lock:
+            for connection_pool in cls._pools.values():
+                connection_pool.closeall()
+            cls._pools.clear()
+
 # Only run when called directly
 if __name__ == "__main__":
     db = PostgresDB()
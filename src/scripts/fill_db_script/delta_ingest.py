@@ -0,0 +1,253 @@
+import hashlib
+from psycopg2 import sql
+from psycopg2.extras import execute_values, Json
+
+# Columns matching a sheet's rows to the table's. Transactions are matched on the loan itself,
+# the full load leaves transaction_id to the SERIAL so the sheet's ids mean nothing in the table
+ROW_KEYS = {
+        'Client'       : ('client_id',),
+        'Transaction'  : ('client_id', 'item_id', 'date_borrowed'),
+        'MediaItem'    : ('item_id',),
+        'Book'         : ('item_id',),
+        'Magazine'     : ('item_id',),
+        'DigitalMedia' : ('item_id',),
+    }
+
+# SERIAL keys that have to be moved past ids written explicitly by a load
+SERIAL_KEYS = {
+        'client'       : 'client_id',
+        'media_item'   : 'item_id',
+        'transaction'  : 'transaction_id',
+    }
+
+# Rows per INSERT ... ON CONFLICT statement
+UPSERT_PAGE_SIZE = 1000
+
+def row_hash(row):
+    """Fingerprint a single parsed row."""
+    return hashlib.sha1(repr(row).encode()).hexdigest()
+
+def sheet_fingerprint(columns, row_hashes):
+    """Fingerprint a whole sheet from its columns and row hashes, independent of row order."""
+    digest = hashlib.sha256(repr(columns).encode())
+    for key, value in sorted(row_hashes.items(), key=lambda item: repr(item[0])):
+        digest.update(f"{key!r}:{value}".encode())
+    return digest.hexdigest()
+
+def row_key(row, key_indexes):
+    """
+    A row's key as stored in the manifest: the value itself for a single column, otherwise a
+    tuple with dates written out, so it survives the JSON round trip unchanged.
+    """
+    if len(key_indexes) == 1:
+        return row[key_indexes[0]]
+    return tuple(row[i].isoformat() if hasattr(row[i], 'isoformat') else row[i] for i in key_indexes)
+
+def read_manifests(cursor):
+    """Load the manifest of every sheet loaded incrementally since the tables were last filled, {sheet: manifest}."""
+    cursor.execute("SELECT sheet, columns, row_key, fingerprint, row_hashes FROM Load_Manifest")
+    manifests = {}
+    for sheet, columns, key, fingerprint, row_hashes in cursor.fetchall():
+        manifests[sheet] = {'columns': columns,
+                            'key': key,
+                            'fingerprint': fingerprint,
+                            'rows': {tuple(k) if isinstance(k, list) else k: v for k, v in row_hashes}}
+    return manifests
+
+def write_manifest(cursor, sheet, columns, fingerprint, row_hashes):
+    """Record what was loaded for a sheet. Rows are stored as pairs so keys keep their type."""
+    cursor.execute("""
+        INSERT INTO Load_Manifest (sheet, columns, row_key, fingerprint, row_hashes) VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (sheet) DO UPDATE
+        SET columns = EXCLUDED.columns, row_key = EXCLUDED.row_key,
+            fingerprint = EXCLUDED.fingerprint, row_hashes = EXCLUDED.row_hashes
+    """, (sheet, Json(columns), Json(list(ROW_KEYS[sheet])), fingerprint,
+          Json([[key, value] for key, value in row_hashes.items()])))
+
+def clear_manifests(cursor):
+    """Forget every manifest, for loads that fill the tables some other way. Does nothing before the table exists."""
+    cursor.execute("SELECT to_regclass('load_manifest') IS NOT NULL")
+    if cursor.fetchone()[0]:
+        cursor.execute("DELETE FROM Load_Manifest")
+
+def diff_sheet(sheet, columns, rows, manifest):
+    """Work out which rows changed since the manifest, returning (upserts, deleted keys, row hashes)."""
+    key_indexes = [columns.index(c) for c in ROW_KEYS[sheet]]
+
+    # Key the rows, a repeated key keeps its last row like a sequence of inserts would
+    keyed = {}
+    skipped = 0
+    for row in rows:
+        if any(row[i] is None for i in key_indexes):
+            skipped += 1
+            continue
+        keyed[row_key(row, key_indexes)] = row
+    if skipped:
+        print(f"[WARNING] {sheet}: ignoring {skipped} rows without a {', '.join(ROW_KEYS[sheet])}.")
+
+    row_hashes = {key: row_hash(row) for key, row in keyed.items()}
+
+    if manifest and manifest['key'] != list(ROW_KEYS[sheet]):
+        # Its keys can't be matched to these rows, reload everything and start a new manifest
+        print(f"[WARNING] {sheet}: the manifest is keyed on {', '.join(manifest['key'])}, rebuilding it. "
+              f"Rows removed from the sheet before this load stay in the table.")
+        manifest = None
+
+    previous = manifest['rows'] if manifest else {}
+    if manifest and manifest['columns'] != columns:
+        # The row hashes changed with the columns, so every row is rewritten. The keys still tell what was removed
+        print(f"[INFO] {sheet}: columns changed since the last load, reloading every row.")
+        upserts = list(keyed.values())
+    else:
+        upserts = [keyed[key] for key, value in row_hashes.items() if previous.get(key) != value]
+    deletes = [key for key in previous if key not in row_hashes]
+
+    return upserts, deletes, row_hashes
+
+def upsert_rows(cursor, table_name, key_column, target_columns, rows):
+    """Insert rows, updating the ones whose key already exists."""
+    updates = [c for c in target_columns if c != key_column]
+    if updates:
+        on_conflict = sql.SQL("DO UPDATE SET {}").format(sql.SQL(', ').join(
+            sql.SQL("{col} = EXCLUDED.{col}").format(col=sql.Identifier(c)) for c in updates))
+    else:
+        on_conflict = sql.SQL("DO NOTHING")
+
+    query = sql.SQL("INSERT INTO {table} ({fields}) VALUES %s ON CONFLICT ({key}) {action}").format(
+            table=sql.Identifier(table_name),
+            fields=sql.SQL(', ').join(sql.Identifier(c) for c in target_columns),
+            key=sql.Identifier(key_column),
+            action=on_conflict
+    )
+    execute_values(cursor, query.as_string(cursor), rows, page_size=UPSERT_PAGE_SIZE)
+
+def replace_rows(cursor, table_name, key_columns, target_columns, rows):
+    """
+    Delete then insert rows. For keys without a unique index to conflict on, like the
+    transactions' or any key of a partitioned table, whose unique indexes need the partition column.
+    """
+    key_indexes = [target_columns.index(c) for c in key_columns]
+    delete_rows(cursor, table_name, key_columns, [row_key(row, key_indexes) for row in rows])
+
+    query = sql.SQL("INSERT INTO {table} ({fields}) VALUES %s").format(
+            table=sql.Identifier(table_name),
+            fields=sql.SQL(', ').join(sql.Identifier(c) for c in target_columns)
+    )
+    execute_values(cursor, query.as_string(cursor), rows, page_size=UPSERT_PAGE_SIZE)
+
+def is_partitioned(cursor, table_name):
+    """Check whether a table was created as a partitioned table."""
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))", (table_name,))
+    return cursor.fetchone()[0]
+
+def delete_rows(cursor, table_name, key_columns, keys):
+    """Delete the rows with the given keys, as made by row_key()."""
+    if len(key_columns) == 1:
+        query = sql.SQL("DELETE FROM {table} WHERE {key} = ANY(%s)").format(
+                table=sql.Identifier(table_name),
+                key=sql.Identifier(key_columns[0])
+        )
+        cursor.execute(query, (list(keys),))
+        return
+
+    # Cast each key column to the table's type, the manifest holds dates as text
+    cursor.execute("SELECT attname, format_type(atttypid, atttypmod) FROM pg_attribute "
+                   "WHERE attrelid = to_regclass(%s) AND attname = ANY(%s)", (table_name, list(key_columns)))
+    types = dict(cursor.fetchall())
+    template = "(" + ", ".join(f"%s::{types[c]}" for c in key_columns) + ")"
+
+    query = sql.SQL("DELETE FROM {table} t USING (VALUES %s) AS gone ({fields}) WHERE {match}").format(
+            table=sql.Identifier(table_name),
+            fields=sql.SQL(', ').join(sql.Identifier(c) for c in key_columns),
+            match=sql.SQL(' AND ').join(
+                sql.SQL("t.{col} = gone.{col}").format(col=sql.Identifier(c)) for c in key_columns)
+    )
+    execute_values(cursor, query.as_string(cursor), list(keys), template=template, page_size=UPSERT_PAGE_SIZE)
+
+def reset_sequences(cursor):
+    """Move the SERIAL sequences past the highest ids written explicitly."""
+    for table_name, key_column in SERIAL_KEYS.items():
+        cursor.execute(sql.SQL(
+            "SELECT setval(pg_get_serial_sequence(%s, %s), GREATEST((SELECT MAX({key}) FROM {table}), 1))"
+        ).format(key=sql.Identifier(key_column), table=sql.Identifier(table_name)), (table_name, key_column))
+
+def incremental_load(conn, file_path, sheet_names, table_map, map_columns, parse_sheet):
+    """
+    Apply only what changed in the workbook since the last incremental load.
+
+    Sheets whose fingerprint matches their manifest are skipped. Changed rows are upserted
+    in sheet order and removed rows deleted in reverse order, so the foreign keys hold
+    throughout. The rows and the manifests in Load_Manifest are written in one transaction,
+    so a failed run is simply retried in full next time.
+    """
+    cursor = conn.cursor()
+    try:
+        manifests = read_manifests(cursor)
+        conn.commit()
+    finally:
+        cursor.close()
+
+    changes = []
+
+    for sheet in sheet_names:
+        columns, rows = parse_sheet(file_path, sheet)
+        if not columns:
+            print(f"[SKIPPED] {sheet}: empty or failed to parse.")
+            continue
+
+        manifest = manifests.get(sheet)
+        upserts, deletes, row_hashes = diff_sheet(sheet, columns, rows, manifest)
+        fingerprint = sheet_fingerprint(columns, row_hashes)
+
+        if manifest and manifest['fingerprint'] == fingerprint:
+            print(f"[SKIPPED] {sheet}: unchanged since the last load.")
+            continue
+
+        changes.append((sheet, columns, upserts, deletes, fingerprint, row_hashes))
+
+    if not changes:
+        print("[SUCCESS] Database already matches the workbook.")
+        return
+
+    cursor = conn.cursor()
+    try:
+        for sheet, columns, upserts, _, _, _ in changes:
+            if not upserts:
+                continue
+            target_columns, indexes = map_columns(sheet, columns)
+            rows = [tuple(row[i] for i in indexes) for row in upserts]
+            key_columns = ROW_KEYS[sheet]
+
+            partitioned = is_partitioned(cursor, table_map[sheet])
+            if partitioned and 'date_borrowed' in target_columns:
+                index = target_columns.index('date_borrowed')
+                dates = [row[index] for row in rows if row[index] is not None]
+                if dates:
+                    cursor.execute("SELECT ensure_transaction_partitions(%s::date, %s::date)", (min(dates), max(dates)))
+
+            # ON CONFLICT needs a unique index on exactly the key
+            if partitioned or len(key_columns) > 1:
+                replace_rows(cursor, table_map[sheet], key_columns, target_columns, rows)
+            else:
+                upsert_rows(cursor, table_map[sheet], key_columns[0], target_columns, rows)
+
+        for sheet, _, _, deletes, _, _ in reversed(changes):
+            if deletes:
+                delete_rows(cursor, table_map[sheet], ROW_KEYS[sheet], deletes)
+
+        # Keep the SERIAL sequences ahead of the client and item ids written from the sheets
+        reset_sequences(cursor)
+
+        for sheet, columns, _, _, fingerprint, row_hashes in changes:
+            write_manifest(cursor, sheet, columns, fingerprint, row_hashes)
+
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"[ERROR] Incremental load failed, nothing was applied: {e}")
+        return
+    finally:
+        cursor.close()
+
+    for sheet, _, upserts, deletes, _, _ in changes:
+        print(f"[SUCCESS] {table_map[sheet]}: {len(upserts)} inserted or updated, {len(deletes)} deleted.")
@@ -1,10 +1,20 @@
 import os
+import io
+import csv
+import json
 import openpyxl
 import sqlparse
+import numpy as np
 import pandas as pd
 from psycopg2 import sql 
 from dotenv import load_dotenv
+from functools import partial
 from db_connection import PostgresDB
+from load_scheduler import load_in_dependency_order, table_dependencies, PARALLEL_WORKERS
+from delta_ingest import incremental_load, clear_manifests
+from validate import validate_tables, rejects_summary
+import sheet_cache
+import schema_version
 
 # Map excel sheet names to SQL table names
 TABLE_MAP = {
@@ -16,12 +26,34 @@ TABLE_MAP = {
         'DigitalMedia' : 'digital_media',
     }
 
-def main(test=False, build_tables=False, drop_tables=False):
+# Sheets in the order they have to be loaded to satisfy the foreign keys
+SHEET_NAMES = ['Client', 'MediaItem', 'Book', 'Magazine', 'DigitalMedia', 'Transaction']
+
+# Column name mapping for Transaction table
+COLUMN_MAP = {
+        'date_returned': 'returned_date'
+    }
+
+# Number of rows streamed to the server per COPY statement in bulk mode
+COPY_BATCH_SIZE = 50000
+
+# Directory that receives the rows COPY rejected, one CSV per table
+REJECTS_DIR = "fill_db_rejects"
+
+# Number of spreadsheet rows parsed at a time when streaming the workbook
+STREAM_CHUNK_SIZE = 10000
+
+def main(test=False, build_tables=False, drop_tables=False, bulk=False, stream=False, parallel=False, workers=PARALLEL_WORKERS,
+         incremental=False, validate=False, cache=True, partition_transactions=False):
     """Execute the data parsing and population logic."""
     load_dotenv()
 
+    # Validation needs every sheet parsed up front, which these loads never do
+    if validate and (incremental or stream or parallel):
+        raise ValueError("validate can't be combined with incremental, stream or parallel loads.")
+
     if drop_tables:
-        conn, _ = open_db_conn()
+        conn, db = open_db_conn()
         if not conn:
             raise Exception("Failed to establish database connection for dropping tables.")
         cursor = conn.cursor()
@@ -30,59 +62,175 @@ def main(test=False, build_tables=False, drop_tables=False):
             print("[SUCCESS] All tables dropped successfully.")
         finally:
             cursor.close()
-            conn.close()
+            db.close()
             if not build_tables:  # Exit if we're only dropping tables
                 return
 
+    # Relative path to the ddl file
+    ddl_path = "src/libraryDDL.sql"
+
     # If informed to do so, create the tables to inhabit the database
     if build_tables: 
-        # Relative path to the ddl file
-        ddl_path = "src/libraryDDL.sql"
-        if not (create_tables(ddl_path)): 
+        if not (create_tables(ddl_path, partition_transactions)): 
             raise Exception("Failed to create tables from DDL file.")
 
     PATH = os.getenv("EXCEL_PATH")
-    
-    SHEET_NAMES = ['Client', 'MediaItem', 'Book', 'Magazine', 'DigitalMedia', 'Transaction']
 
     if not PATH: 
         raise ValueError("EXCEL_PATH is not set in the environment.")
+
+    # Only apply the rows that changed since the last incremental run
+    if incremental:
+        conn, db = open_db_conn()
+        if not conn:
+            raise Exception("Failed to establish database connection for the incremental load.")
+        try:
+            # The manifests live in Load_Manifest, which a database built before it doesn't have
+            if not schema_version.ensure_schema(conn, ddl_path):
+                raise Exception("Failed to bring the schema up to date for the incremental load.")
+            incremental_load(conn, PATH, SHEET_NAMES, TABLE_MAP, map_columns, partial(parse_sheet, cache=cache))
+        finally:
+            db.close()
+        return
+
+    # The tables won't match the incremental manifests once a full load has run
+    if not test:
+        conn, db = open_db_conn()
+        if not conn:
+            raise Exception("Failed to establish database connection for clearing the load manifests.")
+        cursor = conn.cursor()
+        try:
+            clear_manifests(cursor)
+            conn.commit()
+        finally:
+            cursor.close()
+            db.close()
+
+    # Read, parse and load one sheet at a time from a single pass over the workbook
+    if stream:
+        for sheet, chunks in stream_workbook(PATH, SHEET_NAMES):
+            columns, rows = parse_sheet_stream(sheet, chunks)
+            load_sheet(sheet, columns, rows, test, bulk)
+        return
+
+    # Parse sheets in worker processes and load tables with no foreign keys between them side by side
+    if parallel:
+        conn, db = open_db_conn()
+        if not conn:
+            raise Exception("Failed to establish database connection for reading the foreign keys.")
+        cursor = conn.cursor()
+        try:
+            dependencies = table_dependencies(cursor)
+        finally:
+            cursor.close()
+            db.close()
+
+        load = partial(load_sheet, test=test, bulk=bulk)
+        load_in_dependency_order(PATH, SHEET_NAMES, TABLE_MAP, dependencies, partial(parse_sheet, cache=cache), load, workers)
+        return
     
     tables_data = {}
 
     # Parse data    
     for sheet in SHEET_NAMES: 
-        workbook = read_sheet(PATH, sheet)  
-        tables_data[sheet] = parse_workbook(sheet, workbook)            
+        tables_data[sheet] = parse_sheet(PATH, sheet, cache)
+
+    # Drop the rows that would break a constraint before they reach the server
+    if validate:
+        tables_data, rejects = validate_tables(tables_data, SHEET_NAMES, COLUMN_MAP)
+        write_validation_report(tables_data, rejects)
 
     # Populate DB
     for sheet in SHEET_NAMES:     
-        data = tables_data[sheet]
-        if not data: 
-            print(f"[SKIPPED] {sheet}: empty or failed to parse. No rows inserted.")
+        columns, rows = tables_data[sheet]
+        # Validated sheets can't fail a constraint, so each one goes in as a single transaction
+        load_sheet(sheet, columns, rows, test, bulk, single_transaction=validate)
+
+def write_validation_report(tables_data, rejects, rejects_dir=REJECTS_DIR):
+    """Write the rows that failed validation to per-table CSVs plus a JSON summary."""
+    for sheet, rejected in rejects.items():
+        if not rejected:
             continue
-            
-        # Include test routing. Shows data to be inserted to the db, in the correct order
-        if test: 
-            target_table = "Book"
-            populate_table_test(sheet, data, target_table)
-        else:        
-            populate_table(sheet, data) 
+        writer = RejectWriter(rejects_dir, TABLE_MAP[sheet], tables_data[sheet][0], kind="invalid")
+        for row, reason in rejected:
+            writer.write(row, reason)
+        writer.close()
+
+    summary = rejects_summary(rejects)
+    os.makedirs(rejects_dir, exist_ok=True)
+    with open(os.path.join(rejects_dir, "validation_report.json"), 'w') as report_file:
+        json.dump(summary, report_file, indent=4)
+
+    total = sum(sheet['rejected'] for sheet in summary.values())
+    print(f"[INFO] Validation rejected {total} rows, see {rejects_dir}/validation_report.json")
+
+def load_sheet(sheet, columns, rows, test=False, bulk=False, single_transaction=False):
+    """Send a parsed sheet to the loader selected by main."""
+    if not columns or (isinstance(rows, list) and not rows):
+        print(f"[SKIPPED] {sheet}: empty or failed to parse. No rows inserted.")
+        return
+
+    # Include test routing. Shows data to be inserted to the db, in the correct order
+    if test: 
+        target_table = "Book"
+        populate_table_test(sheet, (dict(zip(columns, row)) for row in rows), target_table)
+        return
+
+    # With the whole sheet in hand its months can be created up front, so no row goes through the default partition
+    if sheet == 'Transaction' and isinstance(rows, list) and 'date_borrowed' in columns:
+        index = columns.index('date_borrowed')
+        dates = [row[index] for row in rows if row[index] is not None]
+        if dates:
+            ensure_transaction_partitions(min(dates), max(dates))
+
+    if bulk:
+        bulk_populate_table(sheet, columns, rows, single_transaction=single_transaction)
+    else:        
+        populate_table(sheet, (dict(zip(columns, row)) for row in rows), single_transaction=single_transaction) 
+
+    # Move anything that did land in the default partition into monthly ones
+    if sheet == 'Transaction':
+        ensure_transaction_partitions()
+
+def ensure_transaction_partitions(from_date=None, to_date=None):
+    """Create the monthly Transaction partitions for a date range. Does nothing if Transaction isn't partitioned."""
+    conn, db = open_db_conn()
+
+    if not conn:
+        print("[ERROR] Could not establish a database connection.")
+        return
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT ensure_transaction_partitions(%s::date, %s::date)", (from_date, to_date))
+        created = cursor.fetchone()[0]
+        conn.commit()
+        if created:
+            print(f"[INFO] Created {created} Transaction partitions.")
+    except Exception as e:
+        conn.rollback()
+        print(f"[ERROR] Failed to create Transaction partitions: {e}")
+    finally:
+        cursor.close()
+        db.close()
 
 def open_db_conn(): 
-    """Establish a connection to the PostgreSQL database."""
+    """Check a connection out of the shared PostgreSQL connection pool."""
     try: 
-        db = PostgresDB(password=os.getenv("DB_PASSWORD"))
+        # DB_HOST, DB_NAME and DB_USER can point the scripts at another server, e.g. a local one
+        settings = {key: os.getenv(env) for key, env in (('host', 'DB_HOST'), ('dbname', 'DB_NAME'), ('user', 'DB_USER'))
+                    if os.getenv(env)}
+        db = PostgresDB(password=os.getenv("DB_PASSWORD"), **settings)
         conn = db.connect()
         return conn, db
     except Exception as e:
         print(f"[ERROR] Failed to open DB connection: {e}")
         return None, None
     
-def create_tables(ddl_path) -> bool:
-    """Create database relations by executing the DDL statements."""
+def create_tables(ddl_path, partition_transactions=False) -> bool:
+    """Create database relations by executing the DDL statements, optionally with Transaction partitioned by month."""
     # Open a connection to the database
-    conn, _ = open_db_conn()
+    conn, db = open_db_conn()
 
     if not conn:
         print("[ERROR] Could not establish a database connection.")
@@ -97,6 +245,10 @@ def create_tables(ddl_path) -> bool:
         # Create a cursor object
         cursor = conn.cursor()
 
+        # Read by the DDL when it creates Transaction, LOCAL so it ends with this transaction
+        if partition_transactions:
+            cursor.execute("SET LOCAL libdb.partition_transactions = 'on'")
+
         # Use sqlparse to split the the statements
         # - Sqlparse parses the sql into tokens and understands the structure of the statements 
         # - Better than a split by semicolon, for example
@@ -114,6 +266,11 @@ def create_tables(ddl_path) -> bool:
                 except Exception as e:
                     success = False # Mark failure
                     print(f"[ERROR] Failed to execute statement: {e}")
+
+        # Record the version built so the CLI doesn't apply the file again on startup
+        if success:
+            _, version, fingerprint = schema_version.read_ddl(ddl_path)
+            schema_version.record_version(cursor, version, fingerprint)
         
         conn.commit() # Commit changes
         print("[SUCCESS] Database tables successfully created.\n")
@@ -125,7 +282,7 @@ def create_tables(ddl_path) -> bool:
         if cursor: 
             cursor.close()
         if conn: 
-            conn.close()
+            db.close()
     
     return success
 
@@ -137,52 +294,147 @@ def read_sheet(file_path, excel_sheet_name=None):
         print(f"Failed to read sheet '{excel_sheet_name}': '{e}'")
         return pd.DataFrame() # Return empty dataframe to safely skip
 
-def parse_workbook(table_name, workbook):
-    """Parse a given workbook, store information."""
-    sheet_store = []
+def parse_sheet(file_path, sheet, cache=True):
+    """Read and parse one sheet, returning (columns, row tuples). Reuses the parse of an unchanged workbook."""
+    if cache:
+        cached = sheet_cache.load_sheet(file_path, sheet)
+        if cached is not None:
+            print(f"[INFO] {sheet}: using cached parse.")
+            return cached
 
-    # Store the information as a list of dict objects
-    for _, row in workbook.iterrows(): 
-        # Skip completely empty rows
-        if row.isnull().all():
-            continue
+    workbook = read_sheet(file_path, sheet)
+    columns, rows = parse_workbook_columns(sheet, workbook)
+
+    # A failed read comes back empty, which shouldn't be remembered
+    if cache and columns:
+        sheet_cache.store_sheet(file_path, sheet, columns, rows)
+
+    return columns, rows
 
-        # Skip rows with only occupied cell
-        for index, cell in enumerate(row):
-            if index == 0:
+def stream_workbook(file_path, sheet_names, chunk_size=STREAM_CHUNK_SIZE):
+    """Open the workbook once, read-only, and yield (sheet name, DataFrame chunks) per sheet."""
+    try:
+        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    except Exception as e:
+        print(f"Failed to open workbook '{file_path}': '{e}'")
+        return
+
+    try:
+        for sheet in sheet_names:
+            if sheet not in workbook.sheetnames:
+                print(f"Failed to read sheet '{sheet}': 'Worksheet named {sheet} not found'")
+                yield sheet, iter(())
                 continue
-            if not pd.isnull(cell):
-                break
-        else:
-            continue
+            yield sheet, read_sheet_chunks(workbook[sheet], chunk_size)
+    finally:
+        workbook.close()
+
+def read_sheet_chunks(worksheet, chunk_size=STREAM_CHUNK_SIZE):
+    """Yield a read-only worksheet as DataFrames of at most chunk_size rows."""
+    # Exports from some tools carry stale dimensions, which would cut the read short
+    worksheet.reset_dimensions()
+    rows = worksheet.iter_rows(values_only=True)
+
+    header = list(next(rows, None) or [])
+    while header and header[-1] is None:
+        header.pop()
+    if not header:
+        return
 
-        data = {}
+    # Name blank header cells the way pd.read_excel does
+    columns = [f"Unnamed: {i}" if name is None else str(name) for i, name in enumerate(header)]
+    width = len(columns)
 
-        for col_name in workbook.columns:
-            value = row[col_name]
+    chunk = []
+    for row in rows:
+        row = tuple(row[:width])
+        chunk.append(row + (None,) * (width - len(row)))
+        if len(chunk) >= chunk_size:
+            yield pd.DataFrame.from_records(chunk, columns=columns)
+            chunk = []
 
-            if pd.isna(value):
-                value = None
-            elif isinstance(value, float) and value.is_integer():
-                value = int(value)
-            elif isinstance(value, pd.Timestamp):
-                if pd.isna(value):
-                    value = None
-                elif value.year < 1970: # Check for excel corruption issue (1969-12-31 18:00:00). Was triggered by cell arithmetic
-                    value = None
-                    print(f"[WARNING] Skipping invalid date in column {col_name}. Row: {row}")
-                else: 
-                    value = value.to_pydatetime()
+    if chunk:
+        yield pd.DataFrame.from_records(chunk, columns=columns)
 
-            data[col_name.lower()] = value
+def parse_sheet_stream(table_name, chunks):
+    """Lazily parse a sheet's DataFrame chunks, returning (columns, generator of row tuples)."""
+    chunks = iter(chunks)
+    first = next(chunks, None)
+    if first is None:
+        return [], iter(())
 
-        # ISBN sanitization
-        if 'isbn' in data and data['isbn'] is not None: 
-            data['isbn'] = str(data['isbn']).strip().replace('.0', '')
+    def rows():
+        yield from parse_workbook_columns(table_name, first)[1]
+        for chunk in chunks:
+            yield from parse_workbook_columns(table_name, chunk)[1]
 
-        sheet_store.append(data)
-        
-    return sheet_store
+    return [col_name.lower() for col_name in first.columns], rows()
+
+def parse_workbook(table_name, workbook):
+    """Parse a given workbook, store information."""
+    # Store the information as a list of dict objects
+    return rows_to_dicts(*parse_workbook_columns(table_name, workbook))
+
+def parse_workbook_columns(table_name, workbook):
+    """Parse a given workbook a whole column at a time, returning (columns, row tuples)."""
+    if workbook.empty:
+        return [], []
+
+    # Skip completely empty rows and rows with only the first cell occupied
+    workbook = workbook[workbook.iloc[:, 1:].notna().any(axis=1)]
+
+    columns = [col_name.lower() for col_name in workbook.columns]
+    values = [clean_column(col_name, workbook[col_name]) for col_name in workbook.columns]
+
+    # ISBN sanitization
+    if 'isbn' in columns:
+        index = columns.index('isbn')
+        isbn = values[index]
+        present = isbn.notna()
+        isbn[present] = isbn[present].astype(str).str.strip().str.replace('.0', '', regex=False)
+
+    return columns, list(zip(*(column.tolist() for column in values)))
+
+def clean_column(col_name, column):
+    """Convert a column to python values: NaN to None, whole floats to int, Timestamps to datetime."""
+    missing = column.isna()
+
+    if pd.api.types.is_datetime64_any_dtype(column):
+        # Check for excel corruption issue (1969-12-31 18:00:00). Was triggered by cell arithmetic
+        corrupt = (column.dt.year < 1970) & ~missing
+        if corrupt.any():
+            print(f"[WARNING] Skipping {corrupt.sum()} invalid dates in column {col_name}. Rows: {list(column.index[corrupt])}")
+        cleaned = pd.Series(np.asarray(column.dt.to_pydatetime(), dtype=object), index=column.index, dtype=object)
+        missing |= corrupt
+    elif pd.api.types.is_float_dtype(column):
+        cleaned = column.astype(object)
+        whole = ~missing & (column % 1 == 0)
+        cleaned[whole] = column[whole].astype('int64').astype(object)
+    elif pd.api.types.is_object_dtype(column):
+        # Mixed columns may hold any cell type, so these fall back to a per-cell conversion
+        cleaned = pd.Series([clean_value(value) for value in column], index=column.index, dtype=object)
+    else:
+        cleaned = column.astype(object)
+
+    cleaned[missing] = None
+    return cleaned
+
+def clean_value(value):
+    """Per-cell version of clean_column for mixed-type columns."""
+    if pd.isna(value):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, pd.Timestamp):
+        if value.year < 1970:
+            print(f"[WARNING] Skipping invalid date {value}")
+            return None
+        return value.to_pydatetime()
+    return value
+
+def rows_to_dicts(columns, rows):
+    """Turn parsed (columns, row tuples) back into the per-row dicts insert_row takes."""
+    return [dict(zip(columns, row)) for row in rows]
 
 def populate_table_test(table_name, table_data, target_table, verbose=True): 
     if not target_table.strip(): raise ValueError("Invalid target table name.")
@@ -191,8 +443,11 @@ def populate_table_test(table_name, table_data, target_table, verbose=True):
             print(f"[INSERTED into {table_name}] {row}\n")
       
 
-def populate_table(sheet_name, table_data): 
-    """Populate a table in the PostgreSQL database."""
+def populate_table(sheet_name, table_data, single_transaction=False): 
+    """
+    Populate a table in the PostgreSQL database. Each row is committed on its own unless
+    single_transaction is set, then a failed row is only rolled back to its savepoint.
+    """
     conn, db = open_db_conn()
 
     if not conn:
@@ -203,12 +458,23 @@ def populate_table(sheet_name, table_data):
     
     for row in table_data: 
         try: 
+            if single_transaction:
+                cursor.execute("SAVEPOINT insert_row")
             insert_row(cursor, sheet_name, row)
-            conn.commit() # Commit this row insertion
+            if single_transaction:
+                cursor.execute("RELEASE SAVEPOINT insert_row")
+            else:
+                conn.commit() # Commit this row insertion
             print(f"[INSERTED into {TABLE_MAP[sheet_name]}] {row}")
         except Exception as e: 
-            conn.rollback() # Undo the failed insert
+            if single_transaction:
+                cursor.execute("ROLLBACK TO SAVEPOINT insert_row")
+            else:
+                conn.rollback() # Undo the failed insert
             print(f"[ERROR] Skipping row in {TABLE_MAP[sheet_name]}: {e}")
+
+    if single_transaction:
+        conn.commit()
     
     cursor.close()
     db.close()
@@ -216,11 +482,6 @@ def populate_table(sheet_name, table_data):
 def insert_row(cursor, sheet_name, row_data): 
     """Insert a row into a table in the PostgreSQL database."""
     table_name = TABLE_MAP[sheet_name]
-    
-    # Column name mapping for Transaction table
-    COLUMN_MAP = {
-        'date_returned': 'returned_date'
-    }
 
     # Since the transaction ID is a SERIAL PRIMARY KEY in the ddl, remove manually set ID fields
     if sheet_name == 'Transaction': 
@@ -255,15 +516,148 @@ def insert_row(cursor, sheet_name, row_data):
     # Any error here will bubble up into the populate_table() catch block
     cursor.execute(query, values)
 
+def map_columns(sheet_name, columns):
+    """Resolve sheet columns to table columns, returning (target columns, source indexes)."""
+    target_columns = []
+    indexes = []
+
+    for index, column in enumerate(columns):
+        # Transaction IDs are generated by the SERIAL key, so the sheet's IDs are dropped
+        if sheet_name == 'Transaction' and column.lower() == 'transaction_id':
+            continue
+        target_columns.append(COLUMN_MAP.get(column, column).lower())
+        indexes.append(index)
+
+    return target_columns, indexes
+
+def bulk_populate_table(sheet_name, columns, rows, batch_size=COPY_BATCH_SIZE, rejects_dir=REJECTS_DIR,
+                        single_transaction=False):
+    """
+    Populate a table with COPY ... FROM STDIN, streaming rows (tuples ordered like columns) in batches.
+    Each batch is committed on its own unless single_transaction is set.
+    """
+    table_name = TABLE_MAP[sheet_name]
+    target_columns, indexes = map_columns(sheet_name, columns)
+
+    conn, db = open_db_conn()
+
+    if not conn:
+        print(f"[SKIPPED] {sheet_name}: could not connect to DB.")
+        return
+
+    cursor = conn.cursor()
+    copy_query = sql.SQL("COPY {table} ({fields}) FROM STDIN WITH (FORMAT csv, NULL '\\N')").format(
+            table=sql.Identifier(table_name),
+            fields=sql.SQL(', ').join(sql.Identifier(c) for c in target_columns)
+    ).as_string(conn)
+
+    # The derived tables (B, M, DM) can't be linked to Media_Item without an item id
+    item_id_index = None
+    if sheet_name in ['Book', 'Magazine', 'DigitalMedia'] and 'item_id' in target_columns:
+        item_id_index = target_columns.index('item_id')
+
+    rejects = RejectWriter(rejects_dir, table_name, target_columns)
+    loaded = 0
+
+    try:
+        batch = []
+        for row in rows:
+            values = tuple(row[i] for i in indexes)
+            if item_id_index is not None and values[item_id_index] is None:
+                rejects.write(values, f"{sheet_name} row missing item_id, which is required to link to Media_Item")
+                continue
+
+            batch.append(values)
+            if len(batch) >= batch_size:
+                loaded += copy_batch(cursor, copy_query, batch, rejects)
+                if not single_transaction:
+                    conn.commit() # Commit this batch
+                batch = []
+
+        if batch:
+            loaded += copy_batch(cursor, copy_query, batch, rejects)
+        conn.commit()
+
+        print(f"[SUCCESS] Copied {loaded} rows into {table_name}, {rejects.count} rejected.")
+    except Exception as e:
+        conn.rollback()
+        print(f"[ERROR] Bulk load of {table_name} failed: {e}")
+    finally:
+        rejects.close()
+        cursor.close()
+        db.close()
+
+def copy_batch(cursor, copy_query, batch, rejects):
+    """COPY one batch, bisecting it on failure so only the offending rows are rejected."""
+    cursor.execute("SAVEPOINT copy_batch")
+    try:
+        cursor.copy_expert(copy_query, rows_to_csv(batch))
+        cursor.execute("RELEASE SAVEPOINT copy_batch")
+        return len(batch)
+    except Exception as e:
+        cursor.execute("ROLLBACK TO SAVEPOINT copy_batch")
+        cursor.execute("RELEASE SAVEPOINT copy_batch")
+        if len(batch) == 1:
+            rejects.write(batch[0], ' '.join(str(e).split()))
+            return 0
+
+    # Retry both halves separately, the good rows still go in as COPYs
+    middle = len(batch) // 2
+    return (copy_batch(cursor, copy_query, batch[:middle], rejects)
+            + copy_batch(cursor, copy_query, batch[middle:], rejects))
+
+def rows_to_csv(rows):
+    """Render rows as an in-memory CSV buffer, writing None as the COPY NULL marker."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(['\\N' if value is None else value for value in row])
+    buffer.seek(0)
+    return buffer
+
+class RejectWriter:
+    """Side file collecting the rows that were refused, along with the reason."""
+    def __init__(self, rejects_dir, table_name, columns, kind="rejects"):
+        self.path = os.path.join(rejects_dir, f"{table_name}_{kind}.csv")
+        self.columns = columns
+        self.file = None
+        self.writer = None
+        self.count = 0
+
+    def write(self, row, error):
+        # Only create the file once there is something to put in it
+        if self.file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.file = open(self.path, 'w', newline='')
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(self.columns + ['error'])
+        self.writer.writerow(list(row) + [error])
+        self.count += 1
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            print(f"[WARNING] {self.count} rejected rows written to {self.path}")
+
 def drop_table(cursor, conn): 
     cursor.execute("""
         DROP TABLE IF EXISTS transaction CASCADE;
+        DROP TABLE IF EXISTS client_loan_count CASCADE;
+        DROP TABLE IF EXISTS fee_ledger        CASCADE;
+        DROP TABLE IF EXISTS fee_accrual       CASCADE;
+        DROP TABLE IF EXISTS client_fee_total  CASCADE;
+        DROP TABLE IF EXISTS daily_fee_total   CASCADE;
+        DROP TABLE IF EXISTS membership_limit  CASCADE;
+        DROP TABLE IF EXISTS item_catalog   CASCADE;
         DROP TABLE IF EXISTS book           CASCADE;
         DROP TABLE IF EXISTS magazine       CASCADE;
         DROP TABLE IF EXISTS digital_media  CASCADE;
         DROP TABLE IF EXISTS media_item     CASCADE;
         DROP TABLE IF EXISTS client         CASCADE;
 
+        DROP TABLE IF EXISTS load_manifest     CASCADE;
+        DROP TABLE IF EXISTS schema_version    CASCADE;
+
         DROP TYPE  IF EXISTS availability_status_enum  CASCADE;
         DROP TYPE  IF EXISTS account_status_enum       CASCADE;
         DROP TYPE  IF EXISTS membership_type_enum      CASCADE;
@@ -280,4 +674,22 @@ if __name__ == "__main__":
     # main(drop_tables=True)
     
     # To only build tables:
-    # main(build_tables=True)
\ No newline at end of file
+    # main(build_tables=True)
+
+    # To rebuild with Transaction range partitioned by month of date_borrowed:
+    # main(drop_tables=True, build_tables=True, bulk=True, partition_transactions=True)
+
+    # To load with COPY batches instead of one insert per row:
+    # main(drop_tables=True, build_tables=True, bulk=True)
+
+    # To read the workbook in a single streaming pass with flat memory use:
+    # main(drop_tables=True, build_tables=True, bulk=True, stream=True)
+
+    # To parse in worker processes and load independent tables concurrently:
+    # main(drop_tables=True, build_tables=True, bulk=True, parallel=True)
+
+    # To check the constraints in memory first and load each table in one transaction:
+    # main(drop_tables=True, build_tables=True, bulk=True, validate=True)
+
+    # To sync only what changed since the last incremental load (loans are matched on client, item and date borrowed):
+    # main(incremental=True)
\ No newline at end of file
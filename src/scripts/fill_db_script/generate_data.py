@@ -0,0 +1,233 @@
+"""
+Generate a synthetic library dataset and bulk load it straight into PostgreSQL.
+
+Every row satisfies the constraints in libraryDDL.sql, and the same --seed and --as-of always
+produce the same data. Point the scripts at a local server with DB_HOST / DB_NAME / DB_USER /
+DB_PASSWORD in the environment or .env, for example:
+
+    python src/scripts/fill_db_script/generate_data.py --clients 100000 --items 200000 --transactions 10000000 --truncate
+
+The query plan check (check_query_plans.py) then runs against the loaded data and the script
+exits with an error if a canned query falls back to a sequential scan of Transaction.
+"""
+
+import sys
+import argparse
+import datetime
+import numpy as np
+from dotenv import load_dotenv
+from fill_db import bulk_populate_table, create_tables, ensure_transaction_partitions, open_db_conn
+from delta_ingest import reset_sequences
+
+# Rows generated (and handed to COPY) at a time
+CHUNK_SIZE = 100000
+
+MEMBERSHIP_TYPES = ['Regular', 'Student', 'Senior Citizen', 'Other']
+MEMBERSHIP_MIX = [0.55, 0.25, 0.12, 0.08]
+
+ACCOUNT_STATUSES = ['Active', 'Suspended', 'Inactive']
+ACCOUNT_STATUS_MIX = [0.90, 0.04, 0.06]
+
+# Most popular first, borrowing follows the same order
+GENRES = ['Mystery', 'Romance', 'Thriller', 'Fantasy', 'Science Fiction', 'Horror',
+          'Biography', 'History', 'Young Adult', 'Poetry']
+GENRE_MIX = [0.18, 0.16, 0.14, 0.12, 0.10, 0.09, 0.07, 0.06, 0.05, 0.03]
+
+# Share of the catalog per media type
+ITEM_TYPE_MIX = {'Book': 0.70, 'DigitalMedia': 0.15, 'Magazine': 0.15}
+
+FIRST_NAMES = ['James', 'Mary', 'Robert', 'Patricia', 'John', 'Jennifer', 'Michael', 'Linda', 'David',
+               'Elizabeth', 'William', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah']
+LAST_NAMES = ['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez',
+              'Martinez', 'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Thomas', 'Taylor']
+TITLE_WORDS = ['Silent', 'Hidden', 'Last', 'Broken', 'Golden', 'Midnight', 'Lost', 'Crimson', 'Winter',
+               'River', 'Garden', 'Shadow', 'House', 'Storm', 'Letters', 'Kingdom', 'Secret', 'Road']
+MAGAZINE_TITLES = ['Library Monthly', 'Science Today', 'The Gardener', 'Modern Kitchen', 'Travel Weekly',
+                   'Tech Review', 'History Illustrated', 'Sports Digest']
+
+LOAN_DAYS = 14
+
+def zipf_weights(n, skew):
+    """Probabilities for n ranks where rank r is drawn proportionally to 1 / r^skew."""
+    weights = 1.0 / np.arange(1, n + 1) ** skew
+    return weights / weights.sum()
+
+def to_datetimes(values):
+    """Convert datetime64 values to a list of python datetimes."""
+    return values.astype('datetime64[s]').astype(object).tolist()
+
+def chunks(count):
+    """Yield (start, stop) ranges covering count rows in CHUNK_SIZE steps."""
+    for start in range(0, count, CHUNK_SIZE):
+        yield start, min(start + CHUNK_SIZE, count)
+
+def client_rows(rng, clients):
+    for start, stop in chunks(clients):
+        size = stop - start
+        ids = np.arange(start + 1, stop + 1)
+        membership = rng.choice(MEMBERSHIP_TYPES, size, p=MEMBERSHIP_MIX)
+        status = rng.choice(ACCOUNT_STATUSES, size, p=ACCOUNT_STATUS_MIX)
+        first = rng.choice(FIRST_NAMES, size)
+        last = rng.choice(LAST_NAMES, size)
+        for i in range(size):
+            client_id = int(ids[i])
+            yield (client_id, f"{first[i]} {last[i]}", membership[i], status[i],
+                   f"client{client_id}@example.com", f"555{client_id:010d}")
+
+def media_item_rows(items, open_items):
+    for start, stop in chunks(items):
+        unavailable = open_items[start:stop]
+        for i in range(stop - start):
+            yield (start + i + 1, 'Unavailable' if unavailable[i] else 'Available')
+
+def titled_rows(rng, item_ids, authors, author_weights, as_of, isbn_prefix):
+    """Book / Digital_Media rows, authors drawn with the popularity skew."""
+    for start, stop in chunks(len(item_ids)):
+        ids = item_ids[start:stop]
+        size = len(ids)
+        author = rng.choice(authors, size, p=author_weights)
+        genre = rng.choice(GENRES, size, p=GENRE_MIX)
+        year = as_of.year - np.minimum(rng.geometric(0.08, size) - 1, 120)
+        words = rng.integers(0, len(TITLE_WORDS), (size, 2))
+        for i in range(size):
+            item_id = int(ids[i])
+            yield (item_id, f"{TITLE_WORDS[words[i, 0]]} {TITLE_WORDS[words[i, 1]]} {item_id}", author[i],
+                   f"{isbn_prefix}{item_id:010d}", genre[i], int(year[i]))
+
+def magazine_rows(rng, item_ids, as_of):
+    for start, stop in chunks(len(item_ids)):
+        ids = item_ids[start:stop]
+        size = len(ids)
+        title = rng.choice(MAGAZINE_TITLES, size)
+        age = rng.integers(0, 3650, size)
+        issue = rng.integers(1, 500, size)
+        for i in range(size):
+            yield (int(ids[i]), str(title[i]), as_of.date() - datetime.timedelta(days=int(age[i])), int(issue[i]))
+
+def transaction_rows(rng, clients, items, transactions, open_item_ids, overdue_ratio, history_days, as_of):
+    """
+    Closed loans spread over history_days, followed by one open loan per item in open_item_ids.
+    overdue_ratio is the share of loans returned late, and of open loans already past due.
+    """
+    now = np.datetime64(as_of, 's')
+    client_weights = zipf_weights(clients, 0.6)
+    item_weights = zipf_weights(items, 0.8)
+
+    # Popularity is by rank, shuffle so the busiest clients and items aren't simply the lowest ids
+    client_rank = rng.permutation(clients) + 1
+    item_rank = rng.permutation(items) + 1
+
+    closed = transactions - len(open_item_ids)
+    for start, stop in chunks(closed):
+        size = stop - start
+        client = client_rank[rng.choice(clients, size, p=client_weights)]
+        item = item_rank[rng.choice(items, size, p=item_weights)]
+
+        # Closed loans are at least a loan period old so they could have come back on time
+        borrowed = now - np.timedelta64(LOAN_DAYS * 86400, 's') - rng.integers(0, history_days * 86400, size).astype('timedelta64[s]')
+        expected = borrowed + np.timedelta64(LOAN_DAYS * 86400, 's')
+        late = rng.random(size) < overdue_ratio
+        on_time = borrowed + rng.integers(3600, LOAN_DAYS * 86400, size).astype('timedelta64[s]')
+        overdue = expected + rng.integers(86400, 30 * 86400, size).astype('timedelta64[s]')
+        returned = np.minimum(np.where(late, overdue, on_time), now)
+
+        yield from zip(client.tolist(), item.tolist(), to_datetimes(borrowed), to_datetimes(expected), to_datetimes(returned))
+
+    for start, stop in chunks(len(open_item_ids)):
+        item = open_item_ids[start:stop]
+        size = len(item)
+        client = client_rank[rng.choice(clients, size, p=client_weights)]
+
+        # Past due loans were borrowed more than a loan period ago
+        late = rng.random(size) < overdue_ratio
+        age = np.where(late, rng.integers(LOAN_DAYS * 86400 + 3600, 60 * 86400, size),
+                       rng.integers(0, LOAN_DAYS * 86400 - 3600, size))
+        borrowed = now - age.astype('timedelta64[s]')
+        expected = borrowed + np.timedelta64(LOAN_DAYS * 86400, 's')
+
+        yield from zip(client.tolist(), item.tolist(), to_datetimes(borrowed), to_datetimes(expected), [None] * size)
+
+def generate(clients, items, transactions, seed=447, overdue_ratio=0.1, open_ratio=0.2, history_days=3 * 365,
+             as_of=None, truncate=False, build_tables=False, partition_transactions=False):
+    """Generate and COPY a dataset of the given size into the database from the environment."""
+    load_dotenv()
+    as_of = as_of or datetime.datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    rng = np.random.default_rng(seed)
+
+    if build_tables and not create_tables("src/libraryDDL.sql", partition_transactions):
+        raise Exception("Failed to create tables from DDL file.")
+
+    if truncate:
+        conn, db = open_db_conn()
+        if not conn:
+            raise Exception("Failed to establish database connection for truncating tables.")
+        cursor = conn.cursor()
+        cursor.execute("TRUNCATE transaction, book, magazine, digital_media, media_item, client RESTART IDENTITY CASCADE")
+        conn.commit()
+        cursor.close()
+        db.close()
+
+    # Each item can only be out once, pick the open loans first so availability matches them
+    open_count = min(int(items * open_ratio), transactions)
+    open_item_ids = np.sort(rng.choice(items, open_count, replace=False)) + 1
+    open_items = np.zeros(items, dtype=bool)
+    open_items[open_item_ids - 1] = True
+
+    item_type = rng.choice(list(ITEM_TYPE_MIX), items, p=list(ITEM_TYPE_MIX.values()))
+    item_ids = np.arange(1, items + 1)
+
+    # Stephen King stays the most popular author, the queries look him up by name
+    authors = ['Stephen King'] + [f"{first} {last}" for last in LAST_NAMES for first in FIRST_NAMES]
+    author_weights = zipf_weights(len(authors), 1.1)
+
+    bulk_populate_table('Client', ['client_id', 'name', 'membership_type', 'account_status', 'email_address', 'phone_number'],
+                        client_rows(rng, clients))
+    bulk_populate_table('MediaItem', ['item_id', 'availability_status'], media_item_rows(items, open_items))
+    bulk_populate_table('Book', ['item_id', 'title', 'author', 'isbn', 'genre', 'publication_year'],
+                        titled_rows(rng, item_ids[item_type == 'Book'], authors, author_weights, as_of, '978'))
+    bulk_populate_table('DigitalMedia', ['item_id', 'title', 'author', 'isbn', 'genre', 'publication_year'],
+                        titled_rows(rng, item_ids[item_type == 'DigitalMedia'], authors, author_weights, as_of, '979'))
+    bulk_populate_table('Magazine', ['item_id', 'title', 'publication_date', 'issue_number'],
+                        magazine_rows(rng, item_ids[item_type == 'Magazine'], as_of))
+    # Months the loans span, so COPY routes straight to them instead of through the default partition
+    ensure_transaction_partitions((as_of - datetime.timedelta(days=history_days + LOAN_DAYS)).date(), as_of.date())
+    bulk_populate_table('Transaction', ['client_id', 'item_id', 'date_borrowed', 'expected_return_date', 'returned_date'],
+                        transaction_rows(rng, clients, items, transactions, open_item_ids, overdue_ratio, history_days, as_of))
+
+    conn, db = open_db_conn()
+    if conn:
+        # Ids were written explicitly, then refresh the planner statistics for the new data
+        cursor = conn.cursor()
+        reset_sequences(cursor)
+        cursor.execute("ANALYZE")
+        conn.commit()
+        cursor.close()
+        db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic library dataset and load it with COPY.")
+    parser.add_argument("--clients", type=int, default=10000)
+    parser.add_argument("--items", type=int, default=50000)
+    parser.add_argument("--transactions", type=int, default=1000000)
+    parser.add_argument("--seed", type=int, default=447)
+    parser.add_argument("--overdue-ratio", type=float, default=0.1, help="share of loans returned or still out past due")
+    parser.add_argument("--open-ratio", type=float, default=0.2, help="share of items currently checked out")
+    parser.add_argument("--history-days", type=int, default=3 * 365, help="how far back loans go")
+    parser.add_argument("--as-of", type=datetime.date.fromisoformat, default=None, help="date the data is generated relative to (YYYY-MM-DD)")
+    parser.add_argument("--truncate", action="store_true", help="empty the tables before loading")
+    parser.add_argument("--build-tables", action="store_true", help="run libraryDDL.sql first")
+    parser.add_argument("--partition-transactions", action="store_true", help="with --build-tables, partition Transaction by month")
+    parser.add_argument("--skip-plan-check", action="store_true", help="don't run check_query_plans.py on the loaded data")
+    args = parser.parse_args()
+
+    as_of = datetime.datetime.combine(args.as_of, datetime.time()) if args.as_of else None
+    generate(args.clients, args.items, args.transactions, args.seed, args.overdue_ratio, args.open_ratio,
+             args.history_days, as_of, args.truncate, args.build_tables, args.partition_transactions)
+
+    # Tables of a few thousand rows are read whole by design, skip the check for datasets that small
+    if not args.skip_plan_check:
+        from check_query_plans import check_plans
+        failures = check_plans()
+        if failures:
+            print(f"[ERROR] Sequential scan of Transaction in: {', '.join(failures)}")
+            sys.exit(1)
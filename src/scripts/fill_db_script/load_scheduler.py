@@ -0,0 +1,82 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# Default number of tables loaded (and sheets parsed) at the same time
+PARALLEL_WORKERS = 4
+
+def table_dependencies(cursor):
+    """
+    Read the foreign keys of the tables as built, however they were declared, returning
+    {table: set of referenced tables} for every table on the search path. Partitions are
+    left out, their keys are copies of their parent's.
+    """
+    cursor.execute("""
+        SELECT child.relname, parent.relname
+        FROM pg_class child
+        LEFT JOIN pg_constraint fk ON fk.conrelid = child.oid AND fk.contype = 'f' AND fk.conparentid = 0
+        LEFT JOIN pg_class parent ON parent.oid = fk.confrelid
+        WHERE child.relkind IN ('r', 'p') AND NOT child.relispartition AND pg_table_is_visible(child.oid)
+    """)
+
+    dependencies = {}
+    for table, referenced in cursor.fetchall():
+        dependencies.setdefault(table, set())
+        if referenced and referenced != table:
+            dependencies[table].add(referenced)
+
+    return dependencies
+
+def dependency_levels(sheet_names, table_map, dependencies):
+    """Group sheets into levels, each of which only depends on the levels before it."""
+    missing = [table_map[sheet] for sheet in sheet_names if table_map[sheet] not in dependencies]
+    if missing:
+        raise ValueError(f"Tables not found in the database: {', '.join(missing)}. Build the tables first.")
+
+    remaining = {sheet: {dep for dep in dependencies.get(table_map[sheet], set())
+                         if dep in table_map.values()}
+                 for sheet in sheet_names}
+    loaded = set()
+    levels = []
+
+    while remaining:
+        level = [sheet for sheet in sheet_names if sheet in remaining and remaining[sheet] <= loaded]
+        if not level:
+            raise ValueError(f"Circular foreign keys between: {', '.join(remaining)}")
+        levels.append(level)
+        for sheet in level:
+            loaded.add(table_map[sheet])
+            del remaining[sheet]
+
+    return levels
+
+def load_in_dependency_order(file_path, sheet_names, table_map, dependencies, parse_sheet, load_sheet, workers=PARALLEL_WORKERS):
+    """
+    Parse every sheet in a process pool and load each level of the foreign key graph, as
+    returned by table_dependencies(), concurrently.
+
+    parse_sheet(file_path, sheet) must be a module level function so it can be sent to the
+    worker processes, and returns (columns, rows). load_sheet(sheet, columns, rows) runs on a
+    worker thread and is expected to open its own database connection.
+    """
+    levels = dependency_levels(sheet_names, table_map, dependencies)
+    print(f"[INFO] Load order: {' -> '.join(str(level) for level in levels)}")
+
+    with ProcessPoolExecutor(max_workers=workers) as parsers, ThreadPoolExecutor(max_workers=workers) as loaders:
+        # All parsing starts up front, a level only waits on the sheets it needs
+        parsed = {sheet: parsers.submit(parse_sheet, file_path, sheet) for sheet in sheet_names}
+
+        for level in levels:
+            loads = {}
+            for sheet in level:
+                try:
+                    columns, rows = parsed[sheet].result()
+                except Exception as e:
+                    print(f"[ERROR] Failed to parse {sheet}: {e}")
+                    continue
+                loads[sheet] = loaders.submit(load_sheet, sheet, columns, rows)
+
+            # Wait for the whole level before the tables referencing it start
+            for sheet, future in loads.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"[ERROR] Failed to load {sheet}: {e}")
@@ -0,0 +1,97 @@
+"""
+Schema versioning for libraryDDL.sql.
+
+The DDL file declares its version in a "-- Schema version: N" comment, and the database
+records the version and a fingerprint of the file it was last built from in Schema_Version.
+Checking a schema is then a single query, and the file is only run (in one transaction, under
+an advisory lock so two clients starting together don't both apply it) when either differs.
+"""
+
+import re
+import hashlib
+from psycopg2 import errors
+
+VERSION_PATTERN = re.compile(r"^-- Schema version: (\d+)\s*$", re.MULTILINE)
+
+# Held while the DDL is applied, so concurrent migrations queue instead of racing
+MIGRATION_LOCK = "libdb_schema_migration"
+
+def read_ddl(ddl_path):
+    """Read the DDL file, returning (sql, version, fingerprint)."""
+    with open(ddl_path, 'r') as ddl_file:
+        ddl_content = ddl_file.read()
+
+    match = VERSION_PATTERN.search(ddl_content)
+    if not match:
+        raise ValueError(f"{ddl_path} has no '-- Schema version: N' line")
+
+    # Line endings don't change the schema
+    fingerprint = hashlib.sha256(ddl_content.replace('\r\n', '\n').encode()).hexdigest()
+    return ddl_content, int(match.group(1)), fingerprint
+
+def current_version(cursor):
+    """The (version, fingerprint) recorded in the database, or None if it was never recorded."""
+    # Sent as one round trip, the savepoint keeps the transaction (and any lock) usable if the table is missing
+    try:
+        cursor.execute("SAVEPOINT schema_check; SELECT version, fingerprint FROM Schema_Version")
+    except errors.UndefinedTable:
+        cursor.execute("ROLLBACK TO SAVEPOINT schema_check")
+        return None
+    return cursor.fetchone()
+
+def record_version(cursor, version, fingerprint):
+    cursor.execute("""
+        INSERT INTO Schema_Version (version, fingerprint, applied_at) VALUES (%s, %s, now())
+        ON CONFLICT (id) DO UPDATE
+        SET version = EXCLUDED.version, fingerprint = EXCLUDED.fingerprint, applied_at = EXCLUDED.applied_at
+    """, (version, fingerprint))
+
+def apply_ddl(cursor, ddl_content):
+    """Run every statement of the DDL, stopping at the first one that fails."""
+    # Only needed when migrating, keep it off the startup path
+    import sqlparse
+
+    for statement in sqlparse.split(ddl_content):
+        # Trailing comments come out as a statement of their own
+        if sqlparse.format(statement, strip_comments=True).strip():
+            cursor.execute(statement)
+
+def ensure_schema(connection, ddl_path):
+    """
+    Check the database against the DDL file, applying the file if its version or fingerprint
+    differs from the one recorded. Returns whether the schema is now current.
+    """
+    try:
+        ddl_content, version, fingerprint = read_ddl(ddl_path)
+    except FileNotFoundError:
+        print("DDL file not found")
+        return False
+    except ValueError as e:
+        print(e)
+        return False
+
+    cursor = connection.cursor()
+    try:
+        if current_version(cursor) == (version, fingerprint):
+            connection.commit()
+            print(f"Database schema matches expectation (version {version})")
+            return True
+
+        # Someone may have migrated while this client waited for the lock
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (MIGRATION_LOCK,))
+        if current_version(cursor) == (version, fingerprint):
+            connection.commit()
+            print(f"Database schema matches expectation (version {version})")
+            return True
+
+        apply_ddl(cursor, ddl_content)
+        record_version(cursor, version, fingerprint)
+        connection.commit()
+        print(f"Applied {ddl_path}, database schema is now version {version}")
+        return True
+    except Exception as e:
+        connection.rollback()
+        print(f"Schema migration failed, nothing was applied: {e}")
+        return False
+    finally:
+        cursor.close()
@@ -0,0 +1,91 @@
+import os
+import pickle
+import hashlib
+
+# Directory holding the cached, already parsed sheets
+CACHE_DIR = ".fill_db_cache"
+
+# Upper bound on the cache directory, least recently used entries are evicted past it
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Bump whenever the parse output changes shape so stale entries stop matching
+CACHE_VERSION = 1
+
+def workbook_fingerprint(file_path, hash_contents=False):
+    """Identify a workbook by path, size and mtime, or by its full contents if asked to."""
+    stat = os.stat(file_path)
+    if not hash_contents:
+        return f"{os.path.abspath(file_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as workbook_file:
+        for block in iter(lambda: workbook_file.read(1024 * 1024), b''):
+            digest.update(block)
+    return f"{os.path.abspath(file_path)}:{digest.hexdigest()}"
+
+def cache_path(file_path, sheet, cache_dir=CACHE_DIR, hash_contents=False):
+    key = f"{CACHE_VERSION}:{workbook_fingerprint(file_path, hash_contents)}:{sheet}"
+    return os.path.join(cache_dir, hashlib.sha256(key.encode()).hexdigest() + ".pkl")
+
+def load_sheet(file_path, sheet, cache_dir=CACHE_DIR, hash_contents=False):
+    """
+    Return the cached (columns, rows) for a sheet of this exact workbook, or None. A workbook
+    that can't be found is a miss too, so the caller's read reports it.
+    """
+    try:
+        path = cache_path(file_path, sheet, cache_dir, hash_contents)
+        with open(path, 'rb') as cache_file:
+            entry = pickle.load(cache_file)
+        # Touch the entry so eviction treats it as recently used
+        os.utime(path)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+
+    return entry['columns'], list(zip(*entry['values']))
+
+def store_sheet(file_path, sheet, columns, rows, cache_dir=CACHE_DIR, hash_contents=False, max_bytes=CACHE_MAX_BYTES):
+    """
+    Cache a parsed sheet column by column, then trim the cache back under max_bytes. Skipped
+    if the workbook or the cache directory can't be reached, the parse is still returned.
+    """
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        path = cache_path(file_path, sheet, cache_dir, hash_contents)
+
+        # Written to a temporary name first so a parallel reader never sees half a file
+        with open(path + ".tmp", 'wb') as cache_file:
+            pickle.dump({'columns': columns, 'values': list(zip(*rows))}, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        print(f"[WARNING] {sheet}: parse not cached: {e}")
+        return
+
+    evict(cache_dir, max_bytes)
+
+def evict(cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+    """Remove the least recently used entries until the cache fits in max_bytes."""
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(".pkl"):
+            # Another process may be evicting the same entries
+            try:
+                stat = os.stat(os.path.join(cache_dir, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except FileNotFoundError:
+            pass
+        total -= size
+
+def clear(cache_dir=CACHE_DIR):
+    """Drop every cached sheet."""
+    if os.path.isdir(cache_dir):
+        for name in os.listdir(cache_dir):
+            os.remove(os.path.join(cache_dir, name))
@@ -0,0 +1,146 @@
+import re
+import pandas as pd
+
+# The constraints below mirror libraryDDL.sql, keyed by sheet and using the table's column names
+
+# Columns declared NOT NULL
+NOT_NULL = {
+        'Client'       : ['client_id', 'name', 'membership_type', 'account_status', 'email_address', 'phone_number'],
+        'MediaItem'    : ['item_id', 'availability_status'],
+        'Book'         : ['item_id', 'title', 'author', 'isbn'],
+        'Magazine'     : ['item_id', 'title', 'publication_date', 'issue_number'],
+        'DigitalMedia' : ['item_id', 'title', 'author', 'isbn'],
+        'Transaction'  : ['client_id', 'item_id', 'date_borrowed', 'expected_return_date'],
+    }
+
+# Primary key and UNIQUE columns
+UNIQUE = {
+        'Client'       : ['client_id', 'email_address', 'phone_number'],
+        'MediaItem'    : ['item_id'],
+        'Book'         : ['item_id', 'isbn'],
+        'Magazine'     : ['item_id'],
+        'DigitalMedia' : ['item_id', 'isbn'],
+    }
+
+# Columns typed with an ENUM
+ENUMS = {
+        'Client'       : {'membership_type': {'Regular', 'Student', 'Senior Citizen', 'Other'},
+                          'account_status': {'Active', 'Suspended', 'Inactive'}},
+        'MediaItem'    : {'availability_status': {'Available', 'Unavailable'}},
+    }
+
+# VARCHAR limits
+LENGTHS = {
+        'Client'       : {'name': 50, 'email_address': 50, 'phone_number': 15},
+        'Book'         : {'title': 100, 'author': 100, 'isbn': 20, 'genre': 50},
+        'Magazine'     : {'title': 100},
+        'DigitalMedia' : {'title': 100, 'author': 100, 'isbn': 20, 'genre': 50},
+    }
+
+# Foreign keys as column -> (parent sheet, parent column)
+FOREIGN_KEYS = {
+        'Book'         : {'item_id': ('MediaItem', 'item_id')},
+        'Magazine'     : {'item_id': ('MediaItem', 'item_id')},
+        'DigitalMedia' : {'item_id': ('MediaItem', 'item_id')},
+        'Transaction'  : {'client_id': ('Client', 'client_id'), 'item_id': ('MediaItem', 'item_id')},
+    }
+
+ISBN_PATTERN = re.compile('[1-9]')
+
+def validate_sheet(sheet, columns, rows, column_map, parent_keys):
+    """
+    Check one parsed sheet against the DDL constraints.
+
+    Returns (kept rows, [(row, reason), ...]). Each rule is evaluated over whole columns,
+    and a row is reported against the first rule it breaks.
+    """
+    if not rows:
+        return rows, []
+
+    names = [column_map.get(c, c) for c in columns]
+    frame = pd.DataFrame.from_records(rows, columns=names)
+    reasons = pd.Series(None, index=frame.index, dtype=object)
+
+    def reject(mask, reason):
+        mask = mask & reasons.isna()
+        reasons[mask] = reason
+
+    # Without a required column every row would fail the table, and the rules below can't run
+    missing = [column for column in NOT_NULL.get(sheet, []) if column not in frame]
+    if missing:
+        return [], [(row, f"missing column {', '.join(missing)}") for row in rows]
+
+    for column in NOT_NULL.get(sheet, []):
+        reject(frame[column].isna(), f"null {column}")
+
+    for column, allowed in ENUMS.get(sheet, {}).items():
+        if column in frame:
+            reject(frame[column].notna() & ~frame[column].isin(allowed), f"invalid {column}")
+
+    for column, limit in LENGTHS.get(sheet, {}).items():
+        if column in frame:
+            values = frame[column]
+            reject(values.notna() & (values.astype(str).str.len() > limit), f"{column} longer than {limit}")
+
+    if 'isbn' in frame:
+        isbn = frame['isbn'].astype(str)
+        reject(frame['isbn'].notna() & ((isbn == '0') | ~isbn.str.contains(ISBN_PATTERN)), "isbn fails check (isbn <> '0' AND isbn ~ '[1-9]')")
+
+    for column, (parent, parent_column) in FOREIGN_KEYS.get(sheet, {}).items():
+        if column in frame:
+            reject(frame[column].notna() & ~frame[column].isin(parent_keys.get((parent, parent_column), set())),
+                   f"{column} not present in {parent}")
+
+    if sheet == 'Transaction':
+        borrowed = pd.to_datetime(frame['date_borrowed'])
+        reject(pd.to_datetime(frame['expected_return_date']) <= borrowed, "expected_return_date not after date_borrowed")
+        if 'returned_date' in frame:
+            returned = pd.to_datetime(frame['returned_date'])
+            reject(returned.notna() & (returned <= borrowed), "returned_date not after date_borrowed")
+
+    # Uniqueness is checked last, over the surviving rows, since only those would reach the table
+    for column in UNIQUE.get(sheet, []):
+        if column in frame:
+            values = frame[column].where(reasons.isna())
+            reject(values.notna() & values.duplicated(keep='first'), f"duplicate {column}")
+
+    keep = reasons.isna().tolist()
+    kept = [row for row, ok in zip(rows, keep) if ok]
+    rejected = [(row, reason) for row, ok, reason in zip(rows, keep, reasons.tolist()) if not ok]
+
+    return kept, rejected
+
+def validate_tables(tables_data, sheet_names, column_map):
+    """
+    Validate every parsed sheet, parents before children so foreign keys are checked against
+    the rows that will actually be loaded.
+
+    Returns (validated tables_data, {sheet: [(row, reason), ...]}).
+    """
+    validated = {}
+    rejects = {}
+    parent_keys = {}
+
+    for sheet in sheet_names:
+        columns, rows = tables_data[sheet]
+        kept, rejected = validate_sheet(sheet, columns, rows, column_map, parent_keys)
+        validated[sheet] = (columns, kept)
+        rejects[sheet] = rejected
+
+        # Remember the keys children may reference
+        for column in UNIQUE.get(sheet, []):
+            if column in columns:
+                index = columns.index(column)
+                parent_keys[(sheet, column)] = {row[index] for row in kept}
+
+    return validated, rejects
+
+def rejects_summary(rejects):
+    """Count rejected rows per sheet and reason."""
+    summary = {}
+    for sheet, rejected in rejects.items():
+        counts = {}
+        for _, reason in rejected:
+            counts[reason] = counts.get(reason, 0) + 1
+        summary[sheet] = {'rejected': len(rejected), 'reasons': counts}
+    return summary